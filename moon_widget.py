@@ -1,5 +1,6 @@
 import webview
 import threading
+import multiprocessing
 import time
 import json
 import math
@@ -10,8 +11,22 @@ import os
 import socket
 import requests
 import geoip2.database
+import re
+import bisect
+import hashlib
+import struct
+import mmap
+import csv
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.request import urlopen
 
+try:
+    from zoneinfo import ZoneInfo
+    ZONEINFO_AVAILABLE = True
+except ImportError:
+    ZONEINFO_AVAILABLE = False
+
 # 全局变量
 SKYFIELD_AVAILABLE = False
 ts = None
@@ -20,6 +35,30 @@ sun = None
 moon = None
 earth = None
 HIDE_CONSOLE = False  # 新增：控制是否隐藏控制台窗口的全局变量
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')  # 页面静态资源目录
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'moon_widget_config.json')  # 配置文件
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'moon_widget_snapshot.json')  # 热启动快照
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')  # 离线数据目录（城市表等）
+
+# 联网探测、公网IP和IP定位服务的地址，可在配置文件的"endpoints"中逐项替换（如指向--fault-test的本地替身服务器）
+DEFAULT_ENDPOINTS = {
+    "network_check": "https://www.baidu.com",
+    "public_ip": ["https://api.ipify.org", "https://ident.me", "https://checkip.amazonaws.com"],
+    "ip_location": "https://ipapi.co/{ip}/json/",  # {ip}替换为公网IP
+    "timeout": 3  # 每个请求的超时（秒），公网IP和IP定位请求还以此限制读取响应体的总时长
+}
+
+# 日月食类型代码（search_eclipses的返回值）
+ECLIPSE_TYPES = {
+    0: "日偏食",
+    1: "日环食",
+    2: "日全食",
+    3: "半影月食",
+    4: "月偏食",
+    5: "月全食"
+}
+# 主要月相代码（search_moon_phases的返回值，与almanac.moon_phases一致）
+MOON_PHASE_NAMES = ["新月", "上弦", "满月", "下弦"]
 
 def hide_console_window():
     """隐藏控制台窗口"""
@@ -35,125 +74,2512 @@ def hide_console_window():
         except Exception as e:
             print(f"隐藏控制台窗口失败: {e}")
 
+def minify_asset(content, content_type):
+    """简单压缩HTML/CSS/JS：去掉注释、行首尾空白和空行"""
+    if content_type.startswith("text/css"):
+        content = re.sub(r"/\*.*?\*/", "", content, flags=re.S)
+    elif content_type.startswith("text/html"):
+        content = re.sub(r"<!--.*?-->", "", content, flags=re.S)
+    
+    lines = []
+    for line in content.splitlines():
+        line = line.strip()
+        # JS只去掉整行注释，避免误伤字符串中的//
+        if not line or (content_type.startswith("application/javascript") and line.startswith("//")):
+            continue
+        lines.append(line)
+    return "\n".join(lines)
+
+class MoonDataBroadcaster:
+    """月球数据广播器 - 每次更新只序列化一次，所有订阅者共享同一帧；慢速客户端直接跳到最新帧"""
+    def __init__(self, keepalive_interval=15):
+        self.condition = threading.Condition()
+        self.frame = None  # 最新一帧已编码好的SSE数据
+        self.sequence = 0  # 帧序号，订阅者据此判断是否有新帧
+        self.subscribers = 0
+        self.keepalive_interval = keepalive_interval
+
+    def publish(self, payload):
+        """编码一次并唤醒所有订阅者"""
+        frame = f"data: {encode_payload(payload)}\n\n".encode('utf-8')
+        with self.condition:
+            self.frame = frame
+            self.sequence += 1
+            self.condition.notify_all()
+
+    def wait_frame(self, last_sequence):
+        """等待比last_sequence更新的帧，超时返回(last_sequence, None)用于发送心跳"""
+        with self.condition:
+            if self.sequence == last_sequence or self.frame is None:
+                self.condition.wait(self.keepalive_interval)
+            if self.sequence == last_sequence or self.frame is None:
+                return last_sequence, None
+            return self.sequence, self.frame
+
+    def stream(self, wfile, is_running):
+        """向一个客户端持续写入数据帧，直到连接断开或程序退出"""
+        with self.condition:
+            self.subscribers += 1
+        print(f"新的数据流订阅者，当前 {self.subscribers} 个")
+        try:
+            # 先发送当前最新帧，客户端无需等待下一次更新
+            sequence = -1
+            while is_running():
+                sequence, frame = self.wait_frame(sequence)
+                wfile.write(frame if frame is not None else b": keepalive\n\n")
+                wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+            print(f"数据流订阅者断开，当前 {self.subscribers} 个")
+
+class StaticAssetServer:
+    """本地静态资源服务器 - 资源首次请求时读取并压缩，之后从内存返回，支持ETag缓存"""
+    content_types = {
+        ".html": "text/html; charset=utf-8",
+        ".css": "text/css; charset=utf-8",
+        ".js": "application/javascript; charset=utf-8",
+        ".ico": "image/x-icon"
+    }
+
+    def __init__(self, static_dir, bootstrap_func, host="127.0.0.1", port=0, broadcaster=None, is_running=None,
+                 api_handlers=None):
+        # bootstrap_func返回首帧数据，由/bootstrap.js随页面下发
+        # broadcaster不为空时在/events提供Server-Sent Events数据流
+        # api_handlers为{名称: 无参函数}，在/api/名称以JSON返回结果（页面按需获取的较大数据，如月球轨迹）
+        self.static_dir = static_dir
+        self.bootstrap_func = bootstrap_func
+        self.api_handlers = api_handlers or {}
+        self.broadcaster = broadcaster
+        self.is_running = is_running or (lambda: True)
+        self.assets = {}  # 路径 -> (内容, 类型, ETag)
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://{'127.0.0.1' if host in ('', '0.0.0.0') else host}:{self.httpd.server_address[1]}"
+
+    def load_asset(self, name):
+        """读取并压缩静态资源，结果缓存在内存中"""
+        with self.lock:
+            if name in self.assets:
+                return self.assets[name]
+            
+            path = os.path.normpath(os.path.join(self.static_dir, name))
+            if not path.startswith(os.path.normpath(self.static_dir) + os.sep) or not os.path.isfile(path):
+                return None
+            
+            content_type = self.content_types.get(os.path.splitext(path)[1], "application/octet-stream")
+            if content_type.startswith(("text/", "application/javascript")):
+                with open(path, 'r', encoding='utf-8') as f:
+                    body = minify_asset(f.read(), content_type).encode('utf-8')
+            else:
+                with open(path, 'rb') as f:
+                    body = f.read()
+            
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            self.assets[name] = (body, content_type, etag)
+            return self.assets[name]
+
+    def bootstrap_script(self):
+        """生成首帧数据脚本（不缓存）"""
+        try:
+            data = self.bootstrap_func()
+        except Exception as e:
+            print(f"生成首帧数据失败: {e}")
+            data = None
+        script = f"window.initialMoonData = {json.dumps(data, ensure_ascii=False, default=encode_record)};"
+        if self.broadcaster:
+            # 告诉页面通过数据流接收更新
+            script += 'window.moonStreamUrl = "events";'
+        return script.encode('utf-8')
+
+    def make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.split('?', 1)[0].lstrip('/') or 'moon_widget.html'
+                
+                if name == 'bootstrap.js':
+                    body = server.bootstrap_script()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/javascript; charset=utf-8")
+                    self.send_header("Cache-Control", "no-store")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                
+                if name == 'events' and server.broadcaster:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+                    self.send_header("Cache-Control", "no-store")
+                    self.send_header("Connection", "keep-alive")
+                    self.end_headers()
+                    server.broadcaster.stream(self.wfile, server.is_running)
+                    return
+                
+                if name.startswith('api/') and name[4:] in server.api_handlers:
+                    try:
+                        body = encode_payload(server.api_handlers[name[4:]]()).encode('utf-8')
+                    except Exception as e:
+                        print(f"处理接口请求失败: {e}")
+                        self.send_error(500)
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                    self.send_header("Cache-Control", "no-store")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                
+                asset = server.load_asset(name)
+                if asset is None:
+                    self.send_error(404)
+                    return
+                
+                body, content_type, etag = asset
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Cache-Control", "max-age=86400")
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # 不输出每个请求的日志
+                pass
+
+        return Handler
+
+    def start(self):
+        """在后台线程中启动服务器"""
+        server_thread = threading.Thread(target=self.httpd.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        print(f"静态资源服务器已启动: {self.url}")
+
+    def stop(self):
+        """停止服务器"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class SimulationClock:
+    """可注入的时钟 - 默认返回当前时间，模拟模式下可加速、暂停、倒放和跳转"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rate = 1.0  # 模拟时间相对真实时间的倍速，0为暂停，负数为倒放
+        self.sim_base = None  # 模拟起点（UTC），为None时使用真实时间
+        self.wall_base = 0  # 模拟起点对应的time.monotonic()
+
+    @property
+    def simulated(self):
+        return self.sim_base is not None
+
+    def now(self):
+        """返回当前（模拟）时间，带UTC时区"""
+        with self.lock:
+            if self.sim_base is None:
+                return datetime.now(timezone.utc)
+            return self.sim_base + timedelta(seconds=(time.monotonic() - self.wall_base) * self.rate)
+
+    def set_simulation(self, start=None, rate=None):
+        """进入模拟模式：start为跳转目标时间（为空时从当前模拟时间继续），rate为倍速"""
+        current = self.now()
+        with self.lock:
+            self.sim_base = start if start is not None else current
+            if self.sim_base.tzinfo is None:
+                self.sim_base = self.sim_base.replace(tzinfo=timezone.utc)
+            self.wall_base = time.monotonic()
+            if rate is not None:
+                self.rate = float(rate)
+
+    def reset(self):
+        """回到真实时间"""
+        with self.lock:
+            self.sim_base = None
+            self.rate = 1.0
+
+class EventHorizonCache:
+    """事件时间窗缓存 - 记录已搜索过的时间范围，时间前后跳转时只搜索缺失的部分"""
+    def __init__(self, search_func, chunk=timedelta(hours=24), max_span=timedelta(days=30)):
+        # search_func(start, end)返回按时间排序的[(UTC时间, 值), ...]
+        self.search_func = search_func
+        self.chunk = chunk  # 每次向外扩展的最小长度，避免频繁搜索很短的时间段
+        self.max_span = max_span  # 缓存覆盖的最大时间范围
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """清空缓存（如位置变化时），等待正在进行的ensure完成"""
+        with self.lock:
+            self.start = None
+            self.end = None
+            self.events = []
+            self.searches = 0  # 实际搜索次数，便于诊断
+
+    def search(self, start, end):
+        self.searches += 1
+        return list(self.search_func(start, end))
+
+    def ensure(self, start, end):
+        """确保缓存覆盖[start, end]，只搜索缺失的时间段"""
+        with self.lock:
+            if (self.start is None or self.start - end > self.max_span or
+                    start - self.end > self.max_span):
+                # 没有缓存或跳得太远，直接重新搜索
+                self.events = self.search(start, end + self.chunk)
+                self.start, self.end = start, end + self.chunk
+            else:
+                if start < self.start:
+                    new_start = min(start, self.start - self.chunk)
+                    self.events = self.search(new_start, self.start) + self.events
+                    self.start = new_start
+                if end > self.end:
+                    new_end = max(end, self.end + self.chunk)
+                    self.events = self.events + self.search(self.end, new_end)
+                    self.end = new_end
+                self.events = self.deduplicate(self.events)
+            self.trim(start, end)
+
+    def deduplicate(self, events, tolerance=timedelta(seconds=1)):
+        """去掉分段边界处重复找到的事件"""
+        result = []
+        for event in events:
+            if result and event[0] - result[-1][0] < tolerance and event[1] == result[-1][1]:
+                continue
+            result.append(event)
+        return result
+
+    def trim(self, start, end):
+        """缓存超过最大范围时，丢弃离请求窗口较远的一侧"""
+        if self.end - self.start <= self.max_span:
+            return
+        if start - self.start > self.end - end:
+            self.start = max(self.start, end - self.max_span)
+        else:
+            self.end = min(self.end, start + self.max_span)
+        self.events = [event for event in self.events if self.start <= event[0] <= self.end]
+
+    def between(self, start, end):
+        """返回[start, end]之间的事件"""
+        with self.lock:
+            times = [event[0] for event in self.events]
+            return self.events[bisect.bisect_left(times, start):bisect.bisect_right(times, end)]
+
+class CityIndex:
+    """离线城市索引 - 用于手动输入坐标时的最近城市命名和时区推断
+    
+    城市表优先使用GeoNames的cities15000.txt（需自行下载放入data目录），否则使用自带的cities.csv。
+    首次使用时把城市坐标转换为单位球面向量并构建隐式KD树（按中位数排列的数组），写入二进制索引文件；
+    之后直接内存映射该文件查询，启动时无需解析城市表，单次查询只访问O(log n)个节点，只解码找到的那一条城市记录。
+    """
+    MAGIC = b'MWKD'
+    VERSION = 2
+    HEADER = struct.Struct('<4sIII')  # 标识, 版本, 城市数, 城市信息表偏移
+    NODE = struct.Struct('<fffi')  # x, y, z, 城市编号
+    OFFSET = struct.Struct('<I')  # 城市信息表：count+1个记录偏移，之后是逐条JSON编码的城市记录
+    
+    def __init__(self, data_dir=DATA_DIR):
+        self.sources = [os.path.join(data_dir, 'cities15000.txt'), os.path.join(data_dir, 'cities.csv')]
+        self.index_path = os.path.join(data_dir, 'cities.kdtree')
+        self.lock = threading.Lock()
+        self.mm = None
+        self.count = 0
+        self.table_offset = 0
+        self.error = None
+    
+    @staticmethod
+    def to_vector(latitude, longitude):
+        """经纬度转换为单位球面向量，弦长与大圆距离单调对应，且不存在经度180°处的接缝"""
+        lat = math.radians(latitude)
+        lon = math.radians(longitude)
+        return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+    
+    def read_cities(self, path):
+        """读取城市表，返回[[名称, 国家, 纬度, 经度, 时区], ...]"""
+        cities = []
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith('.txt'):
+                # GeoNames格式：制表符分隔，第2列名称，第5/6列经纬度，第9列国家代码，第18列时区
+                for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+                    if len(row) > 17 and row[17]:
+                        cities.append([row[1], row[8], float(row[4]), float(row[5]), row[17]])
+            else:
+                for row in csv.DictReader(f):
+                    cities.append([row['name'], row['country'], float(row['latitude']),
+                                   float(row['longitude']), row['timezone']])
+        return cities
+    
+    def build(self, source):
+        """由城市表构建KD树索引文件"""
+        cities = self.read_cities(source)
+        points = [self.to_vector(city[2], city[3]) + (i,) for i, city in enumerate(cities)]
+        
+        # 按深度轮换坐标轴，以中位数为根递归排列，查询时由区间[lo, hi)的中点即可还原树结构
+        ordered = []
+        def arrange(items, depth):
+            if not items:
+                return
+            axis = depth % 3
+            items.sort(key=lambda p: p[axis])
+            mid = len(items) // 2
+            arrange(items[:mid], depth + 1)
+            ordered.append(items[mid])
+            arrange(items[mid + 1:], depth + 1)
+        arrange(points, 0)
+        
+        records = [json.dumps(city, ensure_ascii=False, separators=(',', ':')).encode('utf-8') for city in cities]
+        table_offset = self.HEADER.size + self.NODE.size * len(ordered)
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, len(ordered), table_offset))
+            for point in ordered:
+                f.write(self.NODE.pack(*point))
+            position = 0
+            for record in records:
+                f.write(self.OFFSET.pack(position))
+                position += len(record)
+            f.write(self.OFFSET.pack(position))
+            for record in records:
+                f.write(record)
+        os.replace(temp_path, self.index_path)
+        print(f"城市索引已构建: {len(ordered)} 个城市")
+    
+    def open(self):
+        """打开（必要时先构建）索引文件，失败返回False"""
+        with self.lock:
+            if self.mm is not None:
+                return True
+            if self.error:
+                return False
+            try:
+                source = next((path for path in self.sources if os.path.exists(path)), None)
+                if source is None:
+                    raise FileNotFoundError("未找到城市表")
+                if (not os.path.exists(self.index_path) or
+                        os.path.getmtime(self.index_path) < os.path.getmtime(source)):
+                    self.build(source)
+                
+                with open(self.index_path, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, count, table_offset = self.HEADER.unpack_from(mm, 0)
+                if magic != self.MAGIC or version != self.VERSION:
+                    mm.close()
+                    self.build(source)
+                    with open(self.index_path, 'rb') as f:
+                        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    magic, version, count, table_offset = self.HEADER.unpack_from(mm, 0)
+                self.table_offset = table_offset
+                self.count = count
+                self.mm = mm
+                return True
+            except Exception as e:
+                self.error = str(e)
+                print(f"加载离线城市索引失败: {e}")
+                return False
+    
+    def read_city(self, city):
+        """按编号从内存映射中读取一条城市记录[名称, 国家, 纬度, 经度, 时区]"""
+        position = self.table_offset + self.OFFSET.size * city
+        start, = self.OFFSET.unpack_from(self.mm, position)
+        end, = self.OFFSET.unpack_from(self.mm, position + self.OFFSET.size)
+        records = self.table_offset + self.OFFSET.size * (self.count + 1)
+        return json.loads(self.mm[records + start:records + end].decode('utf-8'))
+    
+    def nearest(self, latitude, longitude):
+        """查找距离给定坐标最近的城市，返回{name, country, latitude, longitude, timezone, distance_km}或None"""
+        if not self.open() or self.count == 0:
+            return None
+        query = self.to_vector(latitude, longitude)
+        node = self.NODE
+        mm = self.mm
+        offset = self.HEADER.size
+        best = [float('inf'), -1]
+        
+        def search(lo, hi, depth):
+            if lo >= hi:
+                return
+            mid = (lo + hi) // 2
+            x, y, z, city = node.unpack_from(mm, offset + mid * node.size)
+            dx, dy, dz = query[0] - x, query[1] - y, query[2] - z
+            distance = dx * dx + dy * dy + dz * dz
+            if distance < best[0]:
+                best[0], best[1] = distance, city
+            diff = (dx, dy, dz)[depth % 3]
+            # 先搜索查询点所在一侧，只有分割面比当前最优距离近时才搜索另一侧
+            if diff < 0:
+                search(lo, mid, depth + 1)
+                if diff * diff < best[0]:
+                    search(mid + 1, hi, depth + 1)
+            else:
+                search(mid + 1, hi, depth + 1)
+                if diff * diff < best[0]:
+                    search(lo, mid, depth + 1)
+        
+        search(0, self.count, 0)
+        name, country, city_lat, city_lon, tz = self.read_city(best[1])
+        chord = math.sqrt(best[0])
+        return {
+            "name": name,
+            "country": country,
+            "latitude": city_lat,
+            "longitude": city_lon,
+            "timezone": tz,
+            "distance_km": 2 * 6371.0 * math.asin(min(1.0, chord / 2))
+        }
+
+_timezone_cache = {}
+
+def get_timezone(name):
+    """按名称返回时区对象并缓存
+    
+    优先使用标准库zoneinfo：astimezone由C实现并在时区对象内缓存转换规则，比pytz逐次查表更快；
+    zoneinfo不可用（Python 3.8）或系统缺少时区数据时退回pytz。两者都只用于astimezone，可以互换。
+    """
+    tz = _timezone_cache.get(name)
+    if tz is None:
+        if ZONEINFO_AVAILABLE:
+            try:
+                tz = ZoneInfo(name)
+            except Exception:
+                tz = None
+        if tz is None:
+            tz = pytz.timezone(name)
+        _timezone_cache[name] = tz
+    return tz
+
+class TimezoneIndex:
+    """离线时区边界索引 - 坐标到IANA时区的点在多边形内查询
+    
+    边界数据为简化后的GeoJSON（如timezone-boundary-builder发布的timezones-now.geojson经mapshaper简化），
+    放在data/timezones.geojson，首次查询时加载。多边形按外包框登记到1°网格，查询只对所在网格的候选多边形
+    做射线法判断（即使候选全属同一时区，网格内的近海点也可能不在多边形内），结果按约1km的细网格缓存。
+    """
+    def __init__(self, data_dir=DATA_DIR, fine_cell=0.01, max_cached_cells=4096):
+        self.path = os.path.join(data_dir, 'timezones.geojson')
+        self.fine_cell = fine_cell
+        self.max_cached_cells = max_cached_cells
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.polygons = []  # [(时区, 外包框(最小经度, 最小纬度, 最大经度, 最大纬度), [外环, 内环...]), ...]
+        self.grid = {}  # (纬度格, 经度格) -> 候选多边形编号列表
+        self.cell_cache = {}  # 细网格 -> 时区或None
+    
+    @property
+    def available(self):
+        return self.load()
+    
+    def load(self):
+        """加载边界数据并建立网格索引，数据不存在或加载失败返回False"""
+        with self.lock:
+            if self.loaded:
+                return bool(self.polygons)
+            self.loaded = True
+            if not os.path.exists(self.path):
+                return False
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    features = json.load(f).get('features', [])
+                for feature in features:
+                    tzid = (feature.get('properties') or {}).get('tzid')
+                    geometry = feature.get('geometry') or {}
+                    if not tzid or geometry.get('type') not in ('Polygon', 'MultiPolygon'):
+                        continue
+                    parts = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+                    for rings in parts:
+                        rings = [[(float(point[0]), float(point[1])) for point in ring] for ring in rings if ring]
+                        if not rings:
+                            continue
+                        lons = [point[0] for point in rings[0]]
+                        lats = [point[1] for point in rings[0]]
+                        bbox = (min(lons), min(lats), max(lons), max(lats))
+                        polygon_id = len(self.polygons)
+                        self.polygons.append((tzid, bbox, rings))
+                        for lat_cell in range(math.floor(bbox[1]), math.floor(bbox[3]) + 1):
+                            for lon_cell in range(math.floor(bbox[0]), math.floor(bbox[2]) + 1):
+                                self.grid.setdefault((lat_cell, lon_cell), []).append(polygon_id)
+                print(f"时区边界已加载: {len(self.polygons)} 个多边形")
+            except Exception as e:
+                print(f"加载时区边界失败: {e}")
+                self.polygons = []
+                self.grid = {}
+            return bool(self.polygons)
+    
+    @staticmethod
+    def point_in_ring(lon, lat, ring):
+        """射线法判断点是否在环内"""
+        inside = False
+        x1, y1 = ring[-1]
+        for x2, y2 in ring:
+            if (y1 > lat) != (y2 > lat) and lon < (x2 - x1) * (lat - y1) / (y2 - y1) + x1:
+                inside = not inside
+            x1, y1 = x2, y2
+        return inside
+    
+    def lookup(self, latitude, longitude):
+        """返回坐标所在的IANA时区，数据不可用或不在任何多边形内（如公海）返回None"""
+        if not self.load():
+            return None
+        candidates = self.grid.get((math.floor(latitude), math.floor(longitude)))
+        if not candidates:
+            return None
+        
+        key = (math.floor(latitude / self.fine_cell), math.floor(longitude / self.fine_cell))
+        if key in self.cell_cache:
+            return self.cell_cache[key]
+        
+        result = None
+        for polygon_id in candidates:
+            tzid, bbox, rings = self.polygons[polygon_id]
+            if not (bbox[0] <= longitude <= bbox[2] and bbox[1] <= latitude <= bbox[3]):
+                continue
+            if self.point_in_ring(longitude, latitude, rings[0]) and \
+                    not any(self.point_in_ring(longitude, latitude, hole) for hole in rings[1:]):
+                result = tzid
+                break
+        
+        if len(self.cell_cache) >= self.max_cached_cells:
+            self.cell_cache.clear()
+        self.cell_cache[key] = result
+        return result
+
+class WatchLocation:
+    """关注城市 - 缓存与位置有关的常量（站心改正系数、时区）和该城市的月出月落时间窗"""
+    def __init__(self, location, search_func):
+        self.location = location
+        self.name = location["name"]
+        self.tz = get_timezone(location["timezone"])
+        
+        # 站心视差改正所需的ρsinφ'和ρcosφ'（海拔按0计算，见Meeus《天文算法》第11章）
+        phi = math.radians(location["latitude"])
+        u = math.atan(0.99664719 * math.tan(phi))
+        self.rho_sin_phi = 0.99664719 * math.sin(u)
+        self.rho_cos_phi = math.cos(u)
+        self.sin_lat = math.sin(phi)
+        self.cos_lat = math.cos(phi)
+        self.longitude = location["longitude"]
+        
+        # 该城市的月出月落缓存，search_func(location, start, end)
+        self.event_cache = EventHorizonCache(lambda start, end: search_func(location, start, end))
+
+    def topocentric_altaz(self, ra_hours, dec_degrees, distance_km, gast_hours):
+        """由地心视赤经赤纬（当天历元）计算本地站心高度角和方位角（度）"""
+        ra = math.radians(ra_hours * 15)
+        dec = math.radians(dec_degrees)
+        hour_angle = math.radians(gast_hours * 15 + self.longitude) - ra
+        sin_parallax = 6378.14 / distance_km
+        
+        # 视差改正（Meeus第40章）
+        cos_dec = math.cos(dec)
+        denominator = cos_dec - self.rho_cos_phi * sin_parallax * math.cos(hour_angle)
+        delta_ra = math.atan2(-self.rho_cos_phi * sin_parallax * math.sin(hour_angle), denominator)
+        dec_topo = math.atan2((math.sin(dec) - self.rho_sin_phi * sin_parallax) * math.cos(delta_ra), denominator)
+        hour_angle_topo = hour_angle - delta_ra
+        
+        sin_dec_topo = math.sin(dec_topo)
+        cos_dec_topo = math.cos(dec_topo)
+        cos_hour_angle = math.cos(hour_angle_topo)
+        altitude = math.asin(self.sin_lat * sin_dec_topo + self.cos_lat * cos_dec_topo * cos_hour_angle)
+        azimuth = math.atan2(-cos_dec_topo * math.sin(hour_angle_topo),
+                             sin_dec_topo * self.cos_lat - cos_dec_topo * self.sin_lat * cos_hour_angle)
+        return math.degrees(altitude), math.degrees(azimuth) % 360
+
+    def next_event(self, now_utc):
+        """下一次月出或月落，返回(类型, 本地时间)或None"""
+        self.event_cache.ensure(now_utc, now_utc + timedelta(hours=48))
+        for event_time, kind in self.event_cache.between(now_utc, now_utc + timedelta(hours=48)):
+            return kind, event_time.astimezone(self.tz)
+        return None
+
+class EphemerisLoader:
+    """星历数据单飞加载器 - 同一时间只允许一个加载线程，失败后按指数退避重试"""
+    def __init__(self, load_func, min_retry_delay=5, max_retry_delay=300):
+        # load_func返回True表示成功，返回False表示无需重试的失败，抛出异常表示可重试的失败
+        self.load_func = load_func
+        self.min_retry_delay = min_retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lock = threading.Lock()
+        self.idle = threading.Event()  # 没有加载任务在进行时处于置位状态
+        self.idle.set()
+        self.loading = False
+        self.failures = 0  # 连续失败次数，用于计算退避时间
+        self.retry_timer = None
+        self.generation = 0  # 每次启动加载时递增，被放弃的旧加载线程结束时不再修改状态
+        self.started_at = None
+
+    def start(self, force=False):
+        """启动加载，已有加载在进行时直接返回False；force为True时跳过退避等待"""
+        with self.lock:
+            if self.loading:
+                return False
+            if self.retry_timer is not None:
+                if not force:
+                    # 正在退避等待中，交给定时器重试
+                    return False
+                self.retry_timer.cancel()
+                self.retry_timer = None
+            self.loading = True
+            self.idle.clear()
+            self.generation += 1
+            self.started_at = time.monotonic()
+            generation = self.generation
+
+        loader_thread = threading.Thread(target=self.run, args=(generation,))
+        loader_thread.daemon = True
+        loader_thread.start()
+        return True
+
+    def run(self, generation):
+        """加载线程主体"""
+        retry = False
+        try:
+            self.load_func()
+        except Exception as e:
+            print(f"星历数据加载失败: {e}")
+            retry = True
+
+        with self.lock:
+            if generation != self.generation:
+                print("已放弃的星历加载线程结束")
+                return
+            self.loading = False
+            if retry:
+                self.failures += 1
+                delay = min(self.min_retry_delay * 2 ** (self.failures - 1), self.max_retry_delay)
+                print(f"{delay}秒后重试加载星历数据（第{self.failures}次失败）")
+                self.retry_timer = threading.Timer(delay, self.retry)
+                self.retry_timer.daemon = True
+                self.retry_timer.start()
+            else:
+                self.failures = 0
+            self.idle.set()
+
+    def retry(self):
+        """退避定时器到期后重新加载"""
+        with self.lock:
+            self.retry_timer = None
+        self.start()
+
+    def wait(self, timeout=None):
+        """等待当前加载结束，超时返回False"""
+        return self.idle.wait(timeout)
+
+    def deadline(self, timeout):
+        """正在加载时返回应完成加载的时间（单调时钟），供看门狗判断加载线程是否卡住"""
+        with self.lock:
+            return self.started_at + timeout if self.loading else None
+
+    def abandon(self):
+        """放弃卡住的加载线程（无法从外部终止）并立即重新加载"""
+        with self.lock:
+            self.loading = False
+            self.generation += 1
+            self.idle.set()
+        self.start(force=True)
+
+@dataclass
+class MoonEvents:
+    """本地月球事件 - 页面显示的字符串和下一次月出月落的本地时间（用__slots__，不为每条记录分配字典）"""
+    __slots__ = ("moonrise", "moonset", "first_event", "first_time", "second_event", "second_time",
+                 "transit_time", "max_altitude", "viewing_window", "moonrise_dt", "moonset_dt")
+    moonrise: str
+    moonset: str
+    first_event: str
+    first_time: str
+    second_event: str
+    second_time: str
+    transit_time: str
+    max_altitude: str
+    viewing_window: str
+    moonrise_dt: datetime
+    moonset_dt: datetime
+
+    @classmethod
+    def placeholder(cls, message):
+        """无法计算时的占位记录，message显示在月出月落时间处"""
+        return cls("--:--", "--:--", "月出", message, "月落", message, "--", "--", "--", None, None)
+
+    def to_payload(self):
+        """转换为可写入JSON的字典（热启动快照）"""
+        payload = {name: getattr(self, name) for name in self.__slots__}
+        for key in ("moonrise_dt", "moonset_dt"):
+            if payload[key] is not None:
+                payload[key] = payload[key].isoformat()
+        return payload
+
+    @classmethod
+    def from_payload(cls, payload):
+        """to_payload的逆过程，缺少的字段（旧版本快照）按占位值处理"""
+        values = dict(cls.placeholder("--").to_payload(), **payload)
+        for key in ("moonrise_dt", "moonset_dt"):
+            if values[key]:
+                values[key] = datetime.fromisoformat(values[key])
+        return cls(*(values[name] for name in cls.__slots__))
+
+@dataclass
+class EclipseEvent:
+    """一条本地化的日月食事件，contacts为((名称, 本地时间, 高度角), ...)"""
+    __slots__ = ("time", "type", "raw_type", "time_utc", "magnitude", "visible", "contacts")
+    time: str
+    type: str
+    raw_type: int
+    time_utc: str
+    magnitude: float
+    visible: bool
+    contacts: tuple
+
+    def to_payload(self):
+        """页面使用的字典格式（推送和快照时由encode_record转换）"""
+        return {
+            "time": self.time,
+            "type": self.type,
+            "raw_type": self.raw_type,
+            "time_utc": self.time_utc,
+            "is_lunar": self.raw_type >= 3,
+            "magnitude": self.magnitude,
+            "visible": self.visible,
+            "contacts": [{"name": name, "time": time_str, "altitude": altitude}
+                         for name, time_str, altitude in self.contacts]
+        }
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(payload["time"], payload["type"], payload["raw_type"], payload["time_utc"],
+                   payload["magnitude"], payload["visible"],
+                   tuple((contact["name"], contact["time"], contact["altitude"]) for contact in payload["contacts"]))
+
+def encode_record(value):
+    """JSON编码的default钩子：把事件记录（MoonEvents、EclipseEvent）转换为字典"""
+    if hasattr(value, "to_payload"):
+        return value.to_payload()
+    raise TypeError(f"无法编码的类型: {type(value).__name__}")
+
+# 每次推送都会发送的字段，MoonPayloadBuilder预先分配并复用
+PAYLOAD_FIELDS = (
+    "timestamp", "utc_offset", "clock_rate", "ra", "dec", "distance", "altitude", "azimuth", "phase",
+    "location", "longitude", "latitude", "timezone",
+    "moonrise", "moonset", "first_event", "first_time", "second_event", "second_time",
+    "transit_time", "max_altitude", "viewing_window",
+    "disc", "visibility", "online", "eclipses", "eclipse_days", "skyfield_available", "skyfield_error", "track_key", "watchlist",
+    "keyframe", "stale", "snapshot_time"
+)
+
+# 紧凑JSON编码器，避免每次调用json.dumps时重新创建编码器
+COMPACT_JSON_ENCODER = json.JSONEncoder(separators=(',', ':'), default=encode_record)
+
+def encode_payload(payload):
+    """编码月球数据负载为紧凑JSON（供evaluate_js、SSE和HTTP接口使用）"""
+    return COMPACT_JSON_ENCODER.encode(payload)
+
+class MoonPayloadBuilder:
+    """月球数据负载构建器 - 按位置缓存格式化好的静态字段，每次更新复用同一个字典"""
+    def __init__(self):
+        self.payload = dict.fromkeys(PAYLOAD_FIELDS)
+        self.location_key = None
+
+    def set_location(self, location):
+        """位置变化时才重新格式化位置相关字段"""
+        key = (location["name"], location["latitude"], location["longitude"], location["timezone"])
+        if key == self.location_key:
+            return
+        self.location_key = key
+        
+        payload = self.payload
+        payload["location"] = location["name"]
+        # 经度显示，正数为东经(E)，负数为西经(W)
+        payload["longitude"] = f"{abs(location['longitude']):.4f}°{'E' if location['longitude'] >= 0 else 'W'}"
+        # 纬度显示，正数为北纬(N)，负数为南纬(S)
+        payload["latitude"] = f"{abs(location['latitude']):.4f}°{'N' if location['latitude'] >= 0 else 'S'}"
+        payload["timezone"] = location["timezone"]
+
+    def build(self, now_local, moon_pos, phase, moon_events, visibility, online, eclipses,
+              skyfield_available, skyfield_error, clock_rate=1.0, track_key=None, watchlist=None, eclipse_days=7,
+              disc=None):
+        """填充快速变化的字段并返回复用的负载字典（数值字段由页面负责格式化）"""
+        payload = self.payload
+        payload["timestamp"] = now_local.timestamp() * 1000  # 毫秒时间戳
+        payload["utc_offset"] = now_local.utcoffset().total_seconds() / 60  # 时区偏移（分钟），供页面本地走时
+        payload["clock_rate"] = clock_rate  # 时钟倍速，模拟模式下页面按此倍速走时
+        payload["ra"] = moon_pos["ra"]  # 赤经（时）
+        payload["dec"] = moon_pos["dec"]  # 赤纬（度）
+        payload["distance"] = moon_pos["distance"]  # 地月距离（km）
+        payload["altitude"] = moon_pos["altitude"]  # 高度角（度）
+        payload["azimuth"] = moon_pos["azimuth"]  # 方位角（度），方向由页面计算
+        payload["phase"] = phase
+        payload["disc"] = disc  # 月面绘制参数（亮面比例、亮边方向、天平动），不可用时为None
+        payload["moonrise"] = moon_events.moonrise
+        payload["moonset"] = moon_events.moonset
+        payload["first_event"] = moon_events.first_event
+        payload["first_time"] = moon_events.first_time
+        payload["second_event"] = moon_events.second_event
+        payload["second_time"] = moon_events.second_time
+        payload["transit_time"] = moon_events.transit_time
+        payload["max_altitude"] = moon_events.max_altitude
+        payload["viewing_window"] = moon_events.viewing_window
+        payload["visibility"] = visibility
+        payload["online"] = online
+        payload["eclipses"] = eclipses
+        payload["eclipse_days"] = eclipse_days  # 日月食搜索窗口（天），用于页面标题
+        payload["skyfield_available"] = skyfield_available
+        payload["skyfield_error"] = skyfield_error
+        payload["track_key"] = track_key  # 月球轨迹键，变化时页面重新获取轨迹
+        payload["watchlist"] = watchlist or []  # 关注城市（高度角、方位角为数值）
+        payload["keyframe"] = None
+        payload["stale"] = False  # 实时计算的数据；热启动快照中的首帧为True
+        payload["snapshot_time"] = None
+        return payload
+
+def benchmark_payload(ticks=10000):
+    """微基准：对比旧的推送路径（逐次f-string建字典 + json.dumps）与现在的推送路径
+    （MoonPayloadBuilder构建 + update_moon_data发布的浅拷贝 + 紧凑JSON编码）每次的内存分配和耗时
+    
+    每次推送的分配量用tracemalloc的峰值减去推送前的已分配量得到（需要Python 3.9+的reset_peak），
+    保留量为全部推送结束后仍未释放的内存。
+    """
+    import tracemalloc
+    
+    location = {"name": "Shanghai, China", "latitude": 31.2222, "longitude": 121.4581, "timezone": "Asia/Shanghai"}
+    moon_events = MoonEvents("18:02", "06:41", "月出", "10月18日 18:02", "月落", "10月19日 06:41",
+                             "--", "--", "--", None, None)
+    moon_pos = {"ra": 5.4321, "dec": 21.2345, "distance": 384400.4, "altitude": 35.12, "azimuth": 120.45}
+    now_local = datetime.now(timezone(timedelta(hours=8)))
+    directions = ["北", "东北", "东", "东南", "南", "西南", "西", "西北"]
+
+    def legacy_build():
+        azimuth_direction = directions[round(moon_pos['azimuth'] / 45) % 8]
+        return {
+            "time": now_local.strftime("%Y-%m-%d %H:%M:%S"),
+            "ra": f"{moon_pos['ra']:.2f}时",
+            "dec": f"{moon_pos['dec']:.2f}°",
+            "distance": f"{moon_pos['distance']:.0f} km",
+            "altitude": f"{moon_pos['altitude']:.1f}°",
+            "azimuth": f"{moon_pos['azimuth']:.1f}° ({azimuth_direction})",
+            "phase": 0.25,
+            "location": location["name"],
+            "longitude": f"{abs(location['longitude']):.4f}°{'E' if location['longitude'] >= 0 else 'W'}",
+            "latitude": f"{abs(location['latitude']):.4f}°{'N' if location['latitude'] >= 0 else 'S'}",
+            "moonrise": moon_events.moonrise,
+            "moonset": moon_events.moonset,
+            "first_event": moon_events.first_event,
+            "first_time": moon_events.first_time,
+            "second_event": moon_events.second_event,
+            "second_time": moon_events.second_time,
+            "visibility": "可见",
+            "online": True,
+            "timezone": location["timezone"],
+            "eclipses": [],
+            "skyfield_available": True,
+            "skyfield_error": None
+        }
+
+    builder = MoonPayloadBuilder()
+
+    def legacy_push():
+        return json.dumps(legacy_build())
+
+    def builder_push():
+        builder.set_location(location)
+        payload = builder.build(now_local, moon_pos, 0.25, moon_events, "可见", True, [], True, None)
+        return encode_payload(dict(payload))
+
+    if not hasattr(tracemalloc, "reset_peak"):
+        print("负载基准需要Python 3.9+（tracemalloc.reset_peak）")
+        return None
+    cases = (
+        ("旧推送路径", legacy_push),
+        ("构建器+拷贝+编码", builder_push)
+    )
+    results = {}
+    for name, push in cases:
+        push()  # 预热，同时让构建器缓存静态字段
+        
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        allocated = 0
+        for _ in range(ticks):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            push()
+            allocated += tracemalloc.get_traced_memory()[1] - before
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        
+        # 不开tracemalloc时的耗时
+        start = time.perf_counter()
+        for _ in range(ticks):
+            push()
+        elapsed = time.perf_counter() - start
+        
+        results[name] = {"bytes_per_tick": allocated / ticks, "retained_bytes": retained,
+                         "us_per_tick": elapsed / ticks * 1e6}
+        print(f"{name}: 每次推送峰值分配 {allocated / ticks:.0f} 字节, 结束后保留 {retained} 字节, "
+              f"耗时 {elapsed / ticks * 1e6:.2f} 微秒")
+    legacy, current = results["旧推送路径"], results["构建器+拷贝+编码"]
+    print(f"相对旧推送路径: 分配 {current['bytes_per_tick'] / legacy['bytes_per_tick'] * 100:.0f}%, "
+          f"耗时 {current['us_per_tick'] / legacy['us_per_tick'] * 100:.0f}%")
+    return results
+
+def read_rss_mb():
+    """当前进程的常驻内存（MB），无法读取时返回None"""
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            from ctypes import wintypes
+            
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                            ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                            ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+            
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize / 1048576
+            return None
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576
+    except Exception as e:
+        print(f"读取进程内存失败: {e}")
+        return None
+
+# 可配置项：名称 -> 类型与取值范围
+CONFIG_SCHEMA = {
+    "refresh_mode": {"type": str, "choices": ("fixed", "adaptive", "keyframe")},  # 刷新模式
+    "update_interval": {"type": float, "min": 0.1, "max": 3600},  # fixed模式的刷新间隔（秒）
+    "min_update_interval": {"type": float, "min": 0.1, "max": 3600},  # 最短刷新间隔（秒）
+    "max_update_interval": {"type": float, "min": 0.1, "max": 3600},  # 窗口可见时的最长刷新间隔（秒）
+    "hidden_update_interval": {"type": float, "min": 1, "max": 86400},  # 窗口隐藏时的刷新间隔（秒）
+    "keyframe_span": {"type": float, "min": 10, "max": 86400},  # 关键帧时间跨度（秒）
+    "keyframe_refresh": {"type": float, "min": 5, "max": 86400},  # 关键帧推送间隔（秒）
+    "location_check_interval": {"type": float, "min": 1, "max": 86400},  # IP定位检查间隔（秒）
+    "moon_events_interval": {"type": float, "min": 1, "max": 86400},  # 月出月落刷新间隔（计算时钟秒）
+    "eclipse_interval": {"type": float, "min": 60, "max": 604800},  # 日月食刷新间隔（计算时钟秒）
+    "network_check_interval": {"type": float, "min": 1, "max": 3600},  # 网络探测间隔（秒）
+    "moon_event_horizon_hours": {"type": float, "min": 24, "max": 720},  # 月出月落搜索窗口（小时）
+    "eclipse_horizon_days": {"type": float, "min": 1, "max": 365},  # 日月食搜索窗口（天）
+    "power_saving": {"type": str, "choices": ("auto", "off")},  # 按电池和空闲状态自动降低刷新频率
+    "idle_reduce_minutes": {"type": float, "min": 1, "max": 1440},  # 空闲多久后进入reduced省电档（分钟）
+    "idle_suspend_minutes": {"type": float, "min": 1, "max": 1440},  # 空闲多久后进入suspended省电档（分钟）
+    "low_battery_percent": {"type": float, "min": 0, "max": 100},  # 电池放电且电量低于此值时进入suspended省电档
+    "watchdog_timeout": {"type": float, "min": 30, "max": 3600},  # 后台线程每轮计算/联网的最长耗时，超过后由看门狗接替（秒）
+}
+
+# 命名的性能配置，配置文件中的"settings"可在所选配置的基础上逐项覆盖
+PERFORMANCE_PROFILES = {
+    # 默认：桌面小部件
+    "default": {
+        "refresh_mode": "adaptive",
+        "update_interval": 1,
+        "min_update_interval": 1,
+        "max_update_interval": 10,
+        "hidden_update_interval": 60,
+        "keyframe_span": 300,
+        "keyframe_refresh": 240,
+        "location_check_interval": 1800,  # 网络变化由NetworkChangeWatcher即时发现，这里只是兜底
+        "moon_events_interval": 60,
+        "eclipse_interval": 3600,
+        "network_check_interval": 5,
+        "moon_event_horizon_hours": 72,
+        "eclipse_horizon_days": 7,
+        "power_saving": "auto",
+        "idle_reduce_minutes": 10,
+        "idle_suspend_minutes": 60,
+        "low_battery_percent": 15,
+        "watchdog_timeout": 180,
+    },
+    # 低功耗：笔记本电脑，减少唤醒和联网次数
+    "low_power": {
+        "refresh_mode": "keyframe",
+        "update_interval": 5,
+        "min_update_interval": 2,
+        "max_update_interval": 60,
+        "hidden_update_interval": 300,
+        "keyframe_span": 600,
+        "keyframe_refresh": 540,
+        "location_check_interval": 3600,
+        "moon_events_interval": 300,
+        "eclipse_interval": 21600,
+        "network_check_interval": 60,
+        "moon_event_horizon_hours": 72,
+        "eclipse_horizon_days": 7,
+        "power_saving": "auto",
+        "idle_reduce_minutes": 3,
+        "idle_suspend_minutes": 30,
+        "low_battery_percent": 30,
+        "watchdog_timeout": 180,
+    },
+    # 看板：固定安装、常亮显示，位置几乎不变，日月食看得更远
+    "wallboard": {
+        "refresh_mode": "adaptive",
+        "update_interval": 1,
+        "min_update_interval": 1,
+        "max_update_interval": 10,
+        "hidden_update_interval": 10,
+        "keyframe_span": 300,
+        "keyframe_refresh": 240,
+        "location_check_interval": 3600,
+        "moon_events_interval": 60,
+        "eclipse_interval": 3600,
+        "network_check_interval": 30,
+        "moon_event_horizon_hours": 72,
+        "eclipse_horizon_days": 30,
+        "power_saving": "off",  # 看板无人操作也需要保持刷新
+        "idle_reduce_minutes": 10,
+        "idle_suspend_minutes": 60,
+        "low_battery_percent": 15,
+        "watchdog_timeout": 180,
+    },
+}
+
+def validate_settings(config, profile=None):
+    """按CONFIG_SCHEMA校验配置，返回(配置项字典, 错误列表)
+    
+    先取profile（参数优先，其次配置文件中的"profile"，默认"default"）对应的性能配置，再用"settings"逐项覆盖；
+    无效的项保留性能配置中的值并记录错误，不会使整个配置失效。
+    """
+    errors = []
+    profile = profile or config.get("profile") or "default"
+    if profile not in PERFORMANCE_PROFILES:
+        errors.append(f"未知的性能配置: {profile}")
+        profile = "default"
+    settings = dict(PERFORMANCE_PROFILES[profile])
+    
+    overrides = config.get("settings") or {}
+    if not isinstance(overrides, dict):
+        errors.append("settings必须是对象")
+        overrides = {}
+    for name, value in overrides.items():
+        rule = CONFIG_SCHEMA.get(name)
+        if rule is None:
+            errors.append(f"未知的配置项: {name}")
+            continue
+        if rule["type"] is str:
+            if value not in rule["choices"]:
+                errors.append(f"{name} 必须是 {'/'.join(rule['choices'])} 之一: {value!r}")
+                continue
+        else:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                errors.append(f"{name} 必须是数值: {value!r}")
+                continue
+            if not rule["min"] <= value <= rule["max"]:
+                errors.append(f"{name} 超出范围 [{rule['min']}, {rule['max']}]: {value}")
+                continue
+        settings[name] = value
+    
+    # 相互约束的配置项
+    if settings["min_update_interval"] > settings["max_update_interval"]:
+        errors.append("min_update_interval 不能大于 max_update_interval")
+        settings["min_update_interval"] = settings["max_update_interval"]
+    if settings["keyframe_refresh"] >= settings["keyframe_span"]:
+        errors.append("keyframe_refresh 必须小于 keyframe_span")
+        settings["keyframe_refresh"] = settings["keyframe_span"] * 0.8
+    if settings["idle_reduce_minutes"] > settings["idle_suspend_minutes"]:
+        errors.append("idle_reduce_minutes 不能大于 idle_suspend_minutes")
+        settings["idle_reduce_minutes"] = settings["idle_suspend_minutes"]
+    return settings, errors
+
+class ConfigWatcher:
+    """配置文件监视器 - 轮询文件修改时间，变化时在后台线程中回调，无需重启窗口"""
+    def __init__(self, path, callback, interval=2):
+        self.path = path
+        self.callback = callback
+        self.interval = interval
+        self.running = False
+        self.mtime = self.current_mtime()
+    
+    def current_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+    
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+    
+    def stop(self):
+        self.running = False
+    
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            mtime = self.current_mtime()
+            if mtime != self.mtime:
+                self.mtime = mtime
+                try:
+                    self.callback()
+                except Exception as e:
+                    print(f"重新加载配置错误: {e}")
+
+CONFIG_LOCK = threading.Lock()  # 配置文件的读-改-写都在此锁内进行
+
+def update_config(changes=None, remove=()):
+    """修改配置文件：在锁内读取、合并changes并删除remove中的键，先写临时文件再替换
+    
+    页面、网络监视器、更新线程等都会写配置文件，逐个读-改-写会丢失并发的修改，直接覆盖还可能让ConfigWatcher读到写了一半的文件
+    """
+    with CONFIG_LOCK:
+        config = {}
+        if os.path.exists(CONFIG_PATH):
+            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        config.update(changes or {})
+        for key in remove:
+            config.pop(key, None)
+        temp_path = CONFIG_PATH + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, CONFIG_PATH)
+
+def resolve_endpoints(config):
+    """合并配置文件中的"endpoints"与DEFAULT_ENDPOINTS，无效的项保留默认地址并打印错误"""
+    endpoints = dict(DEFAULT_ENDPOINTS)
+    overrides = config.get("endpoints") or {}
+    for name, value in overrides.items():
+        if name not in DEFAULT_ENDPOINTS:
+            print(f"配置错误: 未知的服务地址 {name}")
+        elif name == "timeout":
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and 0.1 <= value <= 60:
+                endpoints[name] = value
+            else:
+                print(f"配置错误: endpoints.timeout 必须是0.1到60之间的数值: {value!r}")
+        elif name == "public_ip":
+            value = [value] if isinstance(value, str) else value
+            if isinstance(value, list) and value and all(isinstance(url, str) for url in value):
+                endpoints[name] = value
+            else:
+                print(f"配置错误: endpoints.public_ip 必须是地址或地址列表: {value!r}")
+        elif not isinstance(value, str) or (name == "ip_location" and "{ip}" not in value):
+            print(f"配置错误: endpoints.{name} 无效: {value!r}")
+        else:
+            endpoints[name] = value
+    return endpoints
+
+def read_body(chunks, deadline, limit=65536):
+    """逐块读取响应体，超过deadline（单调时钟）时抛出TimeoutError
+    
+    urllib和requests的timeout只限制单次socket操作，服务器逐字节慢速返回时总耗时不受它限制
+    """
+    body = b""
+    for chunk in chunks:
+        body += chunk
+        if len(body) > limit:
+            raise ValueError(f"响应体超过{limit}字节")
+        if time.monotonic() > deadline:
+            raise TimeoutError("读取响应体超时")
+    return body
+
+def fetch_url(url, timeout):
+    """GET url并返回响应体（bytes），连接和读取的总时长约为timeout，非2xx状态抛出HTTPError"""
+    deadline = time.monotonic() + timeout
+    with urlopen(url, timeout=timeout) as response:
+        return read_body(iter(lambda: response.read1(4096), b""), deadline)
+
+def probe_url(url, timeout):
+    """联网探测：只等待状态行和响应头（非2xx状态抛出HTTPError），不读取响应体，普通网站首页也可作为探测地址"""
+    with urlopen(url, timeout=timeout):
+        pass
+
+def download_file(url, path, timeout):
+    """下载url到path：先写入本线程独有的临时文件，完整下载后原子替换
+    
+    看门狗放弃卡住的下载线程后会立即重新下载，旧线程醒来后只会写自己的临时文件，
+    不会与新线程写同一个文件；它若最终完成，替换进来的也是一份完整的文件。
+    """
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with urlopen(url, timeout=timeout) as response, open(temp_path, 'wb') as f:
+            expected = response.headers.get("Content-Length")
+            size = 0
+            for chunk in iter(lambda: response.read(1 << 20), b""):
+                f.write(chunk)
+                size += len(chunk)
+        if expected is not None and size != int(expected):
+            raise IOError(f"下载不完整: {size}/{expected}字节")
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+# 省电档位：在配置项的基础上放慢刷新，数值项只取较大值（不会比用户配置更频繁），
+# 字典项按用户配置的取值替换（未列出的取值保持不变）
+POWER_PROFILES = {
+    # 接通电源且有人使用：按配置运行
+    "full": {},
+    # 使用电池或短时间空闲：固定间隔刷新改为按显示变化刷新（自适应、关键帧模式保持不变），放宽刷新间隔并降低联网探测频率
+    "reduced": {
+        "refresh_mode": {"fixed": "adaptive"},
+        "min_update_interval": 5,
+        "max_update_interval": 60,
+        "hidden_update_interval": 300,
+        "keyframe_span": 900,
+        "keyframe_refresh": 840,
+        "location_check_interval": 600,
+        "moon_events_interval": 300,
+        "eclipse_interval": 21600,
+        "network_check_interval": 60,
+    },
+    # 长时间空闲或电量低：几乎停止后台工作，用户回来后恢复
+    "suspended": {
+        "refresh_mode": {"fixed": "adaptive"},
+        "min_update_interval": 60,
+        "max_update_interval": 600,
+        "hidden_update_interval": 1800,
+        "keyframe_span": 1800,
+        "keyframe_refresh": 1500,
+        "location_check_interval": 3600,
+        "moon_events_interval": 1800,
+        "eclipse_interval": 21600,
+        "network_check_interval": 600,
+    },
+}
+
+def power_adjusted_settings(settings, mode):
+    """返回按省电档位调整后的配置项"""
+    adjusted = dict(settings)
+    for name, value in POWER_PROFILES[mode].items():
+        if isinstance(value, dict):
+            adjusted[name] = value.get(settings[name], settings[name])
+        else:
+            adjusted[name] = max(settings[name], value)
+    return adjusted
+
+# 显示字段的典型变化速率（每秒）和显示精度，用于估算按显示变化刷新的节奏：
+# 站心距离约0.4 km/s（显示到1 km），高度角/方位角约0.004°/s（显示到0.1°），赤经赤纬变化慢得多
+DISPLAY_CHANGE_RATES = {"distance": (0.4, 1), "altitude": (0.004, 0.1), "azimuth": (0.004, 0.1)}
+
+def estimate_wakeup_sources(settings, visible=True, power_check_interval=15, config_poll_interval=2):
+    """估算配置项下各唤醒来源每分钟的唤醒次数
+    
+    后台线程：数据更新、网络探测、省电管理轮询、配置文件轮询、看门狗（最多每分钟醒来一次）；
+    页面：每秒的时钟（窗口可见时），关键帧模式下还有在显示数字变化时醒来的插值渲染。
+    网络变化监视器在netlink/NotifyAddrChange上阻塞，空闲时不唤醒，不计入。
+    """
+    # 显示数字（通常是地月距离的个位）大约每digit_interval秒变化一次
+    digit_interval = min(step / rate for rate, step in DISPLAY_CHANGE_RATES.values())
+    if settings["refresh_mode"] == "fixed":
+        update_delay = settings["update_interval"]
+    elif not visible:
+        update_delay = settings["hidden_update_interval"]
+    elif settings["refresh_mode"] == "keyframe":
+        update_delay = max(settings["min_update_interval"],
+                           min(settings["max_update_interval"], settings["keyframe_refresh"]))
+    else:
+        # 自适应模式在显示数字变化时醒来，受最短/最长间隔限制
+        update_delay = max(settings["min_update_interval"], min(settings["max_update_interval"], digit_interval))
+    sources = {
+        "数据更新": 60 / update_delay,
+        "网络探测": 60 / settings["network_check_interval"],
+        "省电管理": 60 / power_check_interval,
+        "配置轮询": 60 / config_poll_interval,
+        "看门狗": 1,
+        "页面时钟": 60 if visible else 0,
+    }
+    if settings["refresh_mode"] == "keyframe" and visible:
+        # 页面插值在显示数字变化时醒来（不受最短间隔限制）
+        sources["页面插值"] = 60 / digit_interval
+    return sources
+
+def estimate_wakeups_per_minute(settings, visible=True, power_check_interval=15):
+    """估算配置项下每分钟的总唤醒次数（后台线程 + 页面定时器）"""
+    return sum(estimate_wakeup_sources(settings, visible, power_check_interval).values())
+
+class PowerManager:
+    """电源与空闲状态管理 - 定期读取电池和用户空闲时间，在full/reduced/suspended省电档位之间切换
+    
+    Linux下电池状态读取/sys/class/power_supply，空闲时间在X11下通过libXss，在Wayland下通过
+    GNOME Mutter或freedesktop ScreenSaver的D-Bus接口（gdbus命令）；Windows下使用GetSystemPowerStatus和GetLastInputInfo。
+    读取不到的状态视为接通电源/有人使用，不会误入省电档。
+    """
+    def __init__(self, on_mode_change, check_interval=15):
+        self.on_mode_change = on_mode_change
+        self.check_interval = check_interval
+        self.enabled = True
+        self.idle_reduce = 600  # 秒
+        self.idle_suspend = 3600
+        self.low_battery = 15
+        self.mode = "full"
+        self.running = False
+        self.lock = threading.Lock()
+        self.wakeups = 0  # 当前档位下记录的唤醒次数
+        self.mode_since = time.monotonic()
+        self.stats = {mode: [0, 0.0] for mode in POWER_PROFILES}  # 档位 -> [唤醒次数, 持续秒数]
+        self.x11 = None  # (libX11, libXss, display, 信息结构)，首次使用时打开
+        self.x11_failed = False
+    
+    def configure(self, settings):
+        """应用配置文件中的省电设置"""
+        self.enabled = settings["power_saving"] == "auto"
+        self.idle_reduce = settings["idle_reduce_minutes"] * 60
+        self.idle_suspend = settings["idle_suspend_minutes"] * 60
+        self.low_battery = settings["low_battery_percent"]
+    
+    def record_wakeup(self):
+        """后台线程每次醒来时调用，用于统计各档位实际的唤醒频率"""
+        with self.lock:
+            self.wakeups += 1
+    
+    def read_battery(self):
+        """返回(是否使用电池, 电量百分比)，无法判断时为(None, None)"""
+        if sys.platform == 'win32':
+            try:
+                import ctypes
+                class SYSTEM_POWER_STATUS(ctypes.Structure):
+                    _fields_ = [('ACLineStatus', ctypes.c_ubyte), ('BatteryFlag', ctypes.c_ubyte),
+                                ('BatteryLifePercent', ctypes.c_ubyte), ('SystemStatusFlag', ctypes.c_ubyte),
+                                ('BatteryLifeTime', ctypes.c_ulong), ('BatteryFullLifeTime', ctypes.c_ulong)]
+                status = SYSTEM_POWER_STATUS()
+                if ctypes.windll.kernel32.GetSystemPowerStatus(ctypes.byref(status)):
+                    on_battery = {0: True, 1: False}.get(status.ACLineStatus)
+                    percent = status.BatteryLifePercent if status.BatteryLifePercent <= 100 else None
+                    return on_battery, percent
+            except Exception as e:
+                print(f"读取电源状态失败: {e}")
+            return None, None
+        
+        base = '/sys/class/power_supply'
+        if not os.path.isdir(base):
+            return None, None
+        mains_online = None
+        discharging = False
+        percents = []
+        for name in os.listdir(base):
+            path = os.path.join(base, name)
+            try:
+                with open(os.path.join(path, 'type')) as f:
+                    supply_type = f.read().strip()
+                if supply_type == 'Mains':
+                    with open(os.path.join(path, 'online')) as f:
+                        mains_online = bool(mains_online) or f.read().strip() == '1'
+                elif supply_type == 'Battery':
+                    with open(os.path.join(path, 'status')) as f:
+                        discharging = discharging or f.read().strip() == 'Discharging'
+                    with open(os.path.join(path, 'capacity')) as f:
+                        percents.append(int(f.read().strip()))
+            except (OSError, ValueError):
+                continue
+        if not percents:
+            return None, None  # 台式机没有电池
+        on_battery = (not mains_online) if mains_online is not None else discharging
+        return on_battery, min(percents)
+    
+    def read_idle_seconds(self):
+        """返回用户空闲秒数，无法获取时返回None"""
+        if sys.platform == 'win32':
+            try:
+                import ctypes
+                class LASTINPUTINFO(ctypes.Structure):
+                    _fields_ = [('cbSize', ctypes.c_uint), ('dwTime', ctypes.c_uint)]
+                info = LASTINPUTINFO()
+                info.cbSize = ctypes.sizeof(info)
+                if ctypes.windll.user32.GetLastInputInfo(ctypes.byref(info)):
+                    return ((ctypes.windll.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF) / 1000
+            except Exception as e:
+                print(f"读取空闲时间失败: {e}")
+            return None
+        
+        if os.environ.get('WAYLAND_DISPLAY'):
+            idle = self.read_dbus_idle_seconds()
+            if idle is not None:
+                return idle
+        if os.environ.get('DISPLAY'):
+            return self.read_x11_idle_seconds()
+        return None
+    
+    def read_dbus_idle_seconds(self):
+        """Wayland下通过D-Bus查询空闲时间（GNOME Mutter，其次freedesktop ScreenSaver）"""
+        import subprocess
+        queries = [
+            ['gdbus', 'call', '--session', '--dest', 'org.gnome.Mutter.IdleMonitor',
+             '--object-path', '/org/gnome/Mutter/IdleMonitor/Core',
+             '--method', 'org.gnome.Mutter.IdleMonitor.GetIdletime'],
+            ['gdbus', 'call', '--session', '--dest', 'org.freedesktop.ScreenSaver',
+             '--object-path', '/org/freedesktop/ScreenSaver',
+             '--method', 'org.freedesktop.ScreenSaver.GetSessionIdleTime'],
+        ]
+        for query in queries:
+            try:
+                output = subprocess.run(query, capture_output=True, text=True, timeout=2).stdout
+                match = re.search(r'(\d+)', output)
+                if match:
+                    return int(match.group(1)) / 1000  # 两个接口都以毫秒返回
+            except Exception:
+                continue
+        return None
+    
+    def read_x11_idle_seconds(self):
+        """X11下通过XScreenSaver扩展查询空闲时间，连接在首次使用时打开并复用"""
+        if self.x11_failed:
+            return None
+        try:
+            import ctypes
+            import ctypes.util
+            if self.x11 is None:
+                class XScreenSaverInfo(ctypes.Structure):
+                    _fields_ = [('window', ctypes.c_ulong), ('state', ctypes.c_int), ('kind', ctypes.c_int),
+                                ('til_or_since', ctypes.c_ulong), ('idle', ctypes.c_ulong),
+                                ('eventMask', ctypes.c_ulong)]
+                xlib = ctypes.cdll.LoadLibrary(ctypes.util.find_library('X11'))
+                xss = ctypes.cdll.LoadLibrary(ctypes.util.find_library('Xss'))
+                xlib.XOpenDisplay.restype = ctypes.c_void_p
+                xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+                xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+                xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+                xss.XScreenSaverAllocInfo.restype = ctypes.POINTER(XScreenSaverInfo)
+                xss.XScreenSaverQueryInfo.argtypes = [ctypes.c_void_p, ctypes.c_ulong,
+                                                      ctypes.POINTER(XScreenSaverInfo)]
+                display = xlib.XOpenDisplay(None)
+                if not display:
+                    raise OSError("无法连接X服务器")
+                self.x11 = (xlib, xss, display, xss.XScreenSaverAllocInfo())
+            xlib, xss, display, info = self.x11
+            if xss.XScreenSaverQueryInfo(display, xlib.XDefaultRootWindow(display), info):
+                return info.contents.idle / 1000
+        except Exception as e:
+            print(f"读取X11空闲时间失败: {e}")
+            self.x11_failed = True
+        return None
+    
+    def decide_mode(self, on_battery, percent, idle_seconds):
+        """根据电池和空闲状态决定省电档位"""
+        if not self.enabled:
+            return "full"
+        if idle_seconds is not None and idle_seconds >= self.idle_suspend:
+            return "suspended"
+        if on_battery and percent is not None and percent <= self.low_battery:
+            return "suspended"
+        if on_battery or (idle_seconds is not None and idle_seconds >= self.idle_reduce):
+            return "reduced"
+        return "full"
+    
+    def check(self):
+        """读取一次状态，档位变化时通知并打印各档位的唤醒统计"""
+        on_battery, percent = self.read_battery()
+        idle_seconds = self.read_idle_seconds()
+        mode = self.decide_mode(on_battery, percent, idle_seconds)
+        if mode == self.mode:
+            return mode
+        
+        with self.lock:
+            now = time.monotonic()
+            self.stats[self.mode][0] += self.wakeups
+            self.stats[self.mode][1] += now - self.mode_since
+            self.wakeups = 0
+            self.mode_since = now
+            previous, self.mode = self.mode, mode
+        print(f"省电档位: {previous} -> {mode}（电池: {on_battery}, 电量: {percent}, 空闲: {idle_seconds}秒）")
+        self.on_mode_change(mode)
+        self.print_report()
+        return mode
+    
+    def measured_rates(self):
+        """返回各档位实测的每分钟唤醒次数（未运行过的档位为None）"""
+        with self.lock:
+            stats = {mode: list(values) for mode, values in self.stats.items()}
+            stats[self.mode][0] += self.wakeups
+            stats[self.mode][1] += time.monotonic() - self.mode_since
+        return {mode: (wakeups / seconds * 60 if seconds >= 1 else None)
+                for mode, (wakeups, seconds) in stats.items()}
+    
+    def print_report(self, settings=None):
+        """打印各档位的每分钟唤醒次数（估算值和实测值）及相对full档节省的比例"""
+        measured = self.measured_rates()
+        full = None
+        for mode in POWER_PROFILES:
+            line = f"  {mode:<9}"
+            if settings:
+                sources = estimate_wakeup_sources(power_adjusted_settings(settings, mode),
+                                                  power_check_interval=self.check_interval)
+                estimate = sum(sources.values())
+                full = full or estimate
+                line += f" 估算 {estimate:6.1f} 次/分钟（节省 {(1 - estimate / full) * 100:4.1f}%）"
+            if measured[mode] is not None:
+                line += f" 实测 {measured[mode]:6.1f} 次/分钟"
+            print(line)
+            if settings:
+                print("            " + "，".join(f"{name} {rate:.1f}" for name, rate in sources.items()))
+    
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+    
+    def stop(self):
+        self.running = False
+    
+    def run(self):
+        while self.running:
+            try:
+                self.check()
+            except Exception as e:
+                print(f"检查电源状态错误: {e}")
+            time.sleep(self.check_interval)
+
+def parse_nmea_sentence(line):
+    """解析一条NMEA语句（RMC/GGA，任意卫星系统前缀），返回(纬度, 经度)或None（无定位、校验失败或其他语句）"""
+    line = line.strip()
+    if not line.startswith('$') or '*' not in line:
+        return None
+    body, _, checksum = line[1:].partition('*')
+    calculated = 0
+    for char in body:
+        calculated ^= ord(char)
+    try:
+        if calculated != int(checksum[:2], 16):
+            return None
+    except ValueError:
+        return None
+    
+    fields = body.split(',')
+    sentence = fields[0][2:]
+    try:
+        if sentence == 'RMC' and len(fields) > 6 and fields[2] == 'A':
+            lat_field, lat_hemi, lon_field, lon_hemi = fields[3:7]
+        elif sentence == 'GGA' and len(fields) > 6 and fields[6] not in ('', '0'):
+            lat_field, lat_hemi, lon_field, lon_hemi = fields[2:6]
+        else:
+            return None
+        # ddmm.mmmm / dddmm.mmmm
+        latitude = int(lat_field[:2]) + float(lat_field[2:]) / 60
+        longitude = int(lon_field[:3]) + float(lon_field[3:]) / 60
+    except (ValueError, IndexError):
+        return None
+    if lat_hemi == 'S':
+        latitude = -latitude
+    if lon_hemi == 'W':
+        longitude = -longitude
+    return latitude, longitude
+
+class LocationProvider:
+    """定位源接口 - 在后台线程中持续读取定位，每得到一次定位就调用on_fix(纬度, 经度)，不阻塞更新线程"""
+    name = "provider"
+    
+    def __init__(self, retry_delay=10):
+        self.retry_delay = retry_delay
+        self.running = False
+        self.on_fix = None
+        self.last_fix_time = None  # 最近一次定位的单调时钟时间
+    
+    def start(self, on_fix):
+        self.on_fix = on_fix
+        self.running = True
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+    
+    def stop(self):
+        self.running = False
+    
+    def has_fix(self, max_age=60):
+        """最近max_age秒内是否收到过定位"""
+        return self.last_fix_time is not None and time.monotonic() - self.last_fix_time <= max_age
+    
+    def report(self, latitude, longitude):
+        self.last_fix_time = time.monotonic()
+        self.on_fix(latitude, longitude)
+    
+    def run(self):
+        # 连接断开或设备拔出后按retry_delay重试
+        while self.running:
+            try:
+                self.read_fixes()
+            except Exception as e:
+                print(f"{self.name}定位源错误: {e}")
+            if self.running:
+                time.sleep(self.retry_delay)
+    
+    def read_fixes(self):
+        raise NotImplementedError
+
+class GpsdProvider(LocationProvider):
+    """gpsd客户端 - 通过JSON协议订阅TPV报告"""
+    name = "gpsd"
+    
+    def __init__(self, host="127.0.0.1", port=2947, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+    
+    def read_fixes(self):
+        with socket.create_connection((self.host, self.port), timeout=10) as sock:
+            sock.sendall(b'?WATCH={"enable":true,"json":true};\n')
+            sock.settimeout(30)
+            # makefile返回的读取器持有套接字的一个引用，需与套接字一起关闭
+            with sock.makefile('r', encoding='utf-8', errors='replace') as reader:
+                for line in reader:
+                    if not self.running:
+                        return
+                    try:
+                        report = json.loads(line)
+                    except ValueError:
+                        continue
+                    # mode: 0/1=无定位, 2=二维定位, 3=三维定位
+                    if report.get('class') == 'TPV' and report.get('mode', 0) >= 2 and 'lat' in report and 'lon' in report:
+                        self.report(report['lat'], report['lon'])
+
+class NmeaProvider(LocationProvider):
+    """NMEA读取器 - 串口设备（需要pyserial）或NMEA文本文件
+    
+    普通文件按回放处理：每条带定位的语句间隔replay_interval秒，读到末尾后从头循环，可在没有GPS设备时代替车载GPS测试。
+    """
+    name = "nmea"
+    
+    def __init__(self, path, baudrate=4800, replay_interval=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path if os.path.isabs(path) else os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        self.baudrate = baudrate
+        self.replay_interval = replay_interval
+    
+    def read_fixes(self):
+        if os.path.isfile(self.path):
+            self.replay_file()
+            return
+        import serial  # 可选依赖pyserial，仅串口设备需要
+        with serial.Serial(self.path, self.baudrate, timeout=5) as port:
+            while self.running:
+                line = port.readline().decode('ascii', errors='replace')
+                fix = parse_nmea_sentence(line)
+                if fix:
+                    self.report(*fix)
+    
+    def replay_file(self):
+        while self.running:
+            with open(self.path, 'r', encoding='ascii', errors='replace') as f:
+                for line in f:
+                    if not self.running:
+                        return
+                    fix = parse_nmea_sentence(line)
+                    if fix:
+                        self.report(*fix)
+                        time.sleep(self.replay_interval)
+
+def create_location_provider(config):
+    """按配置创建定位源，例如{"type": "gpsd"}或{"type": "nmea", "path": "/dev/ttyUSB0"}，未配置返回None"""
+    if not config:
+        return None
+    options = dict(config)
+    provider_type = options.pop("type", None)
+    if provider_type == "gpsd":
+        return GpsdProvider(**options)
+    if provider_type == "nmea":
+        return NmeaProvider(**options)
+    print(f"未知的定位源类型: {provider_type}")
+    return None
+
+class NetworkChangeWatcher:
+    """网络变化监视器 - 网络环境变化（换网、断开、重连）时回调，替代每10秒重新查询公网IP和定位
+    
+    Linux下订阅rtnetlink的链路、地址和路由变化组播消息，Windows下阻塞在NotifyAddrChange上等待地址变化，
+    收到通知后去抖并比较本地网络状态（默认网关、网关MAC、WiFi名称、本机IP）；都不可用时轮询。
+    Windows下的状态通过iphlpapi/wlanapi读取，不启动route/arp/netsh进程，不产生任何网络请求。
+    首次读取在监视线程中进行，不阻塞启动。
+    """
+    # rtnetlink组播组（linux/rtnetlink.h）
+    RTMGRP_LINK = 0x1
+    RTMGRP_IPV4_IFADDR = 0x10
+    RTMGRP_IPV4_ROUTE = 0x40
+    RTMGRP_IPV6_IFADDR = 0x100
+    RTMGRP_IPV6_ROUTE = 0x400
+    
+    def __init__(self, on_change, poll_interval=30, debounce=2):
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.running = False
+        self.state = None
+    
+    @staticmethod
+    def run_command(args):
+        import subprocess
+        try:
+            # pythonw启动时不弹出控制台窗口
+            return subprocess.run(args, capture_output=True, text=True, timeout=3,
+                                  creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)).stdout
+        except Exception:
+            return ""
+    
+    @staticmethod
+    def read_windows_gateway():
+        """Windows：从IPv4路由表（GetIpForwardTable）取跃点数最小的默认网关，再用SendARP取其MAC，返回(网关, MAC)"""
+        import ctypes
+        
+        iphlpapi = ctypes.windll.iphlpapi
+        size = ctypes.c_ulong(0)
+        iphlpapi.GetIpForwardTable(None, ctypes.byref(size), False)
+        buffer = ctypes.create_string_buffer(size.value)
+        if iphlpapi.GetIpForwardTable(buffer, ctypes.byref(size), True) != 0:
+            return None, None
+        # MIB_IPFORWARDTABLE：条目数 + MIB_IPFORWARDROW[]（14个DWORD：目标、掩码、策略、下一跳、接口、类型、协议、存活时间、AS、跃点数1-5）
+        count = struct.unpack_from('<I', buffer, 0)[0]
+        best = None
+        for i in range(count):
+            row = struct.unpack_from('<14I', buffer, 4 + i * 56)
+            if row[0] == 0 and row[1] == 0 and (best is None or row[9] < best[9]):
+                best = row
+        if best is None:
+            return None, None
+        gateway = socket.inet_ntoa(struct.pack('<I', best[3]))
+        mac = (ctypes.c_ubyte * 8)()
+        length = ctypes.c_ulong(6)
+        if iphlpapi.SendARP(best[3], 0, mac, ctypes.byref(length)) != 0 or length.value != 6:
+            return gateway, None
+        return gateway, ':'.join(f'{byte:02x}' for byte in mac[:6])
+    
+    @staticmethod
+    def read_windows_ssid():
+        """Windows：通过WLAN API读取当前连接的WiFi名称，未连接无线网络时返回None"""
+        import ctypes
+        from ctypes import wintypes
+        
+        class WLAN_INTERFACE_INFO(ctypes.Structure):
+            _fields_ = [("InterfaceGuid", ctypes.c_byte * 16), ("strInterfaceDescription", ctypes.c_wchar * 256),
+                        ("isState", ctypes.c_int)]
+        
+        class WLAN_INTERFACE_INFO_LIST(ctypes.Structure):
+            _fields_ = [("dwNumberOfItems", wintypes.DWORD), ("dwIndex", wintypes.DWORD),
+                        ("InterfaceInfo", WLAN_INTERFACE_INFO * 64)]
+        
+        class WLAN_CONNECTION_ATTRIBUTES(ctypes.Structure):
+            # 只声明到DOT11_SSID为止，之后的字段不需要
+            _fields_ = [("isState", ctypes.c_int), ("wlanConnectionMode", ctypes.c_int),
+                        ("strProfileName", ctypes.c_wchar * 256), ("uSSIDLength", ctypes.c_ulong),
+                        ("ucSSID", ctypes.c_ubyte * 32)]
+        
+        wlanapi = ctypes.windll.wlanapi
+        handle = wintypes.HANDLE()
+        version = wintypes.DWORD()
+        if wlanapi.WlanOpenHandle(2, None, ctypes.byref(version), ctypes.byref(handle)) != 0:
+            return None  # 没有无线网卡或WLAN服务未运行
+        try:
+            interfaces = ctypes.POINTER(WLAN_INTERFACE_INFO_LIST)()
+            if wlanapi.WlanEnumInterfaces(handle, None, ctypes.byref(interfaces)) != 0:
+                return None
+            try:
+                for i in range(min(interfaces.contents.dwNumberOfItems, 64)):
+                    info = interfaces.contents.InterfaceInfo[i]
+                    if info.isState != 1:  # wlan_interface_state_connected
+                        continue
+                    size = wintypes.DWORD()
+                    attributes = ctypes.POINTER(WLAN_CONNECTION_ATTRIBUTES)()
+                    # 7 = wlan_intf_opcode_current_connection
+                    if wlanapi.WlanQueryInterface(handle, ctypes.byref(info.InterfaceGuid), 7, None,
+                                                  ctypes.byref(size), ctypes.byref(attributes), None) != 0:
+                        continue
+                    try:
+                        length = min(attributes.contents.uSSIDLength, 32)
+                        return bytes(attributes.contents.ucSSID[:length]).decode('utf-8', 'replace') or None
+                    finally:
+                        wlanapi.WlanFreeMemory(attributes)
+            finally:
+                wlanapi.WlanFreeMemory(interfaces)
+        finally:
+            wlanapi.WlanCloseHandle(handle, None)
+        return None
+    
+    @staticmethod
+    def local_ip():
+        """本机出口IP（UDP套接字connect不发送数据包）"""
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                sock.connect(('8.8.8.8', 53))
+                return sock.getsockname()[0]
+        except OSError:
+            return None
+    
+    @classmethod
+    def read_state(cls):
+        """读取本地网络状态：{gateway, gateway_mac, ssid, local_ip}，读取不到的项为None"""
+        gateway = gateway_mac = ssid = None
+        if sys.platform.startswith('linux'):
+            try:
+                with open('/proc/net/route') as f:
+                    for line in f.readlines()[1:]:
+                        fields = line.split()
+                        if len(fields) > 2 and fields[1] == '00000000':
+                            gateway = socket.inet_ntoa(struct.pack('<L', int(fields[2], 16)))
+                            break
+                if gateway:
+                    with open('/proc/net/arp') as f:
+                        for line in f.readlines()[1:]:
+                            fields = line.split()
+                            if len(fields) > 3 and fields[0] == gateway and fields[3] != '00:00:00:00:00:00':
+                                gateway_mac = fields[3].lower()
+                                break
+            except OSError:
+                pass
+            ssid = cls.run_command(['iwgetid', '-r']).strip() or None
+        elif sys.platform == 'win32':
+            try:
+                gateway, gateway_mac = cls.read_windows_gateway()
+            except Exception as e:
+                print(f"读取默认网关失败: {e}")
+            try:
+                ssid = cls.read_windows_ssid()
+            except Exception as e:
+                print(f"读取WiFi名称失败: {e}")
+        return {"gateway": gateway, "gateway_mac": gateway_mac, "ssid": ssid, "local_ip": cls.local_ip()}
+    
+    @staticmethod
+    def fingerprint(state):
+        """网络指纹（网关MAC和/或WiFi名称），用于识别曾经连接过的网络；都读取不到时返回None"""
+        if not state or not (state.get("gateway_mac") or state.get("ssid")):
+            return None
+        return f"mac={state.get('gateway_mac') or ''};ssid={state.get('ssid') or ''}"
+    
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+    
+    def stop(self):
+        self.running = False
+    
+    def check(self):
+        """重新读取本地网络状态，变化时回调"""
+        state = self.read_state()
+        if state != self.state:
+            previous, self.state = self.state, state
+            print(f"网络环境变化: {previous} -> {state}")
+            try:
+                self.on_change(state)
+            except Exception as e:
+                print(f"处理网络变化错误: {e}")
+    
+    def run(self):
+        # 首次读取：与构造时的状态（未知）不同，回调后由调用方决定使用记住的位置还是重新定位
+        self.check()
+        if hasattr(socket, 'AF_NETLINK'):
+            try:
+                self.run_netlink()
+                return
+            except OSError as e:
+                print(f"netlink不可用，改为轮询网络状态: {e}")
+        if sys.platform == 'win32':
+            try:
+                self.run_windows_notify()
+                return
+            except Exception as e:
+                print(f"NotifyAddrChange不可用，改为轮询网络状态: {e}")
+        self.run_polling()
+    
+    def run_windows_notify(self):
+        """Windows：同步调用NotifyAddrChange，阻塞到IPv4地址表变化（换网、断开、重连都会改变地址）"""
+        import ctypes
+        
+        notify = ctypes.windll.iphlpapi.NotifyAddrChange
+        while self.running:
+            result = notify(None, None)
+            if result != 0:
+                raise OSError(f"NotifyAddrChange返回{result}")
+            # 一次换网会连续改变多个地址，等debounce秒后再检查
+            time.sleep(self.debounce)
+            self.check()
+    
+    def run_netlink(self):
+        groups = (self.RTMGRP_LINK | self.RTMGRP_IPV4_IFADDR | self.RTMGRP_IPV4_ROUTE |
+                  self.RTMGRP_IPV6_IFADDR | self.RTMGRP_IPV6_ROUTE)
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE) as sock:
+            sock.bind((0, groups))
+            pending_since = None
+            while self.running:
+                # 空闲时一直阻塞到下一条消息，只在等待防抖期间设置超时
+                if pending_since is None:
+                    sock.settimeout(None)
+                else:
+                    sock.settimeout(max(0.01, pending_since + self.debounce - time.monotonic()))
+                try:
+                    sock.recv(65536)
+                    # 一次换网会产生一串消息，等消息停止debounce秒后再检查
+                    pending_since = time.monotonic()
+                    continue
+                except socket.timeout:
+                    pass
+                if pending_since is not None and time.monotonic() - pending_since >= self.debounce:
+                    pending_since = None
+                    self.check()
+    
+    def run_polling(self):
+        while self.running:
+            time.sleep(self.poll_interval)
+            self.check()
+
+class ThreadWatchdog:
+    """后台线程看门狗 - 工作线程每轮循环报告心跳并给出下次心跳的期限，过期未报告视为卡住
+    
+    卡在DNS解析（urlopen的timeout不覆盖域名解析）或星历下载中的线程无法从外部终止，看门狗为该工作
+    启动新一代线程接替；旧线程醒来后发现自己已不是当前一代就退出，不会与新线程重复推送。
+    看门狗线程只在最早的期限到达时醒来，不增加空闲时的唤醒次数。
+    """
+    def __init__(self, max_sleep=60):
+        self.max_sleep = max_sleep
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.workers = {}  # 名称 -> 状态字典
+        self.running = False
+    
+    def add_thread(self, name, target, startup_timeout):
+        """登记并启动循环工作线程，target(generation)为线程主体，需定期调用beat(name, generation, 期限)"""
+        with self.lock:
+            self.workers[name] = {"target": target, "generation": 0, "deadline": None,
+                                  "last_beat": None, "stalls": 0, "startup_timeout": startup_timeout}
+        self.spawn(name)
+    
+    def add_check(self, name, deadline, recover):
+        """登记非循环的工作（如星历加载）：deadline()返回单调时钟期限（无进行中的工作时为None），过期后调用recover()"""
+        with self.lock:
+            self.workers[name] = {"deadline_func": deadline, "recover": recover, "generation": 0,
+                                  "last_beat": None, "stalls": 0}
+    
+    def spawn(self, name):
+        """启动新一代线程，第一次心跳前按startup_timeout判断是否卡住"""
+        with self.lock:
+            worker = self.workers[name]
+            worker["generation"] += 1
+            worker["deadline"] = time.monotonic() + worker["startup_timeout"]
+            generation = worker["generation"]
+        thread = threading.Thread(target=worker["target"], args=(generation,), name=f"{name}-{generation}")
+        thread.daemon = True
+        thread.start()
+        self.wake.set()
+    
+    def beat(self, name, generation, timeout):
+        """报告心跳，应在timeout秒内再次报告；返回False表示该线程已被接替，应退出"""
+        with self.lock:
+            worker = self.workers.get(name)
+            if worker is None:
+                return True  # 未受监视（如诊断模式直接调用）
+            if generation != worker["generation"]:
+                return False
+            worker["last_beat"] = time.monotonic()
+            worker["deadline"] = worker["last_beat"] + timeout
+            return True
+    
+    def is_current(self, name, generation):
+        """线程是否仍是该工作的当前一代"""
+        with self.lock:
+            worker = self.workers.get(name)
+            return worker is None or generation == worker["generation"]
+    
+    def check(self):
+        """接替已过期的工作，返回距最早期限的秒数"""
+        now = time.monotonic()
+        stalled = []
+        next_deadline = now + self.max_sleep
+        with self.lock:
+            for name, worker in self.workers.items():
+                deadline = worker["deadline_func"]() if "deadline_func" in worker else worker["deadline"]
+                if deadline is None:
+                    continue
+                if now > deadline:
+                    worker["stalls"] += 1
+                    stalled.append((name, worker))
+                else:
+                    next_deadline = min(next_deadline, deadline)
+        
+        for name, worker in stalled:
+            print(f"看门狗: {name} 超过期限未响应（第{worker['stalls']}次），启动新的工作线程接替")
+            if "recover" in worker:
+                with self.lock:
+                    worker["generation"] += 1
+                worker["recover"]()
+            else:
+                self.spawn(name)
+        return max(1, next_deadline - now + 0.5)
+    
+    def report(self):
+        """诊断信息：各工作的当前代数、卡住次数和距上次心跳的秒数"""
+        now = time.monotonic()
+        with self.lock:
+            return {name: {"generation": worker["generation"], "stalls": worker["stalls"],
+                           "since_beat": None if worker["last_beat"] is None else round(now - worker["last_beat"], 1)}
+                    for name, worker in self.workers.items()}
+    
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+    
+    def stop(self):
+        self.running = False
+        self.wake.set()
+    
+    def run(self):
+        while self.running:
+            try:
+                delay = self.check()
+            except Exception as e:
+                print(f"看门狗检查错误: {e}")
+                delay = self.max_sleep
+            self.wake.wait(min(delay, self.max_sleep))
+            self.wake.clear()
+
+class ComputeWorker:
+    """可选的计算子进程 - 独占一份星历，在独立的解释器中执行耗时的Skyfield搜索
+    
+    UI进程的GIL不再被长时间的find_discrete/NumPy计算占用，evaluate_js和页面调用的接口（如置顶）保持响应。
+    请求和结果通过管道传递（结果是少量事件元组，序列化成本远小于计算本身）；子进程崩溃或退出后
+    自动重启并重试一次，超时后在释放锁之前终止并重启子进程，不再重试。
+    """
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self.lock = threading.Lock()  # 管道一次只处理一个请求
+        self.process = None
+        self.conn = None
+        self.restarts = 0
+        self.retry_after = 0  # 子进程连续失败后暂停使用到此时间（单调时钟），期间由本进程计算
+    
+    def start(self):
+        # spawn：不复制父进程的GUI线程和锁，各平台行为一致
+        context = multiprocessing.get_context('spawn')
+        parent_conn, child_conn = context.Pipe()
+        self.process = context.Process(target=compute_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        print(f"计算进程已启动 (pid {self.process.pid})")
+    
+    def stop(self):
+        if self.process is not None:
+            try:
+                self.conn.close()
+                self.process.terminate()
+                self.process.join(timeout=2)
+                if self.process.is_alive():
+                    self.process.kill()
+                    self.process.join(timeout=2)
+            except Exception as e:
+                print(f"停止计算进程时出错: {e}")
+            self.process = None
+            self.conn = None
+    
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        print(f"重启计算进程（第{self.restarts}次）")
+        self.start()
+    
+    def call(self, method, *args, timeout=None):
+        """在子进程中执行ComputeEngine的方法并返回结果，子进程中的异常以RuntimeError抛出
+        
+        timeout（秒，默认self.timeout）应小于调用线程的看门狗期限，调用方持有锁的时间不超过它
+        """
+        timeout = timeout or self.timeout
+        with self.lock:
+            if time.monotonic() < self.retry_after:
+                raise RuntimeError("计算进程暂不可用")
+            for attempt in range(2):
+                if self.process is None:
+                    self.start()
+                elif not self.process.is_alive():
+                    print(f"计算进程已退出（退出码 {self.process.exitcode}）")
+                    self.restart()
+                try:
+                    self.conn.send((method, args))
+                    finished = self.conn.poll(timeout)
+                    if finished:
+                        ok, result = self.conn.recv()
+                except (EOFError, OSError) as e:
+                    print(f"计算进程通信失败: {e}")
+                    self.restart()
+                    continue
+                if not finished:
+                    # 子进程仍在计算：释放锁之前终止并重启，下一个请求不会等它或收到迟到的结果；
+                    # 同样的计算再试一次多半还会超时，暂停一分钟
+                    self.restart()
+                    self.retry_after = time.monotonic() + 60
+                    raise TimeoutError(f"{method} 超过{timeout}秒未返回")
+                if ok is None:
+                    # 子进程无法加载星历（如父进程尚未下载完成）：重启子进程并暂停一分钟，
+                    # 期间的请求直接在本进程计算，不再每次先往返子进程
+                    self.restart()
+                    self.retry_after = time.monotonic() + 60
+                    raise RuntimeError(result)
+                if ok:
+                    return result
+                raise RuntimeError(result)
+            # 重启后仍然失败（如子进程无法启动），暂停一分钟，避免每次调用都反复创建进程
+            self.retry_after = time.monotonic() + 60
+            raise RuntimeError("计算进程不可用")
+
 class MoonWidget:
-    def __init__(self):
+    # 本地没有de421.bsp时是否从网络下载（故障注入测试中关闭，测试不访问真实网络）
+    ephemeris_download_enabled = True
+    
+    def __init__(self, profile=None):
         self.window = None
         self.update_interval = 1  # 更新间隔改为1秒
         self.is_running = True
+        self.clock = SimulationClock()  # 计算使用的时钟，模拟模式下可加速和跳转
+        
+        # 刷新模式：
+        #   "fixed"    - 每update_interval秒推送一次完整数据
+        #   "adaptive" - 按显示数值下一次变化的时间休眠，时钟由页面JS本地走时
+        #   "keyframe" - 推送t0和t0+Δ两个位置关键帧，由页面JS插值显示，只在关键帧到期或事件变化时推送
+        self.refresh_mode = "adaptive"
+        self.keyframe_span = 300  # 关键帧时间跨度Δ（秒）
+        self.keyframe_refresh = 240  # 关键帧推送间隔（模拟时间秒），需小于keyframe_span
+        self.last_keyframe_push = 0  # 上次推送关键帧的时间
+        self.last_static_payload = None  # 上次推送的非位置字段，用于检测事件变化
+        self.min_update_interval = 1  # 最短更新间隔（秒）
+        self.max_update_interval = 10  # 窗口可见时的最长更新间隔（秒），保证位置检查等周期任务照常执行
+        self.hidden_update_interval = 60  # 窗口隐藏或最小化时的更新间隔（秒）
+        self.location_check_interval = 1800  # IP定位兜底检查间隔（秒），换网由网络变化监视器即时触发
+        self.moon_events_interval = 60  # 月出月落刷新间隔（计算时钟秒）
+        self.eclipse_interval = 3600  # 日月食刷新间隔（计算时钟秒）
+        self.network_check_interval = 5  # 网络探测间隔（秒）
+        self.moon_event_horizon_hours = 72  # 月出月落搜索窗口（小时）
+        self.eclipse_horizon_days = 7  # 日月食搜索窗口（天）
+        self.watchdog_timeout = 180  # 后台线程每轮的最长耗时（秒），超过后由看门狗接替
+        self.profile = profile  # 命令行指定的性能配置，优先于配置文件
+        self.config_watcher = None  # 配置文件监视器
+        self.base_settings = None  # 配置文件中的配置项（未经省电档位调整）
+        self.power_mode = "full"  # 当前省电档位
+        self.power_manager = PowerManager(self.set_power_mode)  # 电源与空闲状态管理
+        self.page_visible = True  # 页面是否可见（由JS的visibilitychange事件通知）
+        self.window_minimized = False  # 窗口是否最小化
+        self.wake_event = threading.Event()  # 用于提前唤醒更新线程
+        self.latest_moon_data = None  # 最近一次推送的数据，作为页面首帧
+        self.payload_builder = MoonPayloadBuilder()  # 月球数据负载构建器
+        self.asset_server = None  # 本地静态资源服务器
+        self.broadcaster = None  # 服务器模式下的数据广播器
         
         # 先初始化网络状态和位置记忆功能
+        self.endpoints = self.load_endpoints()  # 联网探测、公网IP和IP定位服务的地址
         self.network_available = True  # 默认网络可用
         self.last_known_location = self.load_last_known_location()  # 加载上次已知位置
+        self.city_index = CityIndex()  # 离线城市索引，用于坐标命名
+        self.timezone_index = TimezoneIndex()  # 离线时区边界索引，用于坐标到时区的推断
+        self.manual_location = self.load_manual_location()  # 手动设置的坐标（优先于IP定位）
+        self.network_locations = self.load_network_locations()  # 网络指纹 -> 该网络下的定位结果
+        # GPS定位源（gpsd或NMEA），配置后优先于IP定位；位置只有在稳定偏离超过阈值后才切换，避免抖动触发重算
+        self.location_provider = None
+        self.gps_location = None  # 已采用的GPS位置
+        self.gps_threshold_km = 2.0  # 偏离已采用位置超过此距离才视为移动
+        self.gps_confirm_fixes = 3  # 需要连续多少次定位都超过阈值
+        self.gps_pending = 0  # 连续超过阈值的定位次数
+        self.load_location_provider()
+        self.network_watcher = NetworkChangeWatcher(self.on_network_changed)  # 网络变化时才重新定位
+        self.network_state = None  # 由network_watcher在后台线程中读取，首次读取后回调on_network_changed
+        self.pending_location = None  # 其他线程提交的新位置，由数据更新线程在下一轮应用
+        self.location_lock = threading.Lock()
         
-        # 然后获取位置信息
-        self.location = self.get_location()  # 获取位置信息
-        self.moon_events = {}  # 存储月出月落时间
-        self.local_tz = pytz.timezone(self.location["timezone"])  # 使用IP所在地的时区
+        # 然后获取位置信息（已知网络直接使用记住的定位结果，无需联网）
+        self.location = self.get_location(prefer_cached=True)  # 获取位置信息
+        self.moon_events = MoonEvents.placeholder("--")  # 存储月出月落时间
+        self.eclipse_events = []  # 存储日月食事件
+        self.snapshot_interval = 300  # 热启动快照保存间隔（秒）
+        # 首帧来自快照时为True：实时计算完成前不推送新帧，也不用占位信息覆盖恢复的月出月落和日月食
+        self.snapshot_pending = False
+        self.snapshot_loaded_at = 0
+        self.snapshot_max_wait = 120  # 快照首帧最多等待实时计算的时间（秒）
+        self.moon_events_fresh = False  # 月出月落是否已由Skyfield实时计算过
+        self.last_snapshot_save = time.time()
+        self.load_snapshot()  # 用上次保存的快照作为首帧，Skyfield加载完成前页面即可显示
+        self.local_tz = get_timezone(self.location["timezone"])  # 使用所在地的时区
         self.last_update_second = -1  # 记录上一次更新的秒数
         self.is_topmost = False  # 初始状态为不置顶
 
         # 添加时间戳记录
-        self.last_ip_update = 0  # 上次IP更新时间
+        self.last_ip_update = time.time()  # 上次IP更新时间（上面刚获取过位置）
         self.last_moon_events_update = 0  # 上次月出月落更新时间
         self.last_location = self.location.copy()  # 保存上次位置信息用于比较
         
-        # 初始化Skyfield
+        # 添加Skyfield初始化状态（需在启动加载线程之前设置）
+        self.skyfield_error = None
+        
+        # 可选的计算子进程：启用后月出月落和日月食搜索在子进程中执行，子进程不可用时退回本进程
+        self.compute_worker = ComputeWorker() if self.load_compute_worker_enabled() else None
+        
+        # 月出月落和月食的事件时间窗缓存，时间跳转时只搜索缺失的时间段
+        self.moon_event_cache = EventHorizonCache(self.compute_moon_events)
+        # 关注城市列表：每次更新只计算一次地心月球位置，各城市只做站心改正和月出月落查询
+        self.watchlist = [WatchLocation(location, self.compute_rise_set)
+                          for location in self.load_watchlist()]
+        
+        # 月球轨迹（月出到月落的高度角/方位角曲线），按位置和当晚缓存
+        self.track_resolution = 10  # 轨迹采样间隔（分钟）
+        self.track_cache = {}  # 轨迹键 -> 轨迹数据
+        self.track_key = None  # 当前显示的轨迹键，页面据此判断是否需要重新获取
+        # 日月食全球搜索结果与位置无关，只缓存一次；本地情况按位置另行缓存
+        self.eclipse_cache = EventHorizonCache(self.compute_eclipses, chunk=timedelta(days=30),
+                                               max_span=timedelta(days=365))
+        self.local_eclipse_cache = {}  # (纬度, 经度, 食甚时间) -> 本地情况
+        
+        # 月面绘制参数变化缓慢，按计算时钟每disc_interval秒重新计算一次
+        self.disc_interval = 60
+        self.moon_disc = None
+        self.moon_disc_time = None
+        
+        # 初始化Skyfield - 使用单飞加载器，避免重复启动多个加载线程
+        self.ephemeris_loader = EphemerisLoader(self.load_ephemeris)
         self.init_skyfield_async()
+        
+        # 后台线程看门狗（更新、网络探测、星历加载），在run/run_server中启动
+        self.watchdog = ThreadWatchdog()
+        self.ephemeris_load_timeout = 900  # 星历下载可能较慢，单独给出较长的期限（秒）
 
-        self.eclipse_events = []  # 存储日月食事件
         self.last_eclipse_update = 0  # 上次日月食更新时间
         
         # 添加日月食类型映射
-        self.eclipse_types = {
-            3: "月偏食",
-            4: "月全食"
-        }
+        self.eclipse_types = ECLIPSE_TYPES
         
-        # 添加Skyfield初始化状态
-        self.skyfield_error = None
+        # 按配置文件中的性能配置覆盖以上默认值
+        self.reload_settings()
+        
+    def find_crossings(self, times, values, threshold):
+        """在采样序列中查找values穿过threshold的时刻（线性插值），返回[(UTC时间, 是否由大变小), ...]"""
+        import numpy as np
+        
+        diff = np.asarray(values) - threshold
+        crossings = []
+        for i in np.nonzero(np.sign(diff[:-1]) != np.sign(diff[1:]))[0]:
+            f = diff[i] / (diff[i] - diff[i + 1])
+            crossing = times[i] + (times[i + 1] - times[i]) * float(f)
+            crossings.append((crossing, bool(diff[i] > 0)))
+        return crossings
+
+    def sample_times(self, center, half_span_minutes, step_minutes=1):
+        """以center为中心按分钟采样，返回(Skyfield时间数组, UTC datetime列表)"""
+        import numpy as np
+        
+        t_center = ts.utc(center)
+        offsets = np.arange(-half_span_minutes, half_span_minutes + step_minutes, step_minutes) / 1440.0
+        times = ts.tt_jd(t_center.tt + offsets)
+        return times, list(times.utc_datetime())
+
+    def calculate_lunar_contacts(self, eclipse_time):
+        """计算月食的各个接触时刻（地心，与观测地点无关）"""
+        import numpy as np
+        
+        times, datetimes = self.sample_times(eclipse_time, 240)
+        e = earth.at(times)
+        m = e.observe(moon).apparent()
+        s = e.observe(sun).apparent()
+        moon_distance = m.distance().km
+        sun_distance = s.distance().km
+        
+        # 月球到反日点的角距，以及本影、半影半径（含1.02的大气放大系数）
+        d = np.pi - s.separation_from(m).radians
+        moon_radius = np.arcsin(1737.4 / moon_distance)
+        sun_radius = np.arcsin(696000.0 / sun_distance)
+        moon_parallax = np.arcsin(6378.14 / moon_distance)
+        sun_parallax = np.arcsin(6378.14 / sun_distance)
+        umbra = 1.02 * (moon_parallax + sun_parallax - sun_radius)
+        penumbra = 1.02 * (moon_parallax + sun_parallax + sun_radius)
+        
+        contacts = []
+        for name_in, name_out, threshold in (("半影食始", "半影食终", penumbra + moon_radius),
+                                              ("初亏", "复圆", umbra + moon_radius),
+                                              ("食既", "生光", umbra - moon_radius)):
+            for crossing, entering in self.find_crossings(datetimes, d - threshold, 0):
+                contacts.append((crossing, name_in if entering else name_out))
+        
+        i = int(np.argmin(d))
+        contacts.append((datetimes[i], "食甚"))
+        contacts.sort(key=lambda contact: contact[0])
+        # 本影食分，半影月食时改用半影食分
+        magnitude = (umbra[i] + moon_radius[i] - d[i]) / (2 * moon_radius[i])
+        if magnitude <= 0:
+            magnitude = (penumbra[i] + moon_radius[i] - d[i]) / (2 * moon_radius[i])
+        return tuple(contacts), round(float(magnitude), 3)
+
+    def search_eclipses(self, start, end):
+        """全局搜索[start, end]内的日月食（与观测地点无关，结果由事件时间窗缓存保存）
+        
+        返回[(UTC时间, (类型代码, 接触时刻, 食分)), ...]，类型代码与self.eclipse_types一致：
+        0-2为日食（只做全球判断，接触时刻在本地细化时计算），3-5为月食（接触时刻为地心时刻）
+        """
+        import numpy as np
+        from skyfield import almanac, eclipselib
+        
+        found = []
+        
+        # 月食：Skyfield内置搜索，再补算接触时刻
+        t, y, details = eclipselib.lunar_eclipses(ts.utc(start), ts.utc(end), eph)
+        for ti, yi in zip(t, y):
+            eclipse_time = ti.utc_datetime()
+            contacts, magnitude = self.calculate_lunar_contacts(eclipse_time)
+            found.append((eclipse_time, (int(yi) + 3, contacts, magnitude)))
         
-    def calculate_lunar_eclipses(self, start_time, end_time):
-        """计算月食事件"""
+        # 日食：在每次新月时判断地心日月角距是否足够小，使地球上某处能看到日食
+        t, y = almanac.find_discrete(ts.utc(start), ts.utc(end), almanac.moon_phases(eph))
+        new_moons = t[y == 0]
+        if len(new_moons):
+            e = earth.at(new_moons)
+            s = e.observe(sun).apparent()
+            m = e.observe(moon).apparent()
+            separation = s.separation_from(m).radians
+            sun_radius = np.arcsin(696000.0 / s.distance().km)
+            moon_radius = np.arcsin(1737.4 / m.distance().km)
+            parallax = np.arcsin(6378.14 / m.distance().km) - np.arcsin(6378.14 / s.distance().km)
+            for i in np.nonzero(separation < sun_radius + moon_radius + parallax)[0]:
+                if separation[i] < parallax[i]:
+                    # 影锥轴线扫过地球：月球视半径大于太阳为全食，否则为环食
+                    code = 2 if moon_radius[i] > sun_radius[i] else 1
+                else:
+                    code = 0
+                found.append((new_moons[i].utc_datetime(), (code, (), None)))
+        
+        found.sort(key=lambda event: event[0])
+        return found
+
+    def calculate_local_solar_eclipse(self, eclipse_time):
+        """本地日食情况：在新月前后各3小时按分钟采样站心日月角距，返回(类型代码, 接触时刻, 食分, 太阳高度角)或None"""
+        import numpy as np
+        from skyfield.api import wgs84
+        
+        observer = wgs84.latlon(self.location["latitude"], self.location["longitude"])
+        times, datetimes = self.sample_times(eclipse_time, 180)
+        o = (earth + observer).at(times)
+        s = o.observe(sun).apparent()
+        m = o.observe(moon).apparent()
+        separation = s.separation_from(m).radians
+        sun_radius = np.arcsin(696000.0 / s.distance().km)
+        moon_radius = np.arcsin(1737.4 / m.distance().km)
+        sun_altitude = s.altaz()[0].degrees
+        
+        i = int(np.argmin(separation))
+        if separation[i] >= sun_radius[i] + moon_radius[i]:
+            return None  # 本地看不到日食
+        
+        contacts = []
+        for crossing, entering in self.find_crossings(datetimes, separation - sun_radius - moon_radius, 0):
+            contacts.append((crossing, "初亏" if entering else "复圆"))
+        for crossing, entering in self.find_crossings(datetimes, separation - np.abs(sun_radius - moon_radius), 0):
+            contacts.append((crossing, "食既" if entering else "生光"))
+        contacts.append((datetimes[i], "食甚"))
+        contacts.sort(key=lambda contact: contact[0])
+        
+        if separation[i] < abs(sun_radius[i] - moon_radius[i]):
+            code = 2 if moon_radius[i] > sun_radius[i] else 1
+        else:
+            code = 0
+        magnitude = (sun_radius[i] + moon_radius[i] - separation[i]) / (2 * sun_radius[i])
+        
+        # 各接触时刻的太阳高度角（取最近的采样点）
+        altitudes = []
+        for contact_time, name in contacts:
+            j = min(range(len(datetimes)), key=lambda k: abs(datetimes[k] - contact_time))
+            altitudes.append(float(sun_altitude[j]))
+        return code, tuple(contacts), round(float(magnitude), 3), altitudes
+
+    def calculate_local_circumstances(self, eclipse_time, code, contacts, magnitude):
+        """日月食的本地情况（按位置和食甚时间缓存），位置变化时只重算这一步"""
+        key = (round(self.location["latitude"], 2), round(self.location["longitude"], 2), eclipse_time)
+        if key in self.local_eclipse_cache:
+            return self.local_eclipse_cache[key]
+        
+        if code >= 3:
+            # 月食：接触时刻与位置无关，只需一次矢量化计算各接触时刻的月球高度角
+            from skyfield.api import wgs84
+            observer = wgs84.latlon(self.location["latitude"], self.location["longitude"])
+            times = ts.from_datetimes([contact_time for contact_time, name in contacts])
+            altitudes = [float(a) for a in (earth + observer).at(times).observe(moon).apparent().altaz()[0].degrees]
+            local = (code, contacts, magnitude, altitudes)
+        else:
+            local = self.calculate_local_solar_eclipse(eclipse_time)
+        
+        if len(self.local_eclipse_cache) >= 64:
+            self.local_eclipse_cache.pop(next(iter(self.local_eclipse_cache)))
+        self.local_eclipse_cache[key] = local
+        return local
+
+    def format_eclipse(self, eclipse_time_utc, local):
+        """格式化一条日月食事件，local为calculate_local_circumstances的结果"""
+        code, contacts, magnitude, altitudes = local
+        eclipse_time_local = eclipse_time_utc.astimezone(self.local_tz)
+        return EclipseEvent(
+            eclipse_time_local.strftime("%m月%d日 %H:%M"),
+            self.eclipse_types.get(code, f"未知食({code})"),
+            code,
+            eclipse_time_utc.isoformat(),  # 转换为字符串
+            magnitude,
+            # 日食看太阳、月食看月亮是否在地平线以上
+            any(altitude > 0 for altitude in altitudes),
+            tuple((name, contact_time.astimezone(self.local_tz).strftime("%H:%M"), round(altitude, 1))
+                  for (contact_time, name), altitude in zip(contacts, altitudes))
+        )
+
+    def calculate_eclipse_events(self, start, end):
+        """计算日月食事件（全球搜索结果来自缓存，只对[start, end]内的事件做本地细化并格式化）"""
         try:
-            from skyfield import eclipselib
-            
-            # 计算月食
-            t, y, details = eclipselib.lunar_eclipses(start_time, end_time, eph)
+            self.eclipse_cache.ensure(start, end)
             
             eclipses = []
-            for ti, yi in zip(t, y):
-                # 转换时间为本地时区
-                eclipse_time_utc = ti.utc_datetime()
-                eclipse_time_local = eclipse_time_utc.replace(tzinfo=timezone.utc).astimezone(self.local_tz)
-                
-                # 获取月食类型
-                if yi == 0:
-                    eclipse_type = "半影月食"
-                elif yi == 1:
-                    eclipse_type = "月偏食"
-                elif yi == 2:
-                    eclipse_type = "月全食"
-                else:
-                    eclipse_type = f"未知月食({yi})"
-                
-                # 格式化事件信息
-                eclipse_info = {
-                    "time": eclipse_time_local.strftime("%m月%d日 %H:%M"),
-                    "type": eclipse_type,
-                    "raw_type": int(yi) + 3,  # 月食类型从3开始
-                    "time_utc": eclipse_time_utc.isoformat(),  # 转换为字符串
-                    "is_lunar": True
-                }
+            for eclipse_time_utc, (code, contacts, magnitude) in self.eclipse_cache.between(start, end):
+                local = self.calculate_local_circumstances(eclipse_time_utc, code, contacts, magnitude)
+                if local is None:
+                    # 日食在本地不可见（不在食带内）
+                    continue
                 
+                eclipse_info = self.format_eclipse(eclipse_time_utc, local)
                 eclipses.append(eclipse_info)
-                print(f"月食事件: {eclipse_info['time']} - {eclipse_info['type']}")
+                print(f"日月食事件: {eclipse_info.time} - {eclipse_info.type}")
             
             return eclipses
             
         except Exception as e:
-            print(f"计算月食事件错误: {e}")
+            print(f"计算日月食事件错误: {e}")
             import traceback
             traceback.print_exc()
             return []
         
     def calculate_eclipses(self):
-        """计算未来7天内的月食事件"""
+        """计算未来7天内的日月食事件"""
         try:
             global SKYFIELD_AVAILABLE, ts, eph
             
             if not SKYFIELD_AVAILABLE:
-                print("Skyfield不可用，无法计算月食")
-                self.eclipse_events = []
+                print("Skyfield不可用，无法计算日月食")
+                self.clear_eclipse_events()
                 return
                 
             # 检查星历数据是否可用
             if not self.verify_and_reload_ephemeris():
-                print("星历数据不可用，无法计算月食")
-                self.eclipse_events = []
+                print("星历数据不可用，无法计算日月食")
+                self.clear_eclipse_events()
                 return
                 
             # 获取当前时间（UTC）
-            now_utc = datetime.now(timezone.utc)
-            start_time = ts.utc(now_utc)
-            end_time = ts.utc(now_utc + timedelta(days=7))  # 未来7天
+            now_utc = self.clock.now()
+            end_utc = now_utc + timedelta(days=self.eclipse_horizon_days)  # 默认未来7天
             
-            print(f"查找月食事件的时间范围: {start_time.utc_datetime()} 到 {end_time.utc_datetime()}")
+            print(f"查找日月食事件的时间范围: {now_utc} 到 {end_utc}")
             
-            # 计算月食
-            lunar_eclipses = self.calculate_lunar_eclipses(start_time, end_time)
+            # 计算日月食
+            eclipses = self.calculate_eclipse_events(now_utc, end_utc)
             
             # 限制显示数量，最多显示5个
-            lunar_eclipses = lunar_eclipses[:5]
+            eclipses = eclipses[:5]
             
-            print(f"找到 {len(lunar_eclipses)} 个月食事件")
+            print(f"找到 {len(eclipses)} 个日月食事件")
             
-            self.eclipse_events = lunar_eclipses
+            self.eclipse_events = eclipses
             
         except Exception as e:
-            print(f"计算月食事件错误: {e}")
+            print(f"计算日月食事件错误: {e}")
             import traceback
             traceback.print_exc()
-            self.eclipse_events = []
+            self.clear_eclipse_events()
 
     def set_topmost(self, topmost):
         """设置窗口置顶状态"""
@@ -200,7 +2626,7 @@ class MoonWidget:
     def load_last_known_location(self):
         """加载上次已知的位置信息"""
         try:
-            config_path = os.path.join(os.path.dirname(__file__), 'moon_widget_config.json')
+            config_path = CONFIG_PATH
             if os.path.exists(config_path):
                 with open(config_path, 'r', encoding='utf-8') as f:
                     config = json.load(f)
@@ -211,162 +2637,345 @@ class MoonWidget:
             print(f"加载上次已知位置失败: {e}")
         return None
         
-    def save_last_known_location(self):
-        """保存当前已知的位置信息"""
+    def load_watchlist(self):
+        """从配置文件加载关注城市列表（可只填写经纬度，名称和时区由离线城市索引补全）"""
+        try:
+            config_path = CONFIG_PATH
+            if os.path.exists(config_path):
+                with open(config_path, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+                    return [self.resolve_location(location) for location in config.get('watchlist', [])]
+        except Exception as e:
+            print(f"加载关注城市失败: {e}")
+        return []
+
+    def set_watchlist(self, locations):
+        """设置关注城市列表（可从页面调用）并保存到配置文件"""
+        try:
+            locations = [self.resolve_location(location) for location in locations]
+            self.watchlist = [WatchLocation(location, self.compute_rise_set) for location in locations]
+            update_config({'watchlist': locations})
+            self.wake_event.set()
+            return True
+        except Exception as e:
+            print(f"保存关注城市失败: {e}")
+            return False
+
+    def calculate_watchlist(self, now_utc):
+        """计算所有关注城市的月球高度角、方位角和下一次月出/月落
+        
+        地心视位置和恒星时每次只算一次，各城市只做解析的站心改正，因此成本几乎不随城市数量增加
+        """
+        if not self.watchlist or not SKYFIELD_AVAILABLE or eph is None:
+            return []
+        try:
+            t = ts.utc(now_utc)
+            ra, dec, distance = earth.at(t).observe(moon).apparent().radec(epoch='date')
+            ra_hours, dec_degrees, distance_km, gast = ra.hours, dec.degrees, distance.km, t.gast
+            
+            rows = []
+            for watch in self.watchlist:
+                altitude, azimuth = watch.topocentric_altaz(ra_hours, dec_degrees, distance_km, gast)
+                next_event = watch.next_event(now_utc)
+                rows.append({
+                    "name": watch.name,
+                    "altitude": altitude,
+                    "azimuth": azimuth,
+                    "next_event": ("月出" if next_event[0] == "rise" else "月落") if next_event else "--",
+                    "next_time": next_event[1].strftime("%H:%M") if next_event else "--:--"
+                })
+            return rows
+        except Exception as e:
+            print(f"计算关注城市错误: {e}")
+            return []
+
+    def reload_settings(self):
+        """读取配置文件中的性能配置并应用，配置文件变化时由ConfigWatcher调用"""
+        config = {}
+        try:
+            if os.path.exists(CONFIG_PATH):
+                with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+        except Exception as e:
+            # 文件正在被编辑或格式错误时保持当前配置
+            print(f"读取配置文件失败，保持当前配置: {e}")
+            return
+        settings, errors = validate_settings(config, self.profile)
+        for error in errors:
+            print(f"配置错误: {error}")
+        self.endpoints = resolve_endpoints(config)
+        self.base_settings = settings
+        self.power_manager.configure(settings)
+        self.apply_settings(power_adjusted_settings(settings, self.power_mode))
+
+    def set_power_mode(self, mode):
+        """切换省电档位（由PowerManager调用）"""
+        self.power_mode = mode
+        if self.base_settings:
+            self.apply_settings(power_adjusted_settings(self.base_settings, mode))
+
+    def apply_settings(self, settings):
+        """应用已校验的配置项，只处理发生变化的项"""
+        changed = {name: value for name, value in settings.items() if getattr(self, name, None) != value}
+        if not changed:
+            return
+        for name, value in changed.items():
+            setattr(self, name, value)
+        print(f"配置已更新: {changed}")
+        # 搜索窗口变化时立即重新计算，其余项在下一次循环中生效
+        if "moon_event_horizon_hours" in changed or "moon_events_interval" in changed:
+            self.last_moon_events_update = 0
+        if "eclipse_horizon_days" in changed or "eclipse_interval" in changed:
+            self.last_eclipse_update = 0
+        self.wake_event.set()
+
+    def start_config_watcher(self):
+        """启动配置文件热加载和电源状态监控"""
+        if self.config_watcher is None:
+            self.config_watcher = ConfigWatcher(CONFIG_PATH, self.reload_settings)
+            self.config_watcher.start()
+            self.power_manager.start()
+
+    def load_manual_location(self):
+        """加载手动设置的坐标，未设置返回None"""
         try:
-            config_path = os.path.join(os.path.dirname(__file__), 'moon_widget_config.json')
-            config = {}
+            config_path = CONFIG_PATH
             if os.path.exists(config_path):
                 with open(config_path, 'r', encoding='utf-8') as f:
                     config = json.load(f)
+                    if config.get('manual_location'):
+                        print("使用手动设置的坐标")
+                        return self.resolve_location(config['manual_location'])
+        except Exception as e:
+            print(f"加载手动坐标失败: {e}")
+        return None
+
+    def resolve_location(self, location):
+        """补全位置信息：缺少名称时用离线城市索引的最近城市命名，缺少时区时按坐标离线推断"""
+        location = dict(location)
+        if location.get("name") and location.get("timezone"):
+            return location
+        city = self.city_index.nearest(location["latitude"], location["longitude"])
+        if city is None:
+            if not location.get("name"):
+                location["name"] = f"{location['latitude']:.2f}°, {location['longitude']:.2f}°"
+        elif not location.get("name"):
+            if city["distance_km"] <= 30:
+                location["name"] = f"{city['name']}, {city['country']}"
+            else:
+                location["name"] = f"{city['name']}附近{city['distance_km']:.0f}km, {city['country']}"
+        if not location.get("timezone"):
+            location["timezone"] = self.resolve_timezone(location["latitude"], location["longitude"], city)
+        return location
+
+    def resolve_timezone(self, latitude, longitude, city=None):
+        """按坐标离线推断IANA时区
+        
+        依次使用：时区边界多边形 -> 500km内最近城市的时区（仅在没有边界数据时） -> 按经度划分的航海时区（Etc/GMT±N）
+        """
+        tzid = self.timezone_index.lookup(latitude, longitude)
+        if tzid:
+            return tzid
+        if not self.timezone_index.available:
+            city = city or self.city_index.nearest(latitude, longitude)
+            if city and city["distance_km"] <= 500:
+                return city["timezone"]
+        # 有边界数据但不在任何多边形内（公海、近海）：不归入附近陆地的时区
+        # Etc时区的符号与UTC偏移相反，例如东八区为Etc/GMT-8
+        offset = int(round(longitude / 15.0))
+        return "Etc/GMT" if offset == 0 else f"Etc/GMT{-offset:+d}"
+
+    def set_manual_location(self, latitude, longitude, name=None, timezone_name=None, persist=True):
+        """手动设置坐标（可从页面调用），名称和时区可省略，由离线城市索引推断
+        
+        persist为False时只在本次运行中使用，不写入配置文件（命令行--location）
+        """
+        try:
+            location = {"latitude": float(latitude), "longitude": float(longitude)}
+            if not -90 <= location["latitude"] <= 90 or not -180 <= location["longitude"] <= 180:
+                print(f"坐标超出范围: {latitude}, {longitude}")
+                return None
+            if name:
+                location["name"] = name
+            if timezone_name:
+                get_timezone(timezone_name)  # 校验时区名称
+                location["timezone"] = timezone_name
+            location = self.resolve_location(location)
+            
+            if persist:
+                update_config({'manual_location': location})
             
+            # 页面调用在pywebview的桥接线程中执行，位置交给数据更新线程切换
+            self.manual_location = location
+            self.request_location(location)
+            return location
+        except Exception as e:
+            print(f"设置手动坐标失败: {e}")
+            return None
+
+    def clear_manual_location(self):
+        """取消手动坐标，恢复IP定位"""
+        try:
+            update_config(remove=('manual_location',))
+            self.manual_location = None
+            self.last_ip_update = 0  # 下次更新时立即重新定位
+            self.wake_event.set()
+            return True
+        except Exception as e:
+            print(f"取消手动坐标失败: {e}")
+            return False
+
+    def save_last_known_location(self):
+        """保存当前已知的位置信息"""
+        try:
             # 确保self.location存在
             if hasattr(self, 'location') and self.location:
-                config['last_known_location'] = self.location
-            
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
-                
+                update_config({'last_known_location': self.location})
             print("保存位置信息到配置文件")
         except Exception as e:
             print(f"保存位置信息失败: {e}")
     
-    def init_skyfield_async(self):
-        """在后台线程中初始化Skyfield"""
-        def init_skyfield():
-            global SKYFIELD_AVAILABLE, ts, eph, sun, moon, earth
-            try:
-                from skyfield.api import load, wgs84
-                from skyfield import almanac
-                
-                # 指定本地星历表文件路径
-                de421_path = os.path.join(os.path.dirname(__file__), 'de421.bsp')
-                
-                # 检查网络状态，如果网络不可用，只尝试从本地加载
-                if not self.network_available:
-                    if os.path.exists(de421_path):
-                        print("网络不可用，从本地加载星历数据...")
-                        ts = load.timescale()
-                        eph = load(de421_path)
-                        sun, moon, earth = eph['sun'], eph['moon'], eph['earth']
-                        SKYFIELD_AVAILABLE = True
-                        print("从本地加载星历数据成功")
-                    else:
-                        SKYFIELD_AVAILABLE = False
-                        self.skyfield_error = "网络不可用且本地无星历数据文件"
-                        print("网络不可用且本地无星历数据文件，Skyfield初始化失败")
-                    return
-                
-                # 网络可用时，尝试从本地加载，失败则从网络下载
-                if os.path.exists(de421_path):
-                    print("从本地加载星历数据...")
-                    ts = load.timescale()
-                    eph = load(de421_path)
-                else:
-                    print("从网络加载星历数据，请耐心等待...")
-                    ts = load.timescale()
-                    eph = load('de421.bsp')
-                
-                sun, moon, earth = eph['sun'], eph['moon'], eph['earth']
-                SKYFIELD_AVAILABLE = True
-                print("Skyfield初始化完成")
-                
-                # 通知主线程初始化完成
-                if self.window:
-                    try:
-                        self.window.evaluate_js("document.getElementById('loading-status').textContent = 'Skyfield初始化完成';")
-                    except:
-                        pass
-                        
-            except ImportError:
-                SKYFIELD_AVAILABLE = False
-                self.skyfield_error = "skyfield库未安装，无法计算精确数据"
-                print("skyfield库未安装，无法计算精确数据")
-                print("要获得精确结果，请安装: pip install skyfield")
-            except Exception as e:
-                SKYFIELD_AVAILABLE = False
-                self.skyfield_error = f"加载skyfield时出错: {e}"
-                print(f"加载skyfield时出错: {e}")
-        
-        # 在后台线程中初始化Skyfield
-        skyfield_thread = threading.Thread(target=init_skyfield)
-        skyfield_thread.daemon = True
-        skyfield_thread.start()
-        
-    def verify_and_reload_ephemeris(self):
-        """验证星历数据并必要时重新加载"""
+    def init_skyfield_async(self, force=False):
+        """在后台线程中初始化Skyfield（同一时间只运行一个加载任务）"""
+        return self.ephemeris_loader.start(force=force)
+
+    def load_ephemeris(self):
+        """加载星历数据，由EphemerisLoader在后台线程中调用"""
         global SKYFIELD_AVAILABLE, ts, eph, sun, moon, earth
-        
         try:
-            # 检查星历数据是否有效
-            if eph is None:
-                raise Exception("星历数据未初始化")
-                
-            # 尝试使用星历数据进行简单计算
-            from skyfield.api import load
-            test_ts = load.timescale()
-            test_time = test_ts.utc(datetime.now(timezone.utc))
-            
-            # 尝试计算月球位置
-            astrometric = eph['earth'].at(test_time).observe(eph['moon'])
-            apparent = astrometric.apparent()
-            
-            # 如果计算成功，星历数据有效
-            print("星历数据验证成功")
+            from skyfield.api import load, wgs84
+            from skyfield import almanac
+        except ImportError:
+            SKYFIELD_AVAILABLE = False
+            self.skyfield_error = "skyfield库未安装，无法计算精确数据"
+            print("skyfield库未安装，无法计算精确数据")
+            print("要获得精确结果，请安装: pip install skyfield")
+            return False
+
+        # 当前星历仍然可用时（如网络恢复后触发的加载）不重复打开星历文件
+        if eph is not None and self.ephemeris_ok():
+            SKYFIELD_AVAILABLE = True
+            self.skyfield_error = None
             return True
-            
-        except Exception as e:
-            print(f"星历数据验证失败: {e}")
-            print("尝试重新加载星历数据...")
-            
-            try:
-                # 尝试重新加载星历数据
-                de421_path = os.path.join(os.path.dirname(__file__), 'de421.bsp')
+        
+        # 指定本地星历表文件路径
+        de421_path = os.path.join(os.path.dirname(__file__), 'de421.bsp')
+        # 时间尺度（闰秒和ΔT表）只加载一次，重新加载星历时复用
+        if ts is None:
+            ts = load.timescale()
+
+        try:
+            # 检查网络状态，如果网络不可用，只尝试从本地加载
+            if not self.network_available:
                 if os.path.exists(de421_path):
-                    # 从本地加载
-                    from skyfield.api import load
-                    ts = load.timescale()
+                    print("网络不可用，从本地加载星历数据...")
                     eph = load(de421_path)
-                elif self.network_available:
-                    # 只有网络可用时才尝试从网络下载
-                    from skyfield.api import load
-                    ts = load.timescale()
-                    eph = load('de421.bsp')
+                    sun, moon, earth = eph['sun'], eph['moon'], eph['earth']
+                    SKYFIELD_AVAILABLE = True
+                    self.skyfield_error = None
+                    print("从本地加载星历数据成功")
+                    return True
                 else:
-                    # 网络不可用且本地无星历数据文件
-                    print("无法加载星历数据: 网络不可用且本地无星历数据文件")
                     SKYFIELD_AVAILABLE = False
+                    self.skyfield_error = "网络不可用且本地无星历数据文件"
+                    print("网络不可用且本地无星历数据文件，Skyfield初始化失败")
+                    # 网络恢复时check_network_status会重新触发加载
                     return False
-                    
-                sun, moon, earth = eph['sun'], eph['moon'], eph['earth']
-                SKYFIELD_AVAILABLE = True
-                print("星历数据重新加载成功")
-                return True
-            except Exception as reload_error:
-                print(f"星历数据重新加载失败: {reload_error}")
+
+            # 网络可用时，尝试从本地加载，失败则从网络下载
+            if os.path.exists(de421_path):
+                print("从本地加载星历数据...")
+                eph = load(de421_path)
+            elif not self.ephemeris_download_enabled:
                 SKYFIELD_AVAILABLE = False
+                self.skyfield_error = "本地无星历数据文件，且当前不允许下载"
+                print("本地无星历数据文件，且当前不允许下载，Skyfield初始化失败")
                 return False
-                
+            else:
+                print("从网络加载星历数据，请耐心等待...")
+                # 不交给skyfield下载：它固定写入de421.bsp.download，被放弃的线程会与重新加载的线程写同一个文件
+                download_file(load.build_url('de421.bsp'), de421_path, 60)
+                eph = load(de421_path)
+
+            sun, moon, earth = eph['sun'], eph['moon'], eph['earth']
+            SKYFIELD_AVAILABLE = True
+            self.skyfield_error = None
+            print("Skyfield初始化完成")
+        except Exception as e:
+            SKYFIELD_AVAILABLE = False
+            self.skyfield_error = f"加载skyfield时出错: {e}"
+            # 抛给加载器，按退避时间重试
+            raise
+
+        # 通知主线程初始化完成
+        if self.window:
+            try:
+                self.window.evaluate_js("document.getElementById('loading-status').textContent = 'Skyfield初始化完成';")
+            except:
+                pass
+        return True
+
+    def ephemeris_ok(self):
+        """用当前星历做一次月球位置计算，成功返回True（使用已加载的全局时间尺度和天体，不创建新对象）"""
+        try:
+            if eph is None:
+                raise Exception("星历数据未初始化")
+            earth.at(ts.utc(self.clock.now())).observe(moon).apparent()
+            return True
+        except Exception as e:
+            print(f"星历数据验证失败: {e}")
+            return False
+
+    def verify_and_reload_ephemeris(self):
+        """验证星历数据并必要时重新加载"""
+        global SKYFIELD_AVAILABLE
+        
+        if self.ephemeris_ok():
+            return True
+        
+        print("尝试重新加载星历数据...")
+        # 交给单飞加载器重新加载（已有加载在进行时复用该任务），限时等待结果
+        SKYFIELD_AVAILABLE = False
+        self.init_skyfield_async()
+        if not self.ephemeris_loader.wait(timeout=10):
+            print("星历数据重新加载超时，稍后重试")
+            return False
+        if SKYFIELD_AVAILABLE:
+            print("星历数据重新加载成功")
+        else:
+            print("星历数据重新加载失败")
+        return SKYFIELD_AVAILABLE
+
+    def load_endpoints(self):
+        """读取配置文件中的服务地址（初始化时在首次联网定位之前调用，之后随配置文件热加载更新）"""
+        try:
+            if os.path.exists(CONFIG_PATH):
+                with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                    return resolve_endpoints(json.load(f))
+        except Exception as e:
+            print(f"读取服务地址配置失败: {e}")
+        return dict(DEFAULT_ENDPOINTS)
+
     def check_network_status(self):
         """检查网络连接状态"""
         try:
             # 尝试连接到一个可靠的网站
-            urlopen('https://www.baidu.com', timeout=3)
+            probe_url(self.endpoints["network_check"], self.endpoints["timeout"])
             was_offline = not self.network_available
             self.network_available = True
             
-            # 如果之前是离线状态，现在恢复在线，重新初始化Skyfield
-            if was_offline:
+            # 如果之前是离线状态，现在恢复在线，且星历数据尚未加载，重新初始化Skyfield
+            if was_offline and not SKYFIELD_AVAILABLE:
                 print("网络恢复，重新初始化Skyfield...")
-                self.init_skyfield_async()
+                self.init_skyfield_async(force=True)
                 
             return True
         except:
             was_online = self.network_available
             self.network_available = False
             
-            # 如果之前是在线状态，现在变为离线，尝试使用本地星历数据
-            if was_online:
+            # 如果之前是在线状态，现在变为离线，且星历数据尚未加载，尝试使用本地星历数据
+            if was_online and not SKYFIELD_AVAILABLE:
                 print("网络断开，尝试使用本地星历数据...")
                 # 检查本地是否有星历数据文件
                 de421_path = os.path.join(os.path.dirname(__file__), 'de421.bsp')
@@ -381,23 +2990,15 @@ class MoonWidget:
         try:
             # 检查网络状态
             if not self.check_network_status():
+                # 返回None，由get_location回退到上次已知位置（不能把位置字典当作IP继续查询）
                 print("网络不可用，使用上次已知位置")
-                if self.last_known_location:
-                    return self.last_known_location
-                else:
-                    return None
+                return None
                     
             # 尝试通过多个服务获取IP，增加成功率
-            services = [
-                'https://api.ipify.org',
-                'https://ident.me',
-                'https://checkip.amazonaws.com'
-            ]
-            
-            for service in services:
+            for service in self.endpoints["public_ip"]:
                 try:
                     # 添加超时参数
-                    ip = urlopen(service, timeout=3).read().decode('utf8').strip()
+                    ip = fetch_url(service, self.endpoints["timeout"]).decode('utf8').strip()
                     if ip and len(ip.split('.')) == 4:
                         return ip
                 except Exception as e:
@@ -419,12 +3020,12 @@ class MoonWidget:
                 if os.path.exists(db_path):
                     with geoip2.database.Reader(db_path) as reader:
                         response = reader.city(ip_address)
-                        location_data = {
-                            'name': f"{response.city.name if response.city.name else '未知'}, {response.country.name if response.country.name else '未知'}",
+                        location_data = self.resolve_location({
+                            'name': f"{response.city.name}, {response.country.name if response.country.name else '未知'}" if response.city.name else None,
                             'latitude': response.location.latitude,
                             'longitude': response.location.longitude,
-                            'timezone': response.location.time_zone if response.location.time_zone else 'Asia/Shanghai'
-                        }
+                            'timezone': response.location.time_zone
+                        })
                         # 保存为上次已知位置
                         self.last_known_location = location_data
                         self.save_last_known_location()
@@ -434,15 +3035,17 @@ class MoonWidget:
             
             # 方法2: 使用在线API (ipapi.co)
             try:
-                response = requests.get(f'https://ipapi.co/{ip_address}/json/', timeout=3)
-                data = response.json()
+                timeout = self.endpoints["timeout"]
+                deadline = time.monotonic() + timeout
+                with requests.get(self.endpoints["ip_location"].format(ip=ip_address), timeout=timeout, stream=True) as response:
+                    data = json.loads(read_body(response.iter_content(4096), deadline))
                 if 'error' not in data:
-                    location_data = {
-                        'name': f"{data.get('city', '未知')}, {data.get('country_name', '未知')}",
+                    location_data = self.resolve_location({
+                        'name': f"{data['city']}, {data.get('country_name', '未知')}" if data.get('city') else None,
                         'latitude': data.get('latitude', 31.2304),
                         'longitude': data.get('longitude', 121.4737),
-                        'timezone': data.get('timezone', 'Asia/Shanghai')
-                    }
+                        'timezone': data.get('timezone')
+                    })
                     # 保存为上次已知位置
                     self.last_known_location = location_data
                     self.save_last_known_location()
@@ -455,9 +3058,108 @@ class MoonWidget:
             print(f"通过IP获取位置失败: {e}")
             return None
     
-    def get_location(self):
-        """尝试获取位置信息，失败则使用默认位置（上海）"""
+    def load_location_provider(self):
+        """按配置文件中的"location_provider"创建定位源"""
+        try:
+            if os.path.exists(CONFIG_PATH):
+                with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                    config = json.load(f).get('location_provider')
+                if config:
+                    config = dict(config)
+                    self.gps_threshold_km = config.pop('threshold_km', self.gps_threshold_km)
+                    self.gps_confirm_fixes = config.pop('confirm_fixes', self.gps_confirm_fixes)
+                    self.location_provider = create_location_provider(config)
+        except Exception as e:
+            print(f"加载定位源配置失败: {e}")
+
+    def on_location_fix(self, latitude, longitude):
+        """收到一次GPS定位（在定位源线程中调用）
+        
+        滞回：第一次定位立即采用；之后只有连续gps_confirm_fixes次定位都偏离已采用位置超过gps_threshold_km才切换，
+        GPS抖动和单点跳变不会触发月出月落重算。
+        """
+        if self.gps_location is not None:
+            moved = self.distance_km(self.gps_location["latitude"], self.gps_location["longitude"],
+                                     latitude, longitude) > self.gps_threshold_km
+            self.gps_pending = self.gps_pending + 1 if moved else 0
+            if self.gps_pending < self.gps_confirm_fixes:
+                return
+        self.gps_pending = 0
+        self.gps_location = self.resolve_location({"latitude": latitude, "longitude": longitude})
+        if not self.manual_location:
+            # 交给数据更新线程切换，不在定位源线程中清空位置相关的缓存
+            self.request_location(self.gps_location)
+
+    @staticmethod
+    def distance_km(lat1, lon1, lat2, lon2):
+        """两点间大圆距离（km）"""
+        phi1, phi2 = math.radians(lat1), math.radians(lat2)
+        a = (math.sin((phi2 - phi1) / 2) ** 2 +
+             math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+        return 2 * 6371.0 * math.asin(min(1.0, math.sqrt(a)))
+
+    def load_network_locations(self):
+        """加载按网络指纹记住的定位结果"""
+        try:
+            if os.path.exists(CONFIG_PATH):
+                with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                    return json.load(f).get('network_locations', {})
+        except Exception as e:
+            print(f"加载网络定位缓存失败: {e}")
+        return {}
+
+    def remember_network_location(self, public_ip, location):
+        """记住当前网络（网关MAC/WiFi名称）下的公网IP和定位结果，重新连接该网络时直接使用"""
+        key = NetworkChangeWatcher.fingerprint(self.network_state)
+        if key is None:
+            return
+        entry = {"public_ip": public_ip, "location": location}
+        if self.network_locations.get(key) == entry:
+            return
+        self.network_locations[key] = entry
+        try:
+            update_config({'network_locations': dict(self.network_locations)})
+        except Exception as e:
+            print(f"保存网络定位缓存失败: {e}")
+
+    def on_network_changed(self, state):
+        """网络环境变化（由NetworkChangeWatcher调用）：已知网络直接切换到记住的位置，未知网络立即重新定位"""
+        self.network_state = state
+        if self.manual_location or (self.location_provider and self.location_provider.has_fix()):
+            return
+        entry = self.network_locations.get(NetworkChangeWatcher.fingerprint(state))
+        if entry:
+            print(f"已知网络，使用记住的位置: {entry['location']['name']}")
+            self.last_ip_update = time.time()
+            self.request_location(entry["location"])
+        else:
+            self.last_ip_update = 0  # 下次更新时重新查询公网IP和定位
+            self.wake_event.set()
+
+    def get_location(self, prefer_cached=False):
+        """尝试获取位置信息，失败则使用默认位置（上海）
+        
+        prefer_cached为True时，如果当前网络之前定位过，直接返回记住的结果而不发起网络请求
+        """
         try:
+            # 手动设置的坐标优先，无需联网定位
+            if getattr(self, 'manual_location', None):
+                return self.manual_location
+            
+            # GPS定位源有近期定位时使用GPS位置
+            if self.location_provider and self.gps_location and self.location_provider.has_fix():
+                return self.gps_location
+            
+            if prefer_cached:
+                if self.network_state is None and self.last_known_location:
+                    # 启动时网络状态尚未读取：先用上次已知位置，网络监视器首次读取后再切换到记住的位置或重新定位
+                    print(f"使用上次已知位置: {self.last_known_location['name']}")
+                    return self.last_known_location
+                entry = self.network_locations.get(NetworkChangeWatcher.fingerprint(self.network_state))
+                if entry:
+                    print(f"已知网络，使用记住的位置: {entry['location']['name']}")
+                    return entry["location"]
+            
             # 获取公网IP
             public_ip = self.get_public_ip()
             if public_ip:
@@ -467,6 +3169,7 @@ class MoonWidget:
                 location = self.get_location_from_ip(public_ip)
                 if location:
                     print(f"通过IP获取位置成功: {location['name']}")
+                    self.remember_network_location(public_ip, location)
                     return location
             
             # 如果通过IP获取失败，尝试使用上次已知位置
@@ -502,9 +3205,9 @@ class MoonWidget:
                 }
     
     def update_location_periodically(self):
-        """每10秒更新一次位置信息，如果位置变化则标记需要更新月出月落时间"""
+        """网络变化后或每location_check_interval秒（默认30分钟）更新一次位置信息，如果位置变化则标记需要更新月出月落时间"""
         current_time = time.time()
-        if current_time - self.last_ip_update >= 10:  # 10秒更新一次
+        if current_time - self.last_ip_update >= self.location_check_interval:
             print("更新位置信息...")
             new_location = self.get_location()
             if new_location:
@@ -516,16 +3219,159 @@ class MoonWidget:
                 )
                 
                 if location_changed:
-                    print(f"位置已更新: {new_location['name']}")
-                    self.location = new_location
-                    self.local_tz = pytz.timezone(self.location["timezone"])
-                    # 位置变化时需要重新计算月出月落
-                    self.last_moon_events_update = 0  # 强制下次更新月出月落
-                    # 位置变化时也需要更新月食信息
-                    self.last_eclipse_update = 0  # 新增：强制下次更新月食信息
-                    self.last_location = self.location.copy()  # 更新上次位置信息
+                    self.apply_location(new_location)
             self.last_ip_update = current_time
     
+    def request_location(self, new_location):
+        """从其他线程（网络监视器、定位源、页面）切换位置：只记下新位置并唤醒数据更新线程，
+        依赖位置的缓存只由数据更新线程修改，不会在搜索进行中被清空或存入旧位置的结果"""
+        with self.location_lock:
+            self.pending_location = new_location
+        self.wake_event.set()
+
+    def apply_pending_location(self):
+        """在数据更新线程中应用其他线程提交的新位置"""
+        with self.location_lock:
+            new_location, self.pending_location = self.pending_location, None
+        if new_location is not None and new_location != self.location:
+            self.apply_location(new_location)
+
+    def apply_location(self, new_location):
+        """切换到新位置，并使依赖位置的计算结果失效（只在数据更新线程中调用）"""
+        print(f"位置已更新: {new_location['name']}")
+        self.location = new_location
+        self.local_tz = get_timezone(self.location["timezone"])
+        # 位置变化时需要重新计算月出月落，月出月落缓存与观察者位置相关
+        self.moon_event_cache.clear()
+        self.track_cache.clear()
+        self.moon_disc_time = None  # 亮边方向与观察者纬度有关
+        self.last_moon_events_update = 0  # 强制下次更新月出月落
+        # 位置变化时也需要更新月食信息（月食搜索结果与位置无关，只需按新时区重新格式化）
+        self.last_eclipse_update = 0  # 新增：强制下次更新月食信息
+        self.last_location = self.location.copy()  # 更新上次位置信息
+        self.wake_event.set()
+    
+    def load_compute_worker_enabled(self):
+        """配置文件中"compute_worker"为true或命令行带--compute-worker时启用计算子进程"""
+        if "--compute-worker" in sys.argv:
+            return True
+        try:
+            if os.path.exists(CONFIG_PATH):
+                with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                    return bool(json.load(f).get('compute_worker', False))
+        except Exception as e:
+            print(f"读取计算进程配置失败: {e}")
+        return False
+
+    def compute(self, method, *args):
+        """执行耗时的Skyfield搜索：启用计算子进程时在子进程中执行，否则（或子进程不可用时）在本进程执行"""
+        if self.compute_worker is not None:
+            try:
+                # 等待子进程的时间须小于本线程的看门狗期限，超时后本线程仍有时间在本进程计算
+                return self.compute_worker.call(method, *args, timeout=self.watchdog_timeout / 3)
+            except Exception as e:
+                print(f"计算进程执行{method}失败，改在本进程计算: {e}")
+        return getattr(self, method)(*args)
+
+    def compute_moon_events(self, start, end):
+        """当前位置的月球事件搜索（事件时间窗缓存的搜索函数）"""
+        return self.compute("search_moon_events", start, end, self.location)
+
+    def compute_rise_set(self, location, start, end):
+        """关注城市的月出月落搜索"""
+        return self.compute("search_rise_set", location, start, end)
+
+    def compute_eclipses(self, start, end):
+        """日月食全局搜索"""
+        return self.compute("search_eclipses", start, end)
+
+    def search_rise_set(self, location, start, end):
+        """只搜索指定位置[start, end]内的月出月落，返回[(UTC时间, "rise"/"set"), ...]"""
+        from skyfield import almanac
+        from skyfield.api import wgs84
+        
+        observer = wgs84.latlon(location["latitude"], location["longitude"])
+        f = almanac.risings_and_settings(eph, moon, observer)
+        times, events = almanac.find_discrete(ts.utc(start), ts.utc(end), f)
+        return [(t.utc_datetime(), "rise" if event == 1 else "set") for t, event in zip(times, events)]
+
+    def search_moon_phases(self, start, end):
+        """搜索[start, end]内的主要月相，返回[(UTC时间, 月相代码), ...]，代码见MOON_PHASE_NAMES"""
+        from skyfield import almanac
+        
+        times, phases = almanac.find_discrete(ts.utc(start), ts.utc(end), almanac.moon_phases(eph))
+        return [(t.utc_datetime(), int(phase)) for t, phase in zip(times, phases)]
+
+    def search_moon_events(self, start, end, location=None):
+        """搜索location（默认当前位置）[start, end]内的月出、月落、中天（含最大高度角）和天文昏影起止
+        
+        返回按时间排序的[(UTC时间, (类型, 附加值)), ...]，类型为
+        "rise"、"set"、"transit"（附加值为中天高度角）、"dark_start"、"dark_end"（太阳低于-18°的起止）
+        """
+        from skyfield import almanac
+        from skyfield.api import wgs84
+        
+        print(f"查找月球事件的时间范围: {start} 到 {end}")
+        location = location or self.location
+        observer = wgs84.latlon(location["latitude"], location["longitude"])
+        t0, t1 = ts.utc(start), ts.utc(end)
+        
+        # 月出月落
+        found = [(event_time, (kind, None)) for event_time, kind in self.search_rise_set(location, start, end)]
+        
+        # 上中天，同时一次性算出各中天时刻的高度角（即当次最大高度角）
+        f = almanac.meridian_transits(eph, moon, observer)
+        times, events = almanac.find_discrete(t0, t1, f)
+        upper = times[events == 1]
+        if len(upper):
+            alt, _, _ = (earth + observer).at(upper).observe(moon).apparent().altaz()
+            found += [(t.utc_datetime(), ("transit", round(float(a), 1)))
+                      for t, a in zip(upper, alt.degrees)]
+        
+        # 天文昏影：状态0表示太阳低于-18°（完全天黑）
+        f = almanac.dark_twilight_day(eph, observer)
+        times, events = almanac.find_discrete(t0, t1, f)
+        previous = int(f(t0))
+        for t, event in zip(times, events):
+            if event == 0:
+                found.append((t.utc_datetime(), ("dark_start", None)))
+            elif previous == 0:
+                found.append((t.utc_datetime(), ("dark_end", None)))
+            previous = int(event)
+        
+        found.sort(key=lambda event: event[0])
+        return found
+
+    def find_viewing_window(self, rise_time, set_time):
+        """计算月球在地平线上且太阳低于-18°的时间段（最佳观测窗口），返回最长的一段(开始, 结束)或None"""
+        # 判断月出时是否已经天黑：取月出前最后一个天黑边界。月出可能早于find_track_window搜索的起点
+        # （now - 30小时），先确保缓存覆盖实际查询的范围
+        self.moon_event_cache.ensure(rise_time - timedelta(hours=30), set_time)
+        events = self.moon_event_cache.between(rise_time - timedelta(hours=30), set_time)
+        dark = False
+        for event_time, (kind, _) in events:
+            if event_time > rise_time:
+                break
+            if kind in ("dark_start", "dark_end"):
+                dark = kind == "dark_start"
+        
+        windows = []
+        window_start = rise_time if dark else None
+        for event_time, (kind, _) in events:
+            if event_time <= rise_time:
+                continue
+            if kind == "dark_start":
+                window_start = event_time
+            elif kind == "dark_end" and window_start is not None:
+                windows.append((window_start, event_time))
+                window_start = None
+        if window_start is not None:
+            windows.append((window_start, set_time))
+        
+        if not windows:
+            return None
+        return max(windows, key=lambda window: window[1] - window[0])
+
     def calculate_moon_events_with_skyfield(self):
         """使用skyfield库精确计算月出月落时间"""
         try:
@@ -540,53 +3386,38 @@ class MoonWidget:
             if eph is None:
                 raise Exception("星历数据未加载")
                 
-            # 创建观察者位置
-            from skyfield.api import wgs84
-            observer = wgs84.latlon(self.location["latitude"], self.location["longitude"])
-            
             # 获取当前时间（UTC）- 修复：使用有时区的时间
-            now_utc = datetime.now(timezone.utc)
-            t0 = ts.utc(now_utc)
+            now_utc = self.clock.now()
             
-            # 计算未来72小时内的月出月落事件（增加时间范围）
-            t1 = ts.utc(now_utc + timedelta(hours=72))
-            
-            print(f"查找月出月落事件的时间范围: {t0.utc_datetime()} 到 {t1.utc_datetime()}")
-            
-            # 查找月出月落事件
-            from skyfield import almanac
-            f = almanac.risings_and_settings(eph, moon, observer)
-            times, events = almanac.find_discrete(t0, t1, f)
+            # 未来72小时（可配置）内的月出月落事件，从时间窗缓存中取出，时间跳转时只搜索缺失部分
+            horizon_end = now_utc + timedelta(hours=self.moon_event_horizon_hours)
+            self.moon_event_cache.ensure(now_utc, horizon_end)
+            found = self.moon_event_cache.between(now_utc, horizon_end)
+            rise_set = [(event_time, kind) for event_time, (kind, _) in found if kind in ("rise", "set")]
+            times = [event_time for event_time, kind in rise_set]
+            events = [kind for event_time, kind in rise_set]
             
             print(f"找到 {len(times)} 个事件")
             
             # 检查是否找到事件
             if len(times) == 0:
                 print("警告: 未找到月出月落事件，可能处于极地地区或计算时间范围不足")
-                self.moon_events = {
-                    "moonrise": "--:--",
-                    "moonset": "--:--",
-                    "first_event": "月出",
-                    "first_time": "未找到",
-                    "second_event": "月落",
-                    "second_time": "未找到",
-                    "moonrise_dt": None,
-                    "moonset_dt": None
-                }
+                self.moon_events = MoonEvents.placeholder("未找到")
+                self.moon_events_fresh = True
                 return
                 
             # 提取月出和月落时间
             moonrise_times = []
             moonset_times = []
             
-            for i, (time, event) in enumerate(zip(times, events)):
-                # event: 1表示升起（月出），0表示落下（月落）
-                if event == 1:  # 月出
-                    moonrise_times.append(time.utc_datetime())
-                    print(f"事件 {i}: 月出 at {time.utc_datetime()}")
+            for i, (event_time, event) in enumerate(zip(times, events)):
+                # event: "rise"表示升起（月出），"set"表示落下（月落）
+                if event == "rise":  # 月出
+                    moonrise_times.append(event_time)
+                    print(f"事件 {i}: 月出 at {event_time}")
                 else:  # 月落
-                    moonset_times.append(time.utc_datetime())
-                    print(f"事件 {i}: 月落 at {time.utc_datetime()}")
+                    moonset_times.append(event_time)
+                    print(f"事件 {i}: 月落 at {event_time}")
             
             # 找到下一个月出和月落
             next_moonrise = None
@@ -614,12 +3445,12 @@ class MoonWidget:
             
             # 转换为本地时间
             if next_moonrise:
-                moonrise_local = next_moonrise.replace(tzinfo=timezone.utc).astimezone(self.local_tz)
+                moonrise_local = next_moonrise.astimezone(self.local_tz)
             else:
                 moonrise_local = None
                 
             if next_moonset:
-                moonset_local = next_moonset.replace(tzinfo=timezone.utc).astimezone(self.local_tz)
+                moonset_local = next_moonset.astimezone(self.local_tz)
             else:
                 moonset_local = None
             
@@ -657,18 +3488,35 @@ class MoonWidget:
                 second_event = "月落"
                 second_time = next_moonset_str
             
-            self.moon_events = {
-                "moonrise": moonrise_str,
-                "moonset": moonset_str,
-                "first_event": first_event,
-                "first_time": first_time,
-                "second_event": second_event,
-                "second_time": second_time,
-                "moonrise_dt": moonrise_local,
-                "moonset_dt": moonset_local
-            }
+            # 下一次上中天及其高度角（即最大高度角），与月出月落来自同一次缓存搜索
+            transits = [(event_time, value) for event_time, (kind, value) in found if kind == "transit"]
+            if transits:
+                transit_local = transits[0][0].astimezone(self.local_tz)
+                transit_str = transit_local.strftime("%m月%d日 %H:%M")
+                max_altitude_str = f"{transits[0][1]:.1f}°"
+            else:
+                transit_str = "--"
+                max_altitude_str = "--"
+            
+            # 最佳观测窗口：本次（或下一次）月出到月落期间太阳低于-18°的时段
+            viewing_str = "--"
+            track_window = self.find_track_window(now_utc)
+            if track_window:
+                viewing_window = self.find_viewing_window(*track_window)
+                if viewing_window:
+                    viewing_start = viewing_window[0].astimezone(self.local_tz)
+                    viewing_end = viewing_window[1].astimezone(self.local_tz)
+                    viewing_str = f"{viewing_start.strftime('%m月%d日 %H:%M')}-{viewing_end.strftime('%H:%M')}"
+                else:
+                    viewing_str = "无（月出期间无完全天黑）"
             
-            print(f"使用skyfield计算月出月落时间: 月出 {self.moon_events['moonrise']}, 月落 {self.moon_events['moonset']}")
+            self.moon_events = MoonEvents(
+                moonrise_str, moonset_str, first_event, first_time, second_event, second_time,
+                transit_str, max_altitude_str, viewing_str, moonrise_local, moonset_local
+            )
+            
+            self.moon_events_fresh = True
+            print(f"使用skyfield计算月出月落时间: 月出 {self.moon_events.moonrise}, 月落 {self.moon_events.moonset}")
             print(f"显示顺序: {first_event} {first_time}, {second_event} {second_time}")
             
         except Exception as e:
@@ -677,17 +3525,24 @@ class MoonWidget:
             traceback.print_exc()  # 打印完整的错误堆栈
             
             # 设置错误信息
-            self.moon_events = {
-                "moonrise": "--:--",
-                "moonset": "--:--",
-                "first_event": "月出",
-                "first_time": "计算错误",
-                "second_event": "月落",
-                "second_time": "计算错误",
-                "moonrise_dt": None,
-                "moonset_dt": None
-            }
+            self.set_moon_events_placeholder("计算错误")
     
+    def snapshot_wait_over(self):
+        """快照首帧是否不必再等待实时计算：星历加载已结束但不可用，或已等待超过snapshot_max_wait秒"""
+        if not SKYFIELD_AVAILABLE and self.ephemeris_loader.idle.is_set():
+            return True
+        return time.monotonic() - self.snapshot_loaded_at >= self.snapshot_max_wait
+
+    def set_moon_events_placeholder(self, message):
+        """无法计算月出月落时显示占位信息；快照中恢复的事件仍在显示时保留它们"""
+        if not self.snapshot_pending:
+            self.moon_events = MoonEvents.placeholder(message)
+
+    def clear_eclipse_events(self):
+        """无法计算日月食时清空列表；快照中恢复的事件仍在显示时保留它们"""
+        if not self.snapshot_pending:
+            self.eclipse_events = []
+
     def calculate_moon_events(self):
         """计算月出和月落时间 - 只使用skyfield库"""
         global SKYFIELD_AVAILABLE
@@ -697,62 +3552,122 @@ class MoonWidget:
             # 如果Skyfield不可用，尝试重新初始化
             print("Skyfield不可用，尝试重新初始化...")
             self.init_skyfield_async()
-            # 等待一段时间让初始化完成
-            time.sleep(2)
+            # 等待加载任务完成，最多等待2秒
+            self.ephemeris_loader.wait(timeout=2)
         
         # 再次检查Skyfield是否可用
         if not SKYFIELD_AVAILABLE:
             print("Skyfield仍然不可用，无法计算月出月落")
-            self.moon_events = {
-                "moonrise": "--:--",
-                "moonset": "--:--",
-                "first_event": "月出",
-                "first_time": "Skyfield不可用",
-                "second_event": "月落",
-                "second_time": "Skyfield不可用",
-                "moonrise_dt": None,
-                "moonset_dt": None
-            }
+            self.set_moon_events_placeholder("Skyfield不可用")
             return
         
         # 验证星历数据
         if not self.verify_and_reload_ephemeris():
             print("星历数据不可用，无法计算月出月落")
-            self.moon_events = {
-                "moonrise": "--:--",
-                "moonset": "--:--",
-                "first_event": "月出",
-                "first_time": "星历数据不可用",
-                "second_event": "月落",
-                "second_time": "星历数据不可用",
-                "moonrise_dt": None,
-                "moonset_dt": None
-            }
+            self.set_moon_events_placeholder("星历数据不可用")
             return
         
         # 使用Skyfield计算月出月落
         self.calculate_moon_events_with_skyfield()
     
     def update_moon_events_periodically(self):
-        """每1分钟或位置变化时更新月出月落时间，每1小时更新月食信息"""
-        current_time = time.time()
-        # 检查是否需要更新月出月落时间（1分钟或位置变化）
-        if (current_time - self.last_moon_events_update >= 60 or  # 1分钟 = 60秒
+        """每moon_events_interval（默认1分钟）或位置变化时更新月出月落时间，每eclipse_interval（默认1小时）更新月食信息（按计算时钟，时间跳转时也会触发）"""
+        current_time = self.clock.now().timestamp()
+        # 检查是否需要更新月出月落时间（1分钟或位置变化），模拟倒放时时间差为负，取绝对值
+        if (abs(current_time - self.last_moon_events_update) >= self.moon_events_interval or  # 默认1分钟
             (self.location["latitude"] != self.last_location["latitude"] or 
             self.location["longitude"] != self.last_location["longitude"] or
             self.location["timezone"] != self.last_location["timezone"])):  # 位置发生变化
             
             print("更新月出月落时间...")
             self.calculate_moon_events()
+            self.update_moon_track()
             self.last_moon_events_update = current_time
             self.last_location = self.location.copy()  # 更新上次位置信息
         
-        # 修改这里：将6小时(21600秒)改为1小时(3600秒)
-        if current_time - self.last_eclipse_update >= 3600:  # 1小时 = 3600秒
+        # 默认1小时(3600秒)更新一次
+        if abs(current_time - self.last_eclipse_update) >= self.eclipse_interval:
             print("更新月食信息...")
             self.calculate_eclipses()
             self.last_eclipse_update = current_time
     
+    def find_track_window(self, now_utc):
+        """确定轨迹的时间范围：月球在地平线上时为本次月出到月落，否则为下一次月出到月落"""
+        # 向前多看一天，以便找到已经发生的月出
+        horizon_end = now_utc + timedelta(hours=self.moon_event_horizon_hours)
+        self.moon_event_cache.ensure(now_utc - timedelta(hours=30), horizon_end)
+        events = self.moon_event_cache.between(now_utc - timedelta(hours=30), horizon_end)
+        
+        events = [(event_time, kind) for event_time, (kind, _) in events if kind in ("rise", "set")]
+        
+        past = [event for event in events if event[0] <= now_utc]
+        future = [event for event in events if event[0] > now_utc]
+        if past and past[-1][1] == "rise":
+            # 月球已升起，从本次月出开始
+            rise_time = past[-1][0]
+        else:
+            rises = [event_time for event_time, kind in future if kind == "rise"]
+            if not rises:
+                return None
+            rise_time = rises[0]
+        
+        sets = [event_time for event_time, kind in events if kind == "set" and event_time > rise_time]
+        if not sets:
+            return None
+        return rise_time, sets[0]
+
+    def calculate_moon_track(self, start, end, resolution_minutes):
+        """一次矢量化计算[start, end]内的月球高度角和方位角"""
+        import numpy as np
+        from skyfield.api import wgs84
+        
+        step_days = resolution_minutes / 1440.0
+        t_start = ts.utc(start)
+        t_end = ts.utc(end)
+        count = max(2, int((t_end.tt - t_start.tt) / step_days) + 1)
+        times = ts.tt_jd(np.append(t_start.tt + np.arange(count - 1) * step_days, t_end.tt))
+        
+        observer = wgs84.latlon(self.location["latitude"], self.location["longitude"])
+        alt, az, _ = (earth + observer).at(times).observe(moon).apparent().altaz()
+        return {
+            "start": start.timestamp() * 1000,
+            "end": end.timestamp() * 1000,
+            "times": [round(t.timestamp() * 1000) for t in times.utc_datetime()],
+            "altitude": [round(float(value), 1) for value in alt.degrees],
+            "azimuth": [round(float(value), 1) for value in az.degrees]
+        }
+
+    def get_moon_track(self, resolution_minutes=None):
+        """返回当晚月球的高度角/方位角轨迹（按位置和月出时间缓存），不可用时返回None"""
+        if not SKYFIELD_AVAILABLE or eph is None:
+            return None
+        resolution_minutes = resolution_minutes or self.track_resolution
+        try:
+            window = self.find_track_window(self.clock.now())
+            if window is None:
+                return None
+            rise_time, set_time = window
+            
+            key = (f"{self.location['latitude']:.2f},{self.location['longitude']:.2f}"
+                   f"|{rise_time.strftime('%Y%m%d%H%M')}|{resolution_minutes}")
+            if key not in self.track_cache:
+                print(f"计算月球轨迹: {rise_time} 到 {set_time}")
+                track = self.calculate_moon_track(rise_time, set_time, resolution_minutes)
+                track["key"] = key
+                # 只保留最近几晚的轨迹
+                if len(self.track_cache) >= 8:
+                    self.track_cache.pop(next(iter(self.track_cache)))
+                self.track_cache[key] = track
+            return self.track_cache[key]
+        except Exception as e:
+            print(f"计算月球轨迹错误: {e}")
+            return None
+
+    def update_moon_track(self):
+        """更新当前轨迹键，页面发现键变化后会重新获取轨迹"""
+        track = self.get_moon_track()
+        self.track_key = track["key"] if track else None
+
     def get_azimuth_direction(self, azimuth):
         """将方位角转换为方向（东、南、西、北等）"""
         directions = ["北", "东北", "东", "东南", "南", "西南", "西", "西北"]
@@ -763,8 +3678,6 @@ class MoonWidget:
         """检查月球是否可见（在地平线以上）"""
         try:
             # 修复：使用有时区的时间
-            now_local = datetime.now(timezone.utc).astimezone(self.local_tz)
-            
             # 如果月球位置数据不可用，返回未知
             if not hasattr(self, 'last_moon_pos'):
                 return "未知"
@@ -777,11 +3690,15 @@ class MoonWidget:
         except:
             return "未知"
     
-    def update_network_status(self):
-        """定期更新网络状态并通知界面"""
+    def update_network_status(self, generation=0):
+        """定期更新网络状态并通知界面，generation含义同update_moon_data"""
         while self.is_running:
-            # 每5秒检查一次网络状态
-            time.sleep(5)
+            if not self.watchdog.beat("network", generation, self.network_check_interval + self.watchdog_timeout):
+                print("网络监控线程已被看门狗接替，退出")
+                return
+            # 每network_check_interval秒（默认5秒）检查一次网络状态
+            time.sleep(self.network_check_interval)
+            self.power_manager.record_wakeup()
             
             # 检查网络状态
             was_online = self.network_available
@@ -794,8 +3711,8 @@ class MoonWidget:
                 except Exception as e:
                     print(f"更新网络状态错误: {e}")
 
-    def calculate_moon_position_with_skyfield(self):
-        """使用Skyfield计算月球位置"""
+    def calculate_moon_position_with_skyfield(self, now_utc=None):
+        """使用Skyfield计算月球位置，now_utc为空时使用当前时间"""
         try:
             global SKYFIELD_AVAILABLE, ts, eph, moon, earth
             
@@ -807,7 +3724,8 @@ class MoonWidget:
                 raise Exception("星历数据未加载")
                 
             # 获取当前时间（UTC）
-            now_utc = datetime.now(timezone.utc)
+            if now_utc is None:
+                now_utc = self.clock.now()
             t = ts.utc(now_utc)
             
             # 创建观察者位置
@@ -837,15 +3755,82 @@ class MoonWidget:
             traceback.print_exc()
             return None
 
+    def calculate_moon_disc(self, now_utc):
+        """计算月面绘制参数，返回{illumination, limb_angle, libration_lon, libration_lat}或None
+        
+        illumination为亮面比例（0-1），limb_angle为亮边中点相对本地天顶方向的位置角（度，逆时针为正，
+        即亮边位置角χ减去视差角q），libration_lon/lat为光学天平动（度）。公式见Meeus《天文算法》第48、53章。
+        数值按显示精度取整，页面据此判断是否需要重画明暗界线。
+        """
+        if not SKYFIELD_AVAILABLE or eph is None:
+            return None
+        if (self.moon_disc_time is not None and
+                abs((now_utc - self.moon_disc_time).total_seconds()) < self.disc_interval):
+            return self.moon_disc
+        try:
+            from skyfield.framelib import ecliptic_frame
+            
+            t = ts.utc(now_utc)
+            e = earth.at(t)
+            moon_apparent = e.observe(moon).apparent()
+            sun_apparent = e.observe(sun).apparent()
+            ra, dec, moon_distance = moon_apparent.radec(epoch='date')
+            sun_ra, sun_dec, sun_distance = sun_apparent.radec(epoch='date')
+            
+            # 相位角i和亮面比例k（Meeus 48.2/48.3）
+            elongation = moon_apparent.separation_from(sun_apparent).radians
+            phase_angle = math.atan2(sun_distance.km * math.sin(elongation),
+                                     moon_distance.km - sun_distance.km * math.cos(elongation))
+            illumination = (1 + math.cos(phase_angle)) / 2
+            
+            # 亮边位置角χ（Meeus 48.5），从北点经东向量
+            alpha, delta = ra.radians, dec.radians
+            alpha0, delta0 = sun_ra.radians, sun_dec.radians
+            chi = math.atan2(math.cos(delta0) * math.sin(alpha0 - alpha),
+                             math.sin(delta0) * math.cos(delta) - math.cos(delta0) * math.sin(delta) * math.cos(alpha0 - alpha))
+            
+            # 视差角q（Meeus 14.1），用于把位置角换算成相对天顶的方向
+            latitude = math.radians(self.location["latitude"])
+            hour_angle = math.radians(t.gast * 15 + self.location["longitude"]) - alpha
+            q = math.atan2(math.sin(hour_angle),
+                           math.tan(latitude) * math.cos(delta) - math.sin(delta) * math.cos(hour_angle))
+            
+            # 光学天平动（Meeus 53.1，忽略章动）
+            lat_ecl, lon_ecl, _ = moon_apparent.frame_latlon(ecliptic_frame)
+            T = (t.tt - 2451545.0) / 36525
+            node = math.radians((125.0445479 - 1934.1362891 * T) % 360)
+            argument_of_latitude = math.radians((93.2720950 + 483202.0175233 * T) % 360)
+            inclination = math.radians(1.54242)
+            W = lon_ecl.radians - node
+            beta = lat_ecl.radians
+            A = math.atan2(math.sin(W) * math.cos(beta) * math.cos(inclination) - math.sin(beta) * math.sin(inclination),
+                           math.cos(W) * math.cos(beta))
+            libration_lon = (math.degrees(A - argument_of_latitude) + 180) % 360 - 180
+            libration_lat = math.degrees(math.asin(-math.sin(W) * math.cos(beta) * math.sin(inclination)
+                                                   - math.sin(beta) * math.cos(inclination)))
+            
+            self.moon_disc = {
+                "illumination": round(illumination, 3),
+                "limb_angle": round(math.degrees(chi - q) % 360, 1),
+                "libration_lon": round(libration_lon, 1),
+                "libration_lat": round(libration_lat, 1)
+            }
+            self.moon_disc_time = now_utc
+            return self.moon_disc
+        except Exception as e:
+            print(f"计算月面绘制参数错误: {e}")
+            return None
+
     # 修改 get_moon_data 方法，在返回数据中添加网络状态
     def get_moon_data(self):
         """获取月球数据 - 使用Skyfield计算"""
         try:
             # 使用UTC时间进行计算 - 修复：使用有时区的时间
-            now_utc = datetime.now(timezone.utc)
+            now_utc = self.clock.now()
             now_local = now_utc.astimezone(self.local_tz)  # 使用本地时区
             
-            # 定期更新位置信息（每10秒）
+            # 先应用其他线程提交的新位置，再在网络变化后或定期（兜底）更新位置信息
+            self.apply_pending_location()
             self.update_location_periodically()
             
             # 定期更新月出月落时间（每3分钟或位置变化时）
@@ -856,6 +3841,13 @@ class MoonWidget:
             if SKYFIELD_AVAILABLE:
                 moon_pos = self.calculate_moon_position_with_skyfield()
             
+            # 首帧来自快照时，在Skyfield加载完成并算出月球位置和月出月落之前不推送，页面继续显示（标记为过期的）快照；
+            # 星历加载已结束但失败，或等待超过snapshot_max_wait秒时不再等待，推送带错误信息、网络状态和位置的实时帧
+            if self.snapshot_pending:
+                if (moon_pos is None or not self.moon_events_fresh) and not self.snapshot_wait_over():
+                    return None
+                self.snapshot_pending = False
+            
             # 如果Skyfield计算失败，返回错误信息
             if moon_pos is None:
                 moon_pos = {
@@ -867,42 +3859,23 @@ class MoonWidget:
                 }
             
             self.last_moon_pos = moon_pos  # 保存最后一次计算的位置
+            self.last_moon_pos_time = now_utc  # 最后一次计算位置对应的时间
             
             # 计算月相
             jd = self.julian_day(now_utc)  # 儒略日（使用UTC时间）
             moon_phase = self.calculate_moon_phase(jd)
             
-            # 获取方位角方向
-            azimuth_direction = self.get_azimuth_direction(moon_pos['azimuth'])
-            
             # 检查月球可见性
             visibility = self.is_moon_visible()
             
-            # 格式化数据
-            moon_data = {
-                "time": now_local.strftime("%Y-%m-%d %H:%M:%S"),
-                "ra": f"{moon_pos['ra']:.2f}时",  # 赤经单位改为"时"
-                "dec": f"{moon_pos['dec']:.2f}°",  # 赤纬单位是度
-                "distance": f"{moon_pos['distance']:.0f} km",
-                "altitude": f"{moon_pos['altitude']:.1f}°",
-                "azimuth": f"{moon_pos['azimuth']:.1f}° ({azimuth_direction})",  # 添加方位方向
-                "phase": moon_phase,
-                "location": self.location["name"],
-                "longitude": f"{abs(self.location['longitude']):.4f}°{'E' if self.location['longitude'] >= 0 else 'W'}",  # 经度显示，正数为东经(E)，负数为西经(W)
-                "latitude": f"{abs(self.location['latitude']):.4f}°{'N' if self.location['latitude'] >= 0 else 'S'}",    # 纬度显示，正数为北纬(N)，负数为南纬(S)
-                "moonrise": self.moon_events["moonrise"],
-                "moonset": self.moon_events["moonset"],
-                "first_event": self.moon_events["first_event"],
-                "first_time": self.moon_events["first_time"],
-                "second_event": self.moon_events["second_event"],
-                "second_time": self.moon_events["second_time"],
-                "visibility": visibility,
-                "online": self.network_available,
-                "timezone": self.location["timezone"],
-                "eclipses": self.eclipse_events,
-                "skyfield_available": SKYFIELD_AVAILABLE,
-                "skyfield_error": self.skyfield_error
-            }
+            # 复用负载构建器：静态字段按位置缓存，快速变化的字段以数值发送，由页面格式化
+            self.payload_builder.set_location(self.location)
+            moon_data = self.payload_builder.build(
+                now_local, moon_pos, moon_phase, self.moon_events, visibility,
+                self.network_available, self.eclipse_events, SKYFIELD_AVAILABLE, self.skyfield_error,
+                self.clock.rate if self.clock.simulated else 1.0, self.track_key,
+                self.calculate_watchlist(now_utc), self.eclipse_horizon_days,
+                self.calculate_moon_disc(now_utc))
             
             return moon_data
         except Exception as e:
@@ -928,24 +3901,262 @@ class MoonWidget:
             phase += 1
         return phase
     
-    def update_moon_data(self):
-        """定期更新月球数据 - 每秒更新"""
+    def time_to_next_digit(self, value, rate, step):
+        """计算按step四舍五入显示的数值下一次变化还需多少秒（rate为每秒变化量）"""
+        x = value / step
+        if rate > 0:
+            boundary = math.floor(x + 0.5) + 0.5
+        else:
+            boundary = math.ceil(x - 0.5) - 0.5
+        return abs((boundary * step - value) / rate)
+
+    def calculate_moon_rates(self, moon_pos, lookahead=60):
+        """用lookahead秒后的位置估算月球各坐标每秒的变化量"""
+        future_pos = self.calculate_moon_position_with_skyfield(
+            self.last_moon_pos_time + timedelta(seconds=lookahead))
+        if future_pos is None:
+            return None
+        
+        rates = {}
+        for key in ("ra", "dec", "distance", "altitude", "azimuth"):
+            delta = future_pos[key] - moon_pos[key]
+            # 处理方位角和赤经的回绕
+            if key == "azimuth":
+                delta = (delta + 180) % 360 - 180
+            elif key == "ra":
+                delta = (delta + 12) % 24 - 12
+            rates[key] = delta / lookahead
+        return rates
+
+    def set_simulation(self, start_iso=None, rate=1.0):
+        """进入模拟模式（可从页面或命令行调用）：start_iso为ISO格式的跳转时间，为空时从当前时间继续；rate为倍速"""
+        start = datetime.fromisoformat(start_iso.replace("Z", "+00:00")) if start_iso else None
+        self.clock.set_simulation(start, rate)
+        print(f"模拟时钟: {self.clock.now().isoformat()}, 倍速 {self.clock.rate}")
+        # 时间跳转后立即刷新事件和关键帧，缓存只补算缺失的时间段
+        self.last_moon_events_update = 0
+        self.last_eclipse_update = 0
+        self.last_keyframe_push = 0
+        self.wake_event.set()
+        return True
+
+    def reset_simulation(self):
+        """退出模拟模式，回到真实时间"""
+        self.clock.reset()
+        self.last_moon_events_update = 0
+        self.last_eclipse_update = 0
+        self.last_keyframe_push = 0
+        self.wake_event.set()
+        return True
+
+    def is_window_visible(self):
+        """窗口是否可见（页面未隐藏且窗口未最小化）"""
+        return self.page_visible and not self.window_minimized
+
+    def set_page_visible(self, visible):
+        """由页面JS在可见性变化时调用"""
+        self.page_visible = bool(visible)
+        if self.page_visible:
+            # 重新可见时立即刷新
+            self.wake_event.set()
+        return True
+
+    def on_window_minimized(self):
+        """窗口最小化事件"""
+        self.window_minimized = True
+
+    def on_window_restored(self):
+        """窗口恢复事件"""
+        self.window_minimized = False
+        self.wake_event.set()
+
+    def calculate_next_update_delay(self):
+        """计算到下一次需要推送数据的时间（秒）"""
+        if self.refresh_mode == "fixed":
+            return self.update_interval
+        
+        # 关键帧模式下位置由页面插值，只需按周期任务的节奏检查事件变化（模拟加速时按倍速缩短）
+        if self.refresh_mode == "keyframe":
+            if not self.is_window_visible():
+                return self.hidden_update_interval
+            if self.clock.rate == 0:
+                return self.max_update_interval
+            return max(self.min_update_interval,
+                       min(self.max_update_interval, self.keyframe_refresh / abs(self.clock.rate)))
+        
+        # 窗口不可见时降低刷新频率
+        if not self.is_window_visible():
+            return self.hidden_update_interval
+        
+        moon_pos = getattr(self, 'last_moon_pos', None)
+        if not SKYFIELD_AVAILABLE or not moon_pos or moon_pos['distance'] == 0:
+            return self.min_update_interval
+        
+        rates = self.calculate_moon_rates(moon_pos)
+        if rates is None:
+            return self.min_update_interval
+        
+        # 显示精度与get_moon_data中的格式化保持一致
+        display_steps = {
+            "ra": 0.01,
+            "dec": 0.01,
+            "distance": 1,
+            "altitude": 0.1,
+            "azimuth": 0.1
+        }
+        delay = self.max_update_interval
+        for key, step in display_steps.items():
+            # 换算成每真实秒的变化量（模拟模式下乘以倍速，倒放时方向相反）
+            rate = rates[key] * self.clock.rate
+            if rate != 0:
+                delay = min(delay, self.time_to_next_digit(moon_pos[key], rate, step))
+        
+        # 稍微延后，确保醒来时数值已经变化
+        return max(self.min_update_interval, delay + 0.05)
+
+    def build_keyframe(self):
+        """构建位置关键帧：t0和t0+Δ两个时刻的月球位置，供页面线性插值"""
+        moon_pos = getattr(self, 'last_moon_pos', None)
+        if not SKYFIELD_AVAILABLE or not moon_pos or moon_pos['distance'] == 0:
+            return None
+        
+        t0 = self.last_moon_pos_time
+        t1 = t0 + timedelta(seconds=self.keyframe_span)
+        future_pos = self.calculate_moon_position_with_skyfield(t1)
+        if future_pos is None:
+            return None
+        
+        fields = ("ra", "dec", "distance", "altitude", "azimuth")
+        return {
+            "t0": t0.timestamp() * 1000,  # 毫秒时间戳，与JS的Date.now()一致
+            "t1": t1.timestamp() * 1000,
+            "p0": {key: moon_pos[key] for key in fields},
+            "p1": {key: future_pos[key] for key in fields}
+        }
+
+    def should_push_keyframe(self, moon_data):
+        """关键帧模式下判断是否需要推送：关键帧到期，或月出月落、月食、位置、网络等非位置字段变化"""
+        # 排除随时间连续变化的字段
+        dynamic_fields = ("timestamp", "utc_offset", "clock_rate", "watchlist", "ra", "dec", "distance", "altitude", "azimuth", "visibility", "phase", "keyframe")
+        static_payload = {key: value for key, value in moon_data.items() if key not in dynamic_fields}
+        
+        changed = static_payload != self.last_static_payload
+        expired = abs(self.clock.now().timestamp() - self.last_keyframe_push) >= self.keyframe_refresh
+        if changed or expired:
+            self.last_static_payload = static_payload
+            return True
+        return False
+
+    def update_moon_data(self, generation=0):
+        """定期更新月球数据 - 自适应模式下在显示数值变化时更新，关键帧模式下按关键帧周期或事件更新
+        
+        generation为看门狗分配的线程代数，本线程卡住后被新线程接替时退出
+        """
         while self.is_running:
             # 获取当前时间的秒部分
             current_second = datetime.now().second
             
-            # 每秒更新一次
             moon_data = self.get_moon_data()
+            if not self.watchdog.is_current("update", generation):
+                print("数据更新线程已被看门狗接替，退出")
+                return
+            
+            if moon_data and self.refresh_mode == "keyframe":
+                if self.should_push_keyframe(moon_data):
+                    moon_data["keyframe"] = self.build_keyframe()
+                    self.last_keyframe_push = self.clock.now().timestamp()
+                else:
+                    # 关键帧仍然有效，无需推送
+                    moon_data = None
+            
+            if moon_data:
+                # 发布浅拷贝作为页面（重新）加载时的首帧：复用的负载字典在下一轮计算中会被逐项改写，
+                # 关键帧模式下不推送的轮次还会把keyframe重置为None，读取方不能看到半新半旧的数据
+                moon_data = dict(moon_data)
+                self.latest_moon_data = moon_data
+                # 服务器模式：序列化一次后分发给所有订阅者
+                if self.broadcaster:
+                    self.broadcaster.publish(moon_data)
+            
             if moon_data and self.window:
                 try:
-                    self.window.evaluate_js(f"updateMoonData({json.dumps(moon_data)})")
+                    self.window.evaluate_js(f"updateMoonData({encode_payload(moon_data)})")
                     self.last_update_second = current_second
                 except Exception as e:
                     print(f"更新数据错误: {e}")
             
-            # 短暂休眠以减少CPU使用
-            time.sleep(1)
+            # 休眠到下一次显示数值变化，可被wake_event提前唤醒；醒来后的一轮计算应在watchdog_timeout内完成
+            delay = self.calculate_next_update_delay()
+            self.watchdog.beat("update", generation, delay + self.watchdog_timeout)
+            self.wake_event.wait(delay)
+            self.wake_event.clear()
+            self.power_manager.record_wakeup()
+            
+            # 定期保存热启动快照
+            if time.time() - self.last_snapshot_save >= self.snapshot_interval:
+                self.save_snapshot()
     
+    def get_api_handlers(self):
+        """页面可通过HTTP获取的数据接口"""
+        return {"moon_track": self.get_moon_track, "watchdog": self.watchdog.report}
+
+    def get_bootstrap_data(self):
+        """返回页面首帧数据，尚未计算出数据时返回None（页面显示占位内容）"""
+        data = self.latest_moon_data
+        if data and data.get("stale"):
+            # 快照中的时间戳已过期，页面时钟按当前时间走
+            data = dict(data, timestamp=self.clock.now().timestamp() * 1000, clock_rate=1.0)
+        return data
+
+    def load_snapshot(self):
+        """加载热启动快照：上次的页面数据作为首帧（标记为过期），位置未变时恢复月出月落和日月食结果"""
+        try:
+            if not os.path.exists(SNAPSHOT_PATH):
+                return
+            with open(SNAPSHOT_PATH, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            frame = snapshot.get("moon_data")
+            if frame:
+                frame.update(stale=True, snapshot_time=snapshot.get("saved_at"), keyframe=None)
+                self.latest_moon_data = frame
+                self.snapshot_pending = True
+                self.snapshot_loaded_at = time.monotonic()
+            
+            location = snapshot.get("location") or {}
+            same_location = (
+                abs(location.get("latitude", 999) - self.location["latitude"]) <= 0.01 and
+                abs(location.get("longitude", 999) - self.location["longitude"]) <= 0.01 and
+                location.get("timezone") == self.location["timezone"]
+            )
+            if same_location:
+                if snapshot.get("moon_events"):
+                    self.moon_events = MoonEvents.from_payload(snapshot["moon_events"])
+                self.eclipse_events = [EclipseEvent.from_payload(event) for event in snapshot.get("eclipse_events") or []]
+            print(f"已加载热启动快照（保存于 {snapshot.get('saved_at')}）")
+        except Exception as e:
+            print(f"加载热启动快照失败: {e}")
+
+    def save_snapshot(self):
+        """保存热启动快照（最近一次页面数据、月出月落、日月食和位置），先写临时文件再替换，避免写一半被读取"""
+        try:
+            moon_data = self.latest_moon_data
+            if not moon_data or moon_data.get("stale") or not SKYFIELD_AVAILABLE:
+                return  # 只保存实时计算的结果
+            snapshot = {
+                "saved_at": self.clock.now().astimezone(self.local_tz).strftime("%Y-%m-%d %H:%M"),
+                "location": self.location,
+                "moon_data": moon_data,
+                "moon_events": self.moon_events,
+                "eclipse_events": self.eclipse_events
+            }
+            temp_path = SNAPSHOT_PATH + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'), default=encode_record)
+            os.replace(temp_path, SNAPSHOT_PATH)
+            self.last_snapshot_save = time.time()
+        except Exception as e:
+            print(f"保存热启动快照失败: {e}")
+
     def create_window(self):
         try:
             # 尝试获取屏幕尺寸
@@ -958,428 +4169,35 @@ class MoonWidget:
                 
                 # 窗口尺寸和位置 - 增加高度以确保内容完全显示
                 window_width = 300
-                window_height = 750  # 增加高度以适应内容
+                window_height = 960  # 增加高度以适应内容（含月球轨迹图、中天信息和关注城市）
                 x = screen_width - window_width - 20  # 右侧留20像素边距
                 y = 100  # 离顶部100像素
             except:
                 # 如果无法获取屏幕尺寸，使用默认值
                 x, y = 100, 100
-                window_width, window_height = 300, 750  # 增加高度以适应内容
+                window_width, window_height = 300, 960  # 增加高度以适应内容（含月球轨迹图、中天信息和关注城市）
         except Exception as e:
             print(f"窗口创建错误: {e}")
             # 使用安全的默认值
             x, y = 100, 100
-            window_width, window_height = 300, 750  # 增加高度以适应内容
-    
-        
-        # HTML内容
-        html_content = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <style>
-                body {
-                    margin: 0;
-                    padding: 15px;
-                    font-family: 'Segoe UI', Arial, sans-serif;
-                    background-color: rgba(10, 10, 20, 0.85);
-                    color: #e0e0ff;
-                    border-radius: 10px;
-                    backdrop-filter: blur(5px);
-                    -webkit-backdrop-filter: blur(5px);
-                    overflow: hidden;
-                    border: 1px solid rgba(255, 255, 255, 0.1);
-                    height: 750px; /* 增加高度以适应内容 */
-                    box-sizing: border-box;
-                }
-                .header {
-                    text-align: center;
-                    margin-bottom: 15px;
-                    border-bottom: 1px solid rgba(255, 255, 255, 0.2);
-                    padding-bottom: 10px;
-                }
-                .location {
-                    text-align: center;
-                    font-size: 12px;
-                    color: #aaccff;
-                    margin-bottom: 15px;
-                }
-                .data-row {
-                    display: flex;
-                    justify-content: space-between;
-                    margin-bottom: 8px;
-                    font-size: 13px;
-                }
-                .label {
-                    font-weight: bold;
-                    color: #aaccff;
-                }
-                .moon-phase {
-                    text-align: center;
-                    margin: 15px 0;
-                    font-size: 60px;
-                }
-                .visibility {
-                    text-align: center;
-                    margin: 10px 0;
-                    font-size: 14px;
-                    font-weight: bold;
-                }
-                .visible {
-                    color: #7fff7f;
-                }
-                .not-visible {
-                    color: #ff7f7f;
-                }
-                .unknown {
-                    color: #ffff7f;
-                }
-                .moon-events {
-                    margin: 15px 0;
-                    padding: 15px 0;
-                    border-top: 1px solid rgba(255, 255, 255, 0.1);
-                    border-bottom: 1px solid rgba(255, 255, 255, 0.1);
-                }
-                .event-row {
-                    display: flex;
-                    justify-content: space-between;
-                    margin-bottom: 5px;
-                    font-size: 12px;
-                }
-                .last-update {
-                    text-align: center;
-                    margin-top: 15px;
-                    font-size: 10px;
-                    color: rgba(255, 255, 255, 5);
-                }
-                .close-btn {
-                    position: absolute;
-                    top: 5px;
-                    right: 10px;
-                    color: rgba(255, 255, 255, 0.5);
-                    cursor: pointer;
-                    font-size: 16px;
-                }
-                .close-btn:hover {
-                    color: white;
-                }
-                .topmost-btn {
-                    position: absolute;
-                    top: 5px;
-                    right: 30px;  /* 在关闭按钮左侧 */
-                    color: rgba(255, 255, 255, 0.5);
-                    cursor: pointer;
-                    font-size: 16px;
-                }
-                .topmost-btn:hover {
-                    color: white;
-                }
-                .topmost-btn.pinned {
-                    color: gold;
-                }
-                .loading {
-                    text-align: center;
-                    margin: 20px 0;
-                    font-size: 12px;
-                    color: #aaccff;
-                }
-                .network-status {
-                    position: absolute;
-                    top: 5px;
-                    left: 10px;
-                    font-size: 12px;
-                }
-                .online {
-                    color: #7fff7f;
-                }
-                .offline {
-                    color: #ff7f7f;
-                }
-                .eclipse-section {
-                    margin: 15px 0;
-                    padding: 15px 0;
-                    border-top: 1px solid rgba(255, 255, 255, 0.1);
-                    border-bottom: 1px solid rgba(255, 255, 255, 0.1);
-                    max-height: 120px; /* 限制高度 */
-                    overflow-y: auto;  /* 添加滚动条 */
-                }
-                .eclipse-header {
-                    text-align: center;
-                    font-weight: bold;
-                    margin-bottom: 8px;
-                    color: #aaccff;
-                }
-                .eclipse-item {
-                    font-size: 11px;
-                    margin-bottom: 5px;
-                    display: flex;
-                    justify-content: space-between;
-                }
-                .eclipse-time {
-                    color: #ffff7f;
-                }
-                .eclipse-type {
-                    color: #ff7f7f;
-                }
-                .no-eclipse {
-                    text-align: center;
-                    font-size: 11px;
-                    color: rgba(255, 255, 255, 0.5);
-                }
-                .skyfield-error {
-                    text-align: center;
-                    margin: 10px 0;
-                    padding: 10px;
-                    background-color: rgba(255, 0, 0, 0.2);
-                    border-radius: 5px;
-                    font-size: 11px;
-                    color: #ff7f7f;
-                }
-            </style>
-        </head>
-        <body>
-            <div class="close-btn" onclick="window.pywebview.api.close_app()">×</div>
-            <div class="network-status" id="network-status">● 在线</div>
-            <div class="topmost-btn" id="topmost-btn" onclick="toggleTopmost()">📌</div>
-
-            <div class="header">
-                <h2 style="margin: 0;">🌙 月球位置</h2>
-            </div>
-            
-            <div id="loading">
-                正在初始化...<br>
-                <span id="loading-status">加载中，请稍候...</span>
-            </div>
-            
-            <div id="skyfield-error" class="skyfield-error" style="display: none;"></div>
-            
-            <div class="location">
-                位置: <span id="location">--</span>
-            </div>
-            
-            <div class="data-row">
-                <span class="label">经度:</span>
-                <span id="longitude">--</span>
-            </div>
-            
-            <div class="data-row">
-                <span class="label">纬度:</span>
-                <span id="latitude">--</span>
-            </div>
-            
-            <div class="data-row">
-                <span class="label">时间 (<span id="timezone">--</span>):</span>
-                <span id="time">--:--:--</span>
-            </div>
-            
-            <div class="data-row">
-                <span class="label">赤经 (J2000):</span>
-                <span id="ra">--</span>
-            </div>
-            
-            <div class="data-row">
-                <span class="label">赤纬 (J2000):</span>
-                <span id="dec">--</span>
-            </div>
-            
-            <div class="data-row">
-                <span class="label">地月距离:</span>
-                <span id="distance">--</span>
-            </div>
-            
-            <div class="data-row">
-                <span class="label">方位角:</span>
-                <span id="azimuth">--</span>
-            </div>
-            
-            <div class="data-row">
-                <span class="label">高度角:</span>
-                <span id="altitude">--</span>
-            </div>
-            
-            <!-- 月出月落时间放在高度角下面 -->
-            <div class="moon-events">
-                <div class="event-row">
-                    <span class="label" id="first-event-label">--</span>
-                    <span id="first-event-time">--</span>
-                </div>
-                <div class="event-row">
-                    <span class="label" id="second-event-label">--</span>
-                    <span id="second-event-time">--</span>
-                </div>
-            </div>
-            
-            <!-- 月球emoji放在月出月落时间下面 -->
-            <div class="moon-phase" id="moon-phase">🌑</div>
-            
-            <div class="visibility" id="visibility-container">
-                可见性: <span id="visibility">--</span>
-            </div>
-            
-            <div class="last-update" id="last-update">最后更新: --</div>
-
-            <!-- 月食信息区域 -->
-            <div class="eclipse-section">
-                <div class="eclipse-header">未来7天月食</div>
-                <div id="eclipse-list">
-                    <div class="no-eclipse">加载中...</div>
-                </div>
-            </div>
-
-            <script>
-                function updateEclipseData(eclipses) {
-                    const eclipseList = document.getElementById('eclipse-list');
-                    
-                    if (eclipses.length === 0) {
-                        eclipseList.innerHTML = '<div class="no-eclipse">未来7天内无月食</div>';
-                        return;
-                    }
-                    
-                    let html = '';
-                    eclipses.forEach(eclipse => {
-                        html += `
-                            <div class="eclipse-item">
-                                <span class="eclipse-time">🌙 ${eclipse.time}</span>
-                                <span class="eclipse-type">${eclipse.type}</span>
-                            </div>
-                        `;
-                    });
-                    
-                    eclipseList.innerHTML = html;
-                }
-
-                function updateMoonData(data) {
-                    // 隐藏加载提示
-                    document.getElementById('loading').style.display = 'none';
-                    
-                    // 显示或隐藏Skyfield错误信息
-                    const errorEl = document.getElementById('skyfield-error');
-                    if (data.skyfield_available) {
-                        errorEl.style.display = 'none';
-                    } else {
-                        errorEl.style.display = 'block';
-                        errorEl.textContent = data.skyfield_error || 'Skyfield不可用，部分功能受限';
-                    }
-                    
-                    document.getElementById('location').textContent = data.location;
-                    document.getElementById('longitude').textContent = data.longitude;
-                    document.getElementById('latitude').textContent = data.latitude;
-                    document.getElementById('timezone').textContent = data.timezone;
-                    document.getElementById('time').textContent = data.time;
-                    document.getElementById('ra').textContent = data.ra;
-                    document.getElementById('dec').textContent = data.dec;
-                    document.getElementById('distance').textContent = data.distance;
-                    document.getElementById('azimuth').textContent = data.azimuth;
-                    document.getElementById('altitude').textContent = data.altitude;
-                    
-                    // 更新月出月落事件显示
-                    document.getElementById('first-event-label').textContent = data.first_event + ':';
-                    document.getElementById('first-event-time').textContent = data.first_time;
-                    document.getElementById('second-event-label').textContent = data.second_event + ':';
-                    document.getElementById('second-event-time').textContent = data.second_time;
-                    
-                    document.getElementById('visibility').textContent = data.visibility;
-                    
-                    // 更新可见性样式
-                    const visibilityEl = document.getElementById('visibility-container');
-                    visibilityEl.className = 'visibility';
-                    if (data.visibility === '可见') {
-                        visibilityEl.classList.add('visible');
-                    } else if (data.visibility === '不可见') {
-                        visibilityEl.classList.add('not-visible');
-                    } else {
-                        visibilityEl.classList.add('unknown');
-                    }
-                    
-                    // 更新月相表情
-                    const phase = parseFloat(data.phase);
-                    let moonEmoji = '🌑'; // 新月
-                    if (phase > 0.9375 || phase <= 0.0625) moonEmoji = '🌑'; // 新月
-                    else if (phase <= 0.1875) moonEmoji = '🌒'; // 娥眉月
-                    else if (phase <= 0.3125) moonEmoji = '🌓'; // 上弦月
-                    else if (phase <= 0.4375) moonEmoji = '🌔'; // 盈凸月
-                    else if (phase <= 0.5625) moonEmoji = '🌕'; // 满月
-                    else if (phase <= 0.6875) moonEmoji = '🌖'; // 亏凸月
-                    else if (phase <= 0.8125) moonEmoji = '🌗'; // 下弦月
-                    else if (phase <= 0.9375) moonEmoji = '🌘'; // 残月
-                    
-                    document.getElementById('moon-phase').textContent = moonEmoji;
-                    
-                    // 更新月食信息
-                    updateEclipseData(data.eclipses || []);
-
-                    // 更新最后更新时间
-                    const now = new Date();
-                    document.getElementById('last-update').textContent = 
-                        `最后更新: ${now.toLocaleTimeString()}`;
-                    // 更新网络状态
-                    updateNetworkStatus(data.online);
-                }
-                
-                function updateNetworkStatus(online) {
-                    const statusEl = document.getElementById('network-status');
-                    if (online) {
-                        statusEl.textContent = '● 在线';
-                        statusEl.className = 'network-status online';
-                    } else {
-                        statusEl.textContent = '● 离线 (使用缓存位置)';
-                        statusEl.className = 'network-status offline';
-                    }
-                }
-                
-                function toggleTopmost() {
-                    const btn = document.getElementById('topmost-btn');
-                    // 先立即更新UI状态，让用户有即时反馈
-                    const isCurrentlyPinned = btn.classList.contains('pinned');
-                    btn.classList.toggle('pinned', !isCurrentlyPinned);
-                    
-                    // 然后调用API设置实际状态
-                    window.pywebview.api.set_topmost(!isCurrentlyPinned).then(function(success) {
-                        if (!success) {
-                            // 如果操作失败，恢复原来的状态
-                            btn.classList.toggle('pinned', isCurrentlyPinned);
-                            console.log('置顶操作失败');
-                        }
-                    });
-                }
-
-                function hideLoading() {
-                    document.getElementById('loading').style.display = 'none';
-                }
-                
-                
-
-                // 初始显示
-                updateMoonData({
-                    location: "获取中...",
-                    longitude: "--",
-                    latitude: "--",
-                    timezone: "--",
-                    time: "--:--:--",
-                    ra: "--",
-                    dec: "--",
-                    distance: "--",
-                    azimuth: "--",
-                    altitude: "--",
-                    first_event: "月出",
-                    first_time: "--",
-                    second_event: "月落",
-                    second_time: "--",
-                    visibility: "--",
-                    phase: 0,
-                    skyfield_available: true,
-                    eclipses: []
-                });
-            </script>
-        </body>
-        </html>
-        """
+            window_width, window_height = 300, 960  # 增加高度以适应内容（含月球轨迹图、中天信息和关注城市）
+    
+        
+        # 页面资源位于static目录，由本地静态资源服务器提供（带压缩和HTTP缓存）
+        try:
+            self.asset_server = StaticAssetServer(STATIC_DIR, self.get_bootstrap_data,
+                                                  api_handlers=self.get_api_handlers())
+            self.asset_server.start()
+            url = self.asset_server.url + "/moon_widget.html"
+        except Exception as e:
+            # 服务器启动失败时退回为直接加载本地文件
+            print(f"启动静态资源服务器失败: {e}")
+            url = os.path.join(STATIC_DIR, "moon_widget.html")
         
         # 创建窗口 - 移除on_top参数，使其可以被其他窗口覆盖
         self.window = webview.create_window(
             '月球位置',
-            html=html_content,
+            url=url,
             width=window_width,
             height=window_height,
             x=x,
@@ -1391,11 +4209,35 @@ class MoonWidget:
         )
         
         # 绑定关闭方法
-        self.window.expose(self.close_app, self.set_topmost)
+        self.window.expose(self.close_app, self.set_topmost, self.set_page_visible,
+                           self.set_simulation, self.reset_simulation, self.get_moon_track,
+                           self.set_watchlist, self.set_manual_location, self.clear_manual_location)
+        
+        # 监听窗口最小化/恢复，用于自适应刷新
+        try:
+            self.window.events.minimized += self.on_window_minimized
+            self.window.events.restored += self.on_window_restored
+        except Exception as e:
+            print(f"绑定窗口事件失败: {e}")
     
     def close_app(self):
         """关闭应用 - 修改为仅关闭窗口而不是终止进程"""
         self.is_running = False
+        self.save_snapshot()
+        if self.config_watcher:
+            self.config_watcher.stop()
+        self.power_manager.stop()
+        self.network_watcher.stop()
+        self.watchdog.stop()
+        if self.location_provider:
+            self.location_provider.stop()
+        if self.compute_worker:
+            self.compute_worker.stop()
+        if self.asset_server:
+            try:
+                self.asset_server.stop()
+            except Exception as e:
+                print(f"停止静态资源服务器时出错: {e}")
         try:
             # 仅关闭窗口，而不是终止整个进程
             if self.window:
@@ -1433,20 +4275,114 @@ class MoonWidget:
             # 每10秒尝试一次
             time.sleep(10)
     
+    def start_watched_threads(self):
+        """在看门狗下启动数据更新和网络监控线程，并监视星历加载"""
+        self.watchdog.add_thread("update", self.update_moon_data, self.watchdog_timeout)
+        self.watchdog.add_thread("network", self.update_network_status, self.watchdog_timeout)
+        self.watchdog.add_check("loader", lambda: self.ephemeris_loader.deadline(self.ephemeris_load_timeout),
+                                self.ephemeris_loader.abandon)
+        self.watchdog.start()
+
+    def run_server(self, host="0.0.0.0", port=8765):
+        """服务器模式 - 只运行一个计算引擎，通过HTTP提供页面并用Server-Sent Events向所有客户端推送数据"""
+        self.broadcaster = MoonDataBroadcaster()
+        self.asset_server = StaticAssetServer(STATIC_DIR, self.get_bootstrap_data, host, port,
+                                              broadcaster=self.broadcaster, is_running=lambda: self.is_running,
+                                              api_handlers=self.get_api_handlers())
+        self.asset_server.start()
+        print(f"服务器模式已启动，浏览器访问 http://{host}:{port}/ 即可查看")
+        
+        self.start_config_watcher()
+        self.network_watcher.start()
+        if self.location_provider:
+            self.location_provider.start(self.on_location_fix)
+        
+        # 数据更新在看门狗管理的线程中运行（卡住时可被替换），主线程等待退出
+        self.start_watched_threads()
+        try:
+            while self.is_running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("服务器模式已退出")
+        finally:
+            self.is_running = False
+            self.watchdog.stop()
+            self.save_snapshot()
+            self.asset_server.stop()
+
+    def run_soak(self, hours=72, rate=3600, budget_mb=300, report_seconds=30, top=10):
+        """浸泡测试 - 不打开窗口，用加速时钟连续运行计算流程（位置、月出月落、日月食、月面、负载编码、快照序列化），
+        定期对比tracemalloc快照，打印内存增长最多的代码位置；常驻内存超过budget_mb时失败
+        
+        hours为模拟运行的时长，rate为时钟倍速（默认1秒相当于1小时）。返回True表示全程未超出内存预算。
+        """
+        import tracemalloc
+        
+        self.set_simulation(None, rate)
+        self.ephemeris_loader.wait(timeout=120)
+        sim_start = self.clock.now()
+        sim_end = sim_start + timedelta(hours=hours)
+        print(f"浸泡测试: 模拟{hours}小时（{rate}倍速，约{hours * 3600 / rate:.0f}秒），内存预算{budget_mb}MB")
+        
+        tracemalloc.start(5)
+        baseline = None  # 首次报告时（缓存已填满）的快照，之后的增长相对它计算
+        baseline_traced = 0
+        peak_rss = 0
+        ok = True
+        next_report = time.monotonic() + report_seconds
+        while self.clock.now() < sim_end:
+            moon_data = self.get_moon_data()
+            if moon_data:
+                self.latest_moon_data = dict(moon_data)
+                encode_payload(moon_data)
+            
+            if time.monotonic() >= next_report or self.clock.now() >= sim_end:
+                next_report = time.monotonic() + report_seconds
+                # 快照只序列化不写文件，不覆盖正常运行时的热启动快照
+                json.dumps({"moon_events": self.moon_events, "eclipse_events": self.eclipse_events},
+                           ensure_ascii=False, default=encode_record)
+                snapshot = tracemalloc.take_snapshot().filter_traces(
+                    (tracemalloc.Filter(False, tracemalloc.__file__),))
+                traced, _ = tracemalloc.get_traced_memory()
+                rss = read_rss_mb()
+                peak_rss = max(peak_rss, rss or 0)
+                sim_days = (self.clock.now() - sim_start).total_seconds() / 86400
+                print(f"[浸泡 {sim_days:.2f}天] 常驻内存 {rss if rss is None else f'{rss:.1f}MB'}，"
+                      f"Python分配 {traced / 1048576:.1f}MB，线程 {threading.active_count()}")
+                if baseline is None:
+                    baseline = snapshot
+                    baseline_traced = traced
+                else:
+                    print(f"  相对基线增长 {(traced - baseline_traced) / 1024:.0f}KB，增长最多的位置:")
+                    for stat in snapshot.compare_to(baseline, 'lineno')[:top]:
+                        if stat.size_diff > 0:
+                            print(f"    {stat}")
+                if rss is not None and rss > budget_mb:
+                    print(f"浸泡测试失败: 常驻内存 {rss:.1f}MB 超过预算 {budget_mb}MB")
+                    ok = False
+                    break
+            
+            time.sleep(self.update_interval / 10)
+        
+        tracemalloc.stop()
+        self.is_running = False
+        if ok:
+            print(f"浸泡测试通过: 常驻内存峰值 {peak_rss:.1f}MB（预算 {budget_mb}MB）")
+        return ok
+
     def run(self):
         """运行应用"""
         # 创建窗口
         self.create_window()
         
-        # 启动数据更新线程
-        update_thread = threading.Thread(target=self.update_moon_data)
-        update_thread.daemon = True
-        update_thread.start()
+        # 配置文件热加载、网络变化监视
+        self.start_config_watcher()
+        self.network_watcher.start()
+        if self.location_provider:
+            self.location_provider.start(self.on_location_fix)
         
-        # 启动网络状态监控线程
-        network_thread = threading.Thread(target=self.update_network_status)
-        network_thread.daemon = True
-        network_thread.start()
+        # 启动数据更新和网络状态监控线程（由看门狗监视，卡住时启动新线程接替，无需重启webview）
+        self.start_watched_threads()
         
         # 启动隐藏任务栏图标的线程
         hide_icon_thread = threading.Thread(target=self.hide_taskbar_icon)
@@ -1456,7 +4392,594 @@ class MoonWidget:
         # 启动WebView
         webview.start(debug=False)
 
+class ComputeEngine:
+    """计算子进程中的无界面计算对象 - 复用MoonWidget中只依赖星历和传入位置的搜索方法"""
+    find_crossings = MoonWidget.find_crossings
+    sample_times = MoonWidget.sample_times
+    calculate_lunar_contacts = MoonWidget.calculate_lunar_contacts
+    search_eclipses = MoonWidget.search_eclipses
+    search_rise_set = MoonWidget.search_rise_set
+    search_moon_events = MoonWidget.search_moon_events
+    search_moon_phases = MoonWidget.search_moon_phases
+    
+    def __init__(self):
+        self.location = None
+
+def load_worker_ephemeris(download=False):
+    """计算子进程加载自己的星历：只打开脚本目录中的de421.bsp，不存在时抛出FileNotFoundError
+    
+    下载只由父进程进行（download为True时，如--almanac开始前），子进程各自下载会与父进程同时写同一个文件
+    """
+    global SKYFIELD_AVAILABLE, ts, eph, sun, moon, earth
+    from skyfield.api import load
+    de421_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'de421.bsp')
+    if not os.path.exists(de421_path):
+        if not download:
+            raise FileNotFoundError("星历文件de421.bsp尚未下载")
+        print("从网络加载星历数据，请耐心等待...")
+        download_file(load.build_url('de421.bsp'), de421_path, 60)
+    ts = load.timescale()
+    eph = load(de421_path)
+    sun, moon, earth = eph['sun'], eph['moon'], eph['earth']
+    SKYFIELD_AVAILABLE = True
+
+def compute_worker_main(conn):
+    """计算子进程入口：循环处理(方法名, 参数)请求，返回(是否成功, 结果或错误信息)
+    
+    星历在请求到达时加载，失败时返回(None, 错误信息)并在下一个请求时重试（父进程可能稍后才下载好星历文件）
+    """
+    engine = ComputeEngine()
+    loaded = False
+    
+    while True:
+        try:
+            method, args = conn.recv()
+        except (EOFError, OSError):
+            return  # 父进程已退出
+        if not loaded:
+            try:
+                load_worker_ephemeris()
+                loaded = True
+            except Exception as e:
+                conn.send((None, f"计算进程加载星历失败: {e}"))
+                continue
+        try:
+            if method not in ALMANAC_METHODS.values():
+                raise ValueError(f"不支持的计算方法: {method}")
+            conn.send((True, getattr(engine, method)(*args)))
+        except Exception as e:
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+# 长时间范围搜索（--almanac）可用的搜索类型 -> ComputeEngine方法名
+ALMANAC_METHODS = {
+    "eclipses": "search_eclipses",
+    "phases": "search_moon_phases",
+    "rise-set": "search_rise_set",
+    "moon-events": "search_moon_events"
+}
+
+almanac_engine = None  # 进程池子进程中的计算对象，首个分段到达时加载星历
+
+def run_almanac_chunk(method, args):
+    """进程池子进程执行一个分段的搜索"""
+    global almanac_engine
+    if almanac_engine is None:
+        load_worker_ephemeris()
+        almanac_engine = ComputeEngine()
+    return getattr(almanac_engine, method)(*args)
+
+def encode_almanac_value(value):
+    """把搜索结果转成可写入JSON的结构（datetime -> {"utc": ISO字符串}，元组 -> 列表）"""
+    if isinstance(value, datetime):
+        return {"utc": value.isoformat()}
+    if isinstance(value, (list, tuple)):
+        return [encode_almanac_value(item) for item in value]
+    return value
+
+def decode_almanac_value(value):
+    """encode_almanac_value的逆过程（列表还原为元组）"""
+    if isinstance(value, dict) and "utc" in value:
+        return datetime.fromisoformat(value["utc"])
+    if isinstance(value, list):
+        return tuple(decode_almanac_value(item) for item in value)
+    return value
+
+class AlmanacRunner:
+    """长时间范围的并行天象搜索 - 把[start, end]切成互相重叠的分段，分给进程池中的多个子进程
+    
+    find_discrete和lunar_eclipses的耗时与时间跨度成正比，整个DE421范围或全年逐日的月出月落单线程要几分钟；
+    分段后各子进程独立搜索，星历文件由jplephem以内存映射方式打开，多个进程共享同一份页缓存。
+    每段向两侧各多搜索overlap_days，使落在分段边界附近的事件至少被完整搜索一次，只保留落在分段本身范围内的事件；
+    合并时再按类型去重。每完成一段就把结果按天写入检查点文件，中断后用相同的时间范围和位置重新运行
+    （进程数和分段长度可以不同）只搜索还有未完成日期的分段。
+    """
+    def __init__(self, kind, start, end, location=None, workers=None, chunk_days=None,
+                 overlap_days=2, checkpoint_path=None):
+        if kind not in ALMANAC_METHODS:
+            raise ValueError(f"不支持的搜索类型: {kind}（可选 {', '.join(ALMANAC_METHODS)}）")
+        if kind in ("rise-set", "moon-events") and location is None:
+            raise ValueError(f"{kind} 需要指定位置（--location 纬度,经度）")
+        if end <= start:
+            raise ValueError("结束时间必须晚于开始时间")
+        self.kind = kind
+        self.method = ALMANAC_METHODS[kind]
+        self.start = start
+        self.end = end
+        self.location = location
+        self.workers = workers or os.cpu_count() or 1
+        # 默认每个进程约分到4段，较慢的分段不会拖住整体；最短7天
+        span_days = (end - start).total_seconds() / 86400
+        self.chunk_days = chunk_days or max(7, math.ceil(span_days / (self.workers * 4)))
+        self.overlap = timedelta(days=overlap_days)
+        self.checkpoint_path = checkpoint_path or os.path.join(DATA_DIR, f"almanac_{kind}.partial.json")
+        self.dedupe_seconds = 3600  # 同类事件相隔不到1小时视为同一事件（同类事件实际至少相隔半天）
+    
+    def chunks(self):
+        """返回[(分段开始, 分段结束), ...]"""
+        chunks = []
+        chunk_start = self.start
+        while chunk_start < self.end:
+            chunk_end = min(chunk_start + timedelta(days=self.chunk_days), self.end)
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = chunk_end
+        return chunks
+    
+    def chunk_args(self, chunk_start, chunk_end):
+        """分段的搜索参数：向两侧各扩展overlap，但不超出整个搜索范围"""
+        search_start = max(chunk_start - self.overlap, self.start)
+        search_end = min(chunk_end + self.overlap, self.end)
+        if self.method == "search_rise_set":
+            return (self.location, search_start, search_end)
+        if self.method == "search_moon_events":
+            return (search_start, search_end, self.location)
+        return (search_start, search_end)
+    
+    def chunk_day_range(self, chunk_start, chunk_end):
+        """分段覆盖的日期序号（从start起按24小时计，最后一天可能不满24小时）"""
+        day = timedelta(days=1)
+        return range((chunk_start - self.start) // day, math.ceil((chunk_end - self.start) / day))
+    
+    def checkpoint_key(self):
+        """检查点在搜索类型、时间范围和位置相同时复用（与进程数和分段长度无关）"""
+        return {
+            "kind": self.kind,
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "location": [self.location["latitude"], self.location["longitude"]] if self.location else None
+        }
+    
+    def load_checkpoint(self):
+        """读取已完成日期的结果，返回{日期序号: 当天的事件列表}"""
+        try:
+            if not os.path.exists(self.checkpoint_path):
+                return {}
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            if checkpoint.get("key") != self.checkpoint_key():
+                print("检查点的搜索参数不同，重新搜索")
+                return {}
+            return {int(day): list(decode_almanac_value(events))
+                    for day, events in checkpoint.get("days", {}).items()}
+        except Exception as e:
+            print(f"读取检查点失败: {e}")
+            return {}
+    
+    def save_checkpoint(self, done):
+        """先写临时文件再替换，中途被打断时旧检查点仍然完整"""
+        try:
+            os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+            checkpoint = {
+                "key": self.checkpoint_key(),
+                "days": {str(day): encode_almanac_value(events) for day, events in done.items()}
+            }
+            temp_path = self.checkpoint_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(checkpoint, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temp_path, self.checkpoint_path)
+        except Exception as e:
+            print(f"保存检查点失败: {e}")
+    
+    @staticmethod
+    def event_kind(payload):
+        """事件的去重类型：搜索结果的附加信息为元组时取第一项（如月食类型代码、"rise"/"transit"）"""
+        return payload[0] if isinstance(payload, tuple) else payload
+    
+    def record_chunk(self, done, chunk_start, chunk_end, events):
+        """把一个分段的结果按天记入done：只保留分段本身范围内的事件（重叠区的事件由相邻分段记录）"""
+        days = self.chunk_day_range(chunk_start, chunk_end)
+        for day in days:
+            done[day] = []
+        last_chunk = chunk_end >= self.end
+        for event_time, payload in events:
+            if chunk_start <= event_time < chunk_end or (last_chunk and event_time == chunk_end):
+                day = min((event_time - self.start) // timedelta(days=1), days[-1])
+                done[day].append((event_time, payload))
+    
+    def merge(self, done):
+        """合并各日期的结果：按时间排序，重叠区内重复找到的同类事件只保留一个"""
+        events = sorted((event for chunk_events in done.values() for event in chunk_events),
+                        key=lambda event: event[0])
+        merged = []
+        last_seen = {}  # 类型 -> 最近保留的事件时间
+        for event_time, payload in events:
+            kind = self.event_kind(payload)
+            previous = last_seen.get(kind)
+            if previous is not None and (event_time - previous).total_seconds() < self.dedupe_seconds:
+                continue
+            last_seen[kind] = event_time
+            merged.append((event_time, payload))
+        return merged
+    
+    def run(self):
+        """执行搜索，返回合并后的[(UTC时间, 附加信息), ...]；全部完成后删除检查点"""
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        
+        chunks = self.chunks()
+        done = self.load_checkpoint()
+        # 分段内还有未完成的日期时整段重新搜索
+        pending = [index for index in range(len(chunks))
+                   if any(day not in done for day in self.chunk_day_range(*chunks[index]))]
+        print(f"{self.kind}: {self.start:%Y-%m-%d} 到 {self.end:%Y-%m-%d}，共{len(chunks)}段"
+              f"（每段{self.chunk_days}天），检查点中已完成{len(done)}天，待搜索{len(pending)}段，{self.workers}个进程")
+        
+        if pending:
+            # 先在本进程加载一次星历：文件不存在时只在这里下载一次，子进程直接打开本地文件
+            load_worker_ephemeris(download=True)
+            started = time.perf_counter()
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(pending)), mp_context=context) as pool:
+                futures = {pool.submit(run_almanac_chunk, self.method, self.chunk_args(*chunks[index])): index
+                           for index in pending}
+                for completed, future in enumerate(as_completed(futures), 1):
+                    index = futures[future]
+                    events = future.result()
+                    self.record_chunk(done, *chunks[index], events)
+                    self.save_checkpoint(done)
+                    print(f"分段 {completed}/{len(pending)} 完成（{chunks[index][0]:%Y-%m-%d}，"
+                          f"{len(events)}个事件，已用{time.perf_counter() - started:.1f}秒）")
+        
+        events = self.merge(done)
+        try:
+            os.remove(self.checkpoint_path)
+        except OSError:
+            pass
+        return events
+    
+    def describe(self, payload):
+        """事件的可读说明"""
+        if self.kind == "eclipses":
+            code, contacts, magnitude = payload
+            text = ECLIPSE_TYPES.get(code, f"未知食({code})")
+            return f"{text} 食分{magnitude}" if magnitude is not None else text
+        if self.kind == "phases":
+            return MOON_PHASE_NAMES[payload]
+        if self.kind == "rise-set":
+            return "月出" if payload == "rise" else "月落"
+        kind, value = payload
+        return f"{kind} {value}" if value is not None else kind
+
+# 故障注入测试（--fault-test）的故障配置：[(持续秒数, 故障参数), ...]，全部阶段结束后替身服务器恢复正常
+# 故障参数：latency 每个请求先等待的秒数；status 返回的HTTP状态码；reset 不响应直接断开连接；
+# slow_body 把响应体分散在多少秒内逐字节发送；garbage 返回HTML页面（如强制门户）；flap 每隔多少秒在正常与断开之间切换
+FAULT_PROFILES = {
+    "healthy": [],
+    "latency": [(20, {"latency": 2})],
+    "timeout": [(20, {"latency": 10})],
+    "errors": [(20, {"status": 503})],
+    "reset": [(20, {"reset": True})],
+    "slow_body": [(20, {"slow_body": 15})],
+    "captive_portal": [(20, {"garbage": True})],
+    "flapping": [(20, {"flap": 3})],
+    "outage_then_slow": [(10, {"reset": True}), (10, {"latency": 2.5})],
+}
+
+class NetworkStandIn:
+    """本地网络替身服务器 - 在127.0.0.1上模拟联网探测、公网IP和IP定位服务，并按故障配置注入延迟、错误、慢速响应和抖动"""
+    IP = "203.0.113.7"  # 文档保留地址，GeoLite2中查不到，定位总是落到ip_location服务
+    CITY = {"city": "Standin", "country_name": "Testland", "latitude": 12.5, "longitude": 45.5, "timezone": "UTC"}
+    
+    def __init__(self, phases):
+        self.phases = phases
+        self.started = None
+        self.requests = 0
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+    
+    @property
+    def fault_end(self):
+        """故障阶段结束的时间（单调时钟）"""
+        return self.started + sum(duration for duration, _ in self.phases)
+    
+    @property
+    def endpoints(self):
+        """指向本服务器的服务地址，写入配置文件的"endpoints" """
+        return {
+            "network_check": f"{self.url}/check",
+            "public_ip": [f"{self.url}/ip/{i}" for i in range(3)],
+            "ip_location": f"{self.url}/geo/{{ip}}/json/",
+        }
+    
+    def current_fault(self):
+        """返回(当前阶段的故障参数, 该阶段已持续的秒数)"""
+        elapsed = time.monotonic() - self.started
+        for duration, fault in self.phases:
+            if elapsed < duration:
+                return fault, elapsed
+            elapsed -= duration
+        return {}, elapsed
+    
+    def make_handler(self):
+        stand_in = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+            
+            def do_GET(self):
+                stand_in.requests += 1
+                fault, elapsed = stand_in.current_fault()
+                if fault.get("latency"):
+                    time.sleep(fault["latency"])
+                if fault.get("reset") or (fault.get("flap") and int(elapsed / fault["flap"]) % 2 == 1):
+                    self.close_connection = True
+                    return  # 不写响应，客户端看到连接被关闭
+                
+                if self.path == "/check":
+                    body = b"ok"
+                elif self.path.startswith("/ip/"):
+                    body = stand_in.IP.encode()
+                elif self.path.startswith("/geo/"):
+                    body = json.dumps(stand_in.CITY).encode()
+                else:
+                    self.send_error(404)
+                    return
+                if fault.get("garbage"):
+                    body = b"<html><body>Please log in to the network</body></html>"
+                
+                try:
+                    self.send_response(fault.get("status", 200))
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    if fault.get("slow_body"):
+                        for i in range(len(body)):
+                            self.wfile.write(body[i:i + 1])
+                            self.wfile.flush()
+                            time.sleep(fault["slow_body"] / len(body))
+                    else:
+                        self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客户端已超时放弃
+        
+        return Handler
+    
+    def start(self):
+        self.started = time.monotonic()
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def run_fault_test(names=None, recovery_timeout=60, settle_seconds=10):
+    """故障注入测试：对每个故障配置启动替身服务器，让一个无窗口的MoonWidget通过它联网并运行更新和网络监控线程，
+    测量最坏帧间隔（位置查询在更新线程中进行，联网卡住时画面停止刷新）和故障结束后恢复所需的时间
+    （网络在线且位置来自替身服务器）。恢复后再观察settle_seconds秒，确认帧间隔回到正常。
+    配置文件和快照写到临时目录，不影响正常使用的数据；测试期间不下载星历（只使用本地已有的de421.bsp），
+    除替身服务器外不访问真实网络。
+    
+    返回True表示所有配置都在recovery_timeout秒内恢复。
+    """
+    global CONFIG_PATH, SNAPSHOT_PATH
+    import tempfile
+    
+    class FrameRecorder:
+        """替代服务器模式的广播器，记录每帧的推送时间"""
+        def __init__(self):
+            self.times = []
+        
+        def publish(self, moon_data):
+            self.times.append(time.monotonic())
+    
+    saved_paths = (CONFIG_PATH, SNAPSHOT_PATH)
+    MoonWidget.ephemeris_download_enabled = False
+    results = {}
+    try:
+        for name in names or FAULT_PROFILES:
+            print(f"===== 故障配置: {name} {FAULT_PROFILES[name]} =====")
+            temp_dir = tempfile.mkdtemp(prefix="moon_widget_fault_")
+            CONFIG_PATH = os.path.join(temp_dir, 'moon_widget_config.json')
+            SNAPSHOT_PATH = os.path.join(temp_dir, 'moon_widget_snapshot.json')
+            stand_in = NetworkStandIn(FAULT_PROFILES[name])
+            with open(CONFIG_PATH, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "endpoints": stand_in.endpoints,
+                    "settings": {"refresh_mode": "fixed", "update_interval": 0.5, "location_check_interval": 2,
+                                 "network_check_interval": 1, "watchdog_timeout": 30}
+                }, f)
+            
+            stand_in.start()
+            widget = MoonWidget()
+            startup = time.monotonic() - stand_in.started
+            recorder = FrameRecorder()
+            widget.broadcaster = recorder
+            threads_started = time.monotonic()
+            widget.start_watched_threads()
+            
+            recovery = None
+            observe_until = stand_in.fault_end + recovery_timeout
+            while time.monotonic() < observe_until:
+                now = time.monotonic()
+                if (recovery is None and now >= stand_in.fault_end and widget.network_available and
+                        widget.location.get("name", "").startswith(NetworkStandIn.CITY["city"])):
+                    recovery = now - stand_in.fault_end
+                    observe_until = now + settle_seconds
+                time.sleep(0.1)
+            ended = time.monotonic()
+            widget.is_running = False
+            widget.watchdog.stop()
+            stand_in.stop()
+            
+            frame_times = [threads_started] + recorder.times + [ended]
+            worst_gap = max(later - earlier for earlier, later in zip(frame_times, frame_times[1:]))
+            results[name] = {
+                "startup": round(startup, 2),
+                "frames": len(recorder.times),
+                "worst_frame_delay": round(max(0, worst_gap - widget.update_interval), 2),
+                "recovery": None if recovery is None else round(recovery, 2),
+                "requests": stand_in.requests,
+                "stalls": sum(worker["stalls"] for worker in widget.watchdog.report().values())
+            }
+            print(f"结果: {results[name]}")
+    finally:
+        CONFIG_PATH, SNAPSHOT_PATH = saved_paths
+        MoonWidget.ephemeris_download_enabled = True
+    
+    print("故障配置            启动(秒)  帧数  最坏帧延迟(秒)  恢复(秒)  请求数  线程卡住")
+    for name, result in results.items():
+        recovery = "未恢复" if result["recovery"] is None else f"{result['recovery']:.2f}"
+        print(f"{name:<18}  {result['startup']:>8.2f}  {result['frames']:>4}  {result['worst_frame_delay']:>14.2f}  "
+              f"{recovery:>8}  {result['requests']:>6}  {result['stalls']:>8}")
+    return all(result["recovery"] is not None for result in results.values())
+
+def run_client(url):
+    """客户端模式 - 只打开窗口显示服务器模式推送的数据，本机不运行计算引擎"""
+    webview.create_window(
+        '月球位置',
+        url=url.rstrip('/') + '/moon_widget.html',
+        width=300,
+        height=960,
+        frameless=True,
+        easy_drag=True,
+        transparent=True,
+        focus=False
+    )
+    webview.start(debug=False)
+
+def get_cli_option(name, default=None):
+    """读取形如 --name value 的命令行参数"""
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv) and not sys.argv[index + 1].startswith("--"):
+            return sys.argv[index + 1]
+        return default
+    return None
+
 if __name__ == '__main__':
+    # 诊断命令：负载构建微基准
+    if "--bench-payload" in sys.argv:
+        benchmark_payload()
+        sys.exit(0)
+    
+    # 诊断命令：校验配置文件并打印生效的配置项
+    if "--check-config" in sys.argv:
+        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+            settings, errors = validate_settings(json.load(f), get_cli_option("--profile"))
+        for error in errors:
+            print(f"配置错误: {error}")
+        print(json.dumps(settings, ensure_ascii=False, indent=2))
+        sys.exit(1 if errors else 0)
+    
+    # 诊断命令：打印当前电源/空闲状态和各省电档位的每分钟唤醒次数
+    if "--power-report" in sys.argv:
+        config = {}
+        if os.path.exists(CONFIG_PATH):
+            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        settings, _ = validate_settings(config, get_cli_option("--profile"))
+        manager = PowerManager(lambda mode: None)
+        manager.configure(settings)
+        on_battery, percent = manager.read_battery()
+        idle_seconds = manager.read_idle_seconds()
+        print(f"电池: {on_battery}, 电量: {percent}, 空闲: {idle_seconds}秒, "
+              f"档位: {manager.decide_mode(on_battery, percent, idle_seconds)}")
+        manager.print_report(settings)
+        sys.exit(0)
+    
+    # 诊断命令：长时间范围并行搜索（中断后重新运行可从检查点继续）
+    # python moon_widget.py --almanac eclipses --from 1900-01-01 --to 2050-01-01 [--workers 8] [--output eclipses.json]
+    # python moon_widget.py --almanac rise-set --location 31.23,121.47 --from 2026-01-01 --to 2027-01-01
+    almanac_kind = get_cli_option("--almanac", "eclipses")
+    if almanac_kind:
+        def parse_utc(value, default):
+            if not value:
+                return default
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+        
+        start = parse_utc(get_cli_option("--from"), datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0))
+        end = parse_utc(get_cli_option("--to"), start + timedelta(days=365))
+        location = None
+        if get_cli_option("--location"):
+            latitude, _, longitude = get_cli_option("--location").partition(",")
+            location = {"latitude": float(latitude), "longitude": float(longitude)}
+        workers = get_cli_option("--workers")
+        chunk_days = get_cli_option("--chunk-days")
+        runner = AlmanacRunner(almanac_kind, start, end, location,
+                               workers=int(workers) if workers else None,
+                               chunk_days=int(chunk_days) if chunk_days else None)
+        events = runner.run()
+        output_path = get_cli_option("--output")
+        if output_path:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump(encode_almanac_value(events), f, ensure_ascii=False, indent=1)
+            print(f"{len(events)}个事件已写入 {output_path}")
+        else:
+            for event_time, payload in events:
+                print(f"{event_time:%Y-%m-%d %H:%M:%S} UTC  {runner.describe(payload)}")
+        sys.exit(0)
+    
+    # 诊断命令：浸泡测试，python moon_widget.py --soak 72 [--rate 3600] [--memory-budget 300]（不打开窗口）
+    soak_hours = get_cli_option("--soak", "72")
+    if soak_hours:
+        widget = MoonWidget(get_cli_option("--profile"))
+        if get_cli_option("--location"):
+            latitude, _, longitude = get_cli_option("--location").partition(",")
+            widget.set_manual_location(latitude, longitude, persist=False)
+        passed = widget.run_soak(float(soak_hours), float(get_cli_option("--rate", "3600") or 3600),
+                                 float(get_cli_option("--memory-budget", "300") or 300))
+        sys.exit(0 if passed else 1)
+    
+    # 诊断命令：故障注入测试，python moon_widget.py --fault-test [配置名,配置名]（配置见FAULT_PROFILES）
+    fault_profiles = get_cli_option("--fault-test", "all")
+    if fault_profiles:
+        names = None if fault_profiles == "all" else fault_profiles.split(",")
+        sys.exit(0 if run_fault_test(names) else 1)
+    
+    # 模拟模式：python moon_widget.py --simulate 2025-09-07T18:00:00Z --rate 1000
+    simulate_start = get_cli_option("--simulate", "")
+    simulate_rate = float(get_cli_option("--rate", "1") or 1)
+    
+    # 手动坐标：python moon_widget.py --location 31.23,121.47（名称和时区由离线城市索引推断，只在本次运行中使用，不写入配置文件）
+    manual_coordinates = get_cli_option("--location")
+    
+    # 性能配置：python moon_widget.py --profile low_power（覆盖配置文件中的"profile"）
+    profile = get_cli_option("--profile")
+    
+    def create_widget():
+        widget = MoonWidget(profile)
+        if manual_coordinates:
+            latitude, _, longitude = manual_coordinates.partition(",")
+            widget.set_manual_location(latitude, longitude, persist=False)
+        if simulate_start is not None:
+            widget.set_simulation(simulate_start or None, simulate_rate)
+        return widget
+    
+    # 服务器模式：python moon_widget.py --server [host:port]
+    server_address = get_cli_option("--server", "0.0.0.0:8765")
+    if server_address:
+        host, _, port = server_address.rpartition(":")
+        create_widget().run_server(host or "0.0.0.0", int(port))
+        sys.exit(0)
+    
+    # 客户端模式：python moon_widget.py --connect http://server:8765
+    server_url = get_cli_option("--connect")
+    if server_url:
+        run_client(server_url)
+        sys.exit(0)
+    
     # 如果设置了隐藏控制台，则尝试隐藏
     if HIDE_CONSOLE:
         hide_console_window()
@@ -1464,9 +4987,9 @@ if __name__ == '__main__':
     # 设置为后台运行，不显示控制台窗口
     if sys.executable.endswith("pythonw.exe"):
         # 如果使用pythonw运行，已经是后台模式
-        widget = MoonWidget()
+        widget = create_widget()
         widget.run()
     else:
         # 如果使用python运行，根据全局变量决定是否隐藏控制台
-        widget = MoonWidget()
+        widget = create_widget()
         widget.run()
\ No newline at end of file
@@ -0,0 +1,714 @@
+// 渲染层：缓存元素引用，写入先进入队列，在requestAnimationFrame中批量提交，且只写入发生变化的值
+const elementCache = {};
+const writtenValues = new Map();  // "id|属性" -> 上次写入的值
+const pendingWrites = new Map();  // "id|属性" -> [元素, 属性, 值]
+let flushScheduled = false;
+const renderStats = {frames: 0, totalMs: 0, maxMs: 0, writes: 0, skipped: 0, updates: 0, updateMs: 0};
+
+function el(id) {
+    let element = elementCache[id];
+    if (!element) {
+        element = document.getElementById(id);
+        elementCache[id] = element;
+    }
+    return element;
+}
+
+function queueWrite(element, key, prop, value) {
+    if (writtenValues.get(key) === value) {
+        pendingWrites.delete(key);
+        renderStats.skipped++;
+        return;
+    }
+    pendingWrites.set(key, [element, prop, value]);
+    if (!flushScheduled) {
+        flushScheduled = true;
+        requestAnimationFrame(flushWrites);
+    }
+}
+
+function setText(id, text) {
+    queueWrite(el(id), id + '|text', 'textContent', text);
+}
+
+function setClass(id, className) {
+    queueWrite(el(id), id + '|class', 'className', className);
+}
+
+function setDisplay(id, display) {
+    queueWrite(el(id), id + '|display', 'display', display);
+}
+
+function flushWrites() {
+    flushScheduled = false;
+    if (!pendingWrites.size) return;
+    const start = performance.now();
+    pendingWrites.forEach(([element, prop, value], key) => {
+        if (prop === 'display') element.style.display = value;
+        else element[prop] = value;
+        writtenValues.set(key, value);
+    });
+    renderStats.writes += pendingWrites.size;
+    pendingWrites.clear();
+    const elapsed = performance.now() - start;
+    renderStats.frames++;
+    renderStats.totalMs += elapsed;
+    renderStats.maxMs = Math.max(renderStats.maxMs, elapsed);
+}
+
+// 渲染耗时统计：批量写入耗时、数据更新耗时（含脚本和样式计算）及跳过的无变化写入
+function moonRenderStats() {
+    return {
+        frames: renderStats.frames,
+        avgFlushMs: renderStats.frames ? renderStats.totalMs / renderStats.frames : 0,
+        maxFlushMs: renderStats.maxMs,
+        updates: renderStats.updates,
+        avgUpdateMs: renderStats.updates ? renderStats.updateMs / renderStats.updates : 0,
+        writes: renderStats.writes,
+        skippedWrites: renderStats.skipped
+    };
+}
+window.moonRenderStats = moonRenderStats;
+
+// 长任务（>50ms）会造成掉帧，支持时在控制台报告
+if (window.PerformanceObserver && PerformanceObserver.supportedEntryTypes &&
+        PerformanceObserver.supportedEntryTypes.includes('longtask')) {
+    new PerformanceObserver(list => {
+        list.getEntries().forEach(entry => console.log(`长任务: ${entry.duration.toFixed(1)}ms`));
+    }).observe({entryTypes: ['longtask']});
+}
+
+// 调试开关：在开发者工具中执行 localStorage.setItem('moonRenderDebug', '1') 后重新加载页面，每分钟输出一次渲染统计
+let renderDebug = false;
+try {
+    renderDebug = window.localStorage.getItem('moonRenderDebug') === '1';
+} catch (e) {
+    // 部分WebView禁用了localStorage
+}
+if (renderDebug) {
+    setInterval(() => {
+        const stats = moonRenderStats();
+        if (stats.updates) {
+            console.log(`渲染统计: 数据更新平均 ${stats.avgUpdateMs.toFixed(3)}ms, 批量写入平均 ${stats.avgFlushMs.toFixed(3)}ms ` +
+                `(最大 ${stats.maxFlushMs.toFixed(3)}ms), 写入 ${stats.writes} 次, 跳过无变化写入 ${stats.skippedWrites} 次`);
+        }
+    }, 60000);
+}
+
+// 旧写法的一帧：每次重新查找元素、无条件写入文本和类名、整段重建日月食列表（仅用于moonRenderBenchmark对比）
+function legacyRenderFrame(data) {
+    const texts = {
+        'location': data.location, 'longitude': data.longitude, 'latitude': data.latitude, 'timezone': data.timezone,
+        'first-event-label': data.first_event + ':', 'first-event-time': data.first_time,
+        'second-event-label': data.second_event + ':', 'second-event-time': data.second_time,
+        'transit-time': data.transit_time || '--', 'max-altitude': data.max_altitude || '--',
+        'viewing-window': data.viewing_window || '--', 'visibility': data.visibility,
+        'last-update': `最后更新: ${new Date().toLocaleTimeString()}`
+    };
+    if (typeof data.ra === 'number') {
+        Object.assign(texts, {
+            'ra': `${data.ra.toFixed(2)}时`, 'dec': `${data.dec.toFixed(2)}°`, 'distance': `${data.distance.toFixed(0)} km`,
+            'altitude': `${data.altitude.toFixed(1)}°`, 'azimuth': `${data.azimuth.toFixed(1)}°`
+        });
+    }
+    Object.keys(texts).forEach(id => {
+        document.getElementById(id).textContent = texts[id];
+    });
+    const visibilityEl = document.getElementById('visibility-container');
+    visibilityEl.className = 'visibility';
+    visibilityEl.className = 'visibility ' + (data.visibility === '可见' ? 'visible' : 'not-visible');
+
+    const days = data.eclipse_days || 7;
+    const eclipses = data.eclipses || [];
+    document.getElementById('eclipse-header').textContent = `未来${days}天日月食`;
+    let html = eclipses.length ? '' : `<div class="no-eclipse">未来${days}天内无日月食</div>`;
+    eclipses.forEach(eclipse => {
+        const contacts = (eclipse.contacts || []).map(c => `${c.name} ${c.time}`).join(' · ');
+        html += `<div class="eclipse-item"><span class="eclipse-time">${eclipse.is_lunar ? '🌙' : '☀️'} ${eclipse.time}</span>` +
+            `<span class="eclipse-type">${eclipse.type}</span></div>` +
+            `<div class="eclipse-detail">食分 ${eclipse.magnitude} · ${eclipse.visible ? '本地可见' : '本地不可见'}<br>${contacts}</div>`;
+    });
+    document.getElementById('eclipse-list').innerHTML = html;
+}
+
+// 每帧耗时对比：用最近一次收到的数据，分别按旧写法和渲染层重复更新同样的数据，
+// 每帧读取offsetHeight强制同步完成样式计算和布局，用performance.now()计时（含脚本、样式和布局）
+function moonRenderBenchmark(frames = 200) {
+    const data = lastMoonData;
+    if (!data) {
+        console.log('尚未收到数据，无法对比');
+        return null;
+    }
+    function measure(frame) {
+        frame();
+        void document.body.offsetHeight;  // 预热（渲染层首帧需要创建列表节点）
+        let total = 0, max = 0;
+        for (let i = 0; i < frames; i++) {
+            const start = performance.now();
+            frame();
+            void document.body.offsetHeight;
+            const elapsed = performance.now() - start;
+            total += elapsed;
+            max = Math.max(max, elapsed);
+        }
+        return {avgMs: total / frames, maxMs: max};
+    }
+    const legacy = measure(() => legacyRenderFrame(data));
+    // 旧写法绕过了渲染层：清空已写入值和列表节点记录，让渲染层重新接管
+    writtenValues.clear();
+    el('eclipse-list')._keyedNodes = null;
+    el('eclipse-list').textContent = '';
+    const layer = measure(() => {
+        updateMoonData(data);
+        flushWrites();
+    });
+    console.log(`每帧耗时: 旧写法平均 ${legacy.avgMs.toFixed(3)}ms（最大 ${legacy.maxMs.toFixed(3)}ms），` +
+        `渲染层平均 ${layer.avgMs.toFixed(3)}ms（最大 ${layer.maxMs.toFixed(3)}ms）`);
+    return {legacy, layer};
+}
+window.moonRenderBenchmark = moonRenderBenchmark;
+
+// 按键对比列表：只新增、删除或修改变化的行，未变化的行保持原DOM节点
+function reconcileList(container, items, keyOf, create, update) {
+    const existing = container._keyedNodes || new Map();
+    const next = new Map();
+    let cursor = container.firstChild;
+    items.forEach(item => {
+        const key = keyOf(item);
+        let entry = existing.get(key);
+        if (!entry) {
+            entry = {nodes: create(item), signature: null};
+        }
+        const signature = JSON.stringify(item);
+        if (entry.signature !== signature) {
+            update(entry.nodes, item);
+            entry.signature = signature;
+        }
+        next.set(key, entry);
+        // 只有位置不对时才移动节点
+        entry.nodes.forEach(node => {
+            if (node === cursor) cursor = cursor.nextSibling;
+            else container.insertBefore(node, cursor);
+        });
+    });
+    // 已排好的行都在cursor之前，之后的节点是被删除的行或不由列表管理的节点（如"加载中"提示）
+    while (cursor) {
+        const following = cursor.nextSibling;
+        cursor.remove();
+        cursor = following;
+    }
+    existing.forEach((entry, key) => {
+        if (!next.has(key)) entry.nodes.forEach(node => node.remove());
+    });
+    container._keyedNodes = next;
+}
+
+function createElement(tag, className) {
+    const element = document.createElement(tag);
+    if (className) element.className = className;
+    return element;
+}
+
+function updateEclipseData(eclipses, days) {
+    setText('eclipse-header', `未来${days}天日月食`);
+    const eclipseList = el('eclipse-list');
+
+    if (eclipses.length === 0) {
+        eclipses = [{empty: true, text: `未来${days}天内无日月食`}];
+    }
+
+    reconcileList(eclipseList, eclipses,
+        eclipse => eclipse.empty ? 'empty' : `${eclipse.is_lunar}|${eclipse.time}|${eclipse.type}`,
+        eclipse => {
+            if (eclipse.empty) return [createElement('div', 'no-eclipse')];
+            const item = createElement('div', 'eclipse-item');
+            item.appendChild(createElement('span', 'eclipse-time'));
+            item.appendChild(createElement('span', 'eclipse-type'));
+            return [item, createElement('div', 'eclipse-detail')];
+        },
+        (nodes, eclipse) => {
+            if (eclipse.empty) {
+                nodes[0].textContent = eclipse.text;
+                return;
+            }
+            const icon = eclipse.is_lunar ? '🌙' : '☀️';
+            const contacts = (eclipse.contacts || []).map(c => `${c.name} ${c.time}`).join(' · ');
+            nodes[0].firstChild.textContent = `${icon} ${eclipse.time}`;
+            nodes[0].lastChild.textContent = eclipse.type;
+            const detail = nodes[1];
+            detail.textContent = `食分 ${eclipse.magnitude} · ${eclipse.visible ? '本地可见' : '本地不可见'}`;
+            detail.appendChild(document.createElement('br'));
+            detail.appendChild(document.createTextNode(contacts));
+        });
+}
+
+function updateWatchlist(rows) {
+    setDisplay('watchlist-section', rows.length ? 'block' : 'none');
+    if (!rows.length) return;
+
+    reconcileList(el('watchlist'), rows.map(row => ({
+            name: row.name,
+            position: `${row.altitude.toFixed(1)}° / ${row.azimuth.toFixed(1)}°`,
+            next: `${row.next_event} ${row.next_time}`
+        })),
+        row => row.name,
+        () => {
+            const line = createElement('div', 'watch-row');
+            line.appendChild(createElement('span', 'label'));
+            line.appendChild(createElement('span'));
+            line.appendChild(createElement('span'));
+            return [line];
+        },
+        (nodes, row) => {
+            const spans = nodes[0].children;
+            spans[0].textContent = row.name;
+            spans[1].textContent = row.position;
+            spans[2].textContent = row.next;
+        });
+}
+
+// 页面本地走时，Python端无需每秒推送时间
+let clockOffsetMinutes = null;
+// 时钟基准：Python端时间戳、收到时的本地时间和倍速（模拟模式下倍速不为1）
+let clockBase = null;
+
+function currentTimeMs() {
+    if (!clockBase) return Date.now();
+    return clockBase.timestamp + (Date.now() - clockBase.received) * clockBase.rate;
+}
+
+function pad2(n) {
+    return String(n).padStart(2, '0');
+}
+
+function tickClock() {
+    if (clockOffsetMinutes === null) return;
+    const d = new Date(currentTimeMs() + clockOffsetMinutes * 60000);
+    setText('time',
+        `${d.getUTCFullYear()}-${pad2(d.getUTCMonth() + 1)}-${pad2(d.getUTCDate())} ` +
+        `${pad2(d.getUTCHours())}:${pad2(d.getUTCMinutes())}:${pad2(d.getUTCSeconds())}`);
+    // 轨迹图当前位置标记每分钟移动一次
+    drawSkyTrack(false);
+}
+
+setInterval(tickClock, 1000);
+
+// 关键帧插值：插值高度角、方位角等，只在下一位显示数字变化时醒来（而不是每个显示帧）
+const azimuthDirections = ["北", "东北", "东", "东南", "南", "西南", "西", "西北"];
+// 各字段的显示精度，与renderPosition中的toFixed一致
+const displaySteps = {ra: 0.01, dec: 0.01, distance: 1, altitude: 0.1, azimuth: 0.1};
+const minKeyframeDelayMs = 50;
+const maxKeyframeDelayMs = 10000;
+let keyframe = null;
+let keyframeTimer = null;
+let keyframeFramePending = false;
+
+function lerp(a, b, f) {
+    return a + (b - a) * f;
+}
+
+function angleDelta(a, b, period) {
+    return ((b - a) % period + period * 1.5) % period - period / 2;
+}
+
+function lerpAngle(a, b, f, period) {
+    return ((a + angleDelta(a, b, period) * f) % period + period) % period;
+}
+
+// 按当前变化速率（每毫秒真实时间）计算距离显示值四舍五入进位的毫秒数，与后端time_to_next_digit一致
+function msToNextDigit(value, ratePerMs, step) {
+    if (!ratePerMs) return Infinity;
+    const x = value / step;
+    const boundary = ratePerMs > 0 ? Math.floor(x + 0.5) + 0.5 : Math.ceil(x - 0.5) - 0.5;
+    return Math.abs((boundary * step - value) / ratePerMs);
+}
+
+function scheduleKeyframeRender(delay) {
+    clearTimeout(keyframeTimer);
+    keyframeTimer = setTimeout(() => {
+        keyframeTimer = null;
+        if (!keyframeFramePending) {
+            keyframeFramePending = true;
+            requestAnimationFrame(renderKeyframe);
+        }
+    }, delay);
+}
+
+function setVisibility(visibility) {
+    setText('visibility', visibility);
+    let cls = 'unknown';
+    if (visibility === '可见') cls = 'visible';
+    else if (visibility === '不可见') cls = 'not-visible';
+    setClass('visibility-container', 'visibility ' + cls);
+}
+
+// 月球位置以数值下发，在页面中格式化（占位数据为字符串时原样显示）
+function renderPosition(pos) {
+    if (typeof pos.ra !== 'number') {
+        setText('ra', pos.ra);
+        setText('dec', pos.dec);
+        setText('distance', pos.distance);
+        setText('altitude', pos.altitude);
+        setText('azimuth', pos.azimuth);
+        return;
+    }
+    const direction = azimuthDirections[Math.round(pos.azimuth / 45) % 8];
+    setText('ra', `${pos.ra.toFixed(2)}时`);
+    setText('dec', `${pos.dec.toFixed(2)}°`);
+    setText('distance', `${pos.distance.toFixed(0)} km`);
+    setText('altitude', `${pos.altitude.toFixed(1)}°`);
+    setText('azimuth', `${pos.azimuth.toFixed(1)}° (${direction})`);
+}
+
+function renderKeyframe() {
+    keyframeFramePending = false;
+    if (!keyframe) return;
+    const f = (currentTimeMs() - keyframe.t0) / (keyframe.t1 - keyframe.t0);
+    const p0 = keyframe.p0, p1 = keyframe.p1;
+    const pos = {
+        ra: lerpAngle(p0.ra, p1.ra, f, 24),
+        dec: lerp(p0.dec, p1.dec, f),
+        distance: lerp(p0.distance, p1.distance, f),
+        altitude: lerp(p0.altitude, p1.altitude, f),
+        azimuth: lerpAngle(p0.azimuth, p1.azimuth, f, 360)
+    };
+    renderPosition(pos);
+    setVisibility(pos.altitude > 0 ? '可见' : '不可见');
+    // 已在动画帧内，直接提交本帧的写入
+    flushWrites();
+
+    // 下一次在最先变化的显示数字进位时醒来
+    const span = (keyframe.t1 - keyframe.t0) / clockBase.rate;
+    const deltas = {
+        ra: angleDelta(p0.ra, p1.ra, 24),
+        dec: p1.dec - p0.dec,
+        distance: p1.distance - p0.distance,
+        altitude: p1.altitude - p0.altitude,
+        azimuth: angleDelta(p0.azimuth, p1.azimuth, 360)
+    };
+    let delay = maxKeyframeDelayMs;
+    for (const name in displaySteps) {
+        delay = Math.min(delay, msToNextDigit(pos[name], deltas[name] / span, displaySteps[name]));
+    }
+    scheduleKeyframeRender(Math.max(minKeyframeDelayMs, delay));
+}
+
+function updateMoonKeyframe(frame) {
+    keyframe = frame;
+    if (keyframe) {
+        scheduleKeyframeRender(0);
+    } else {
+        clearTimeout(keyframeTimer);
+        keyframeTimer = null;
+    }
+}
+
+// 月球轨迹图：轨迹只在轨迹键变化时获取一次，曲线缓存为Path2D，之后只重画当前位置标记
+let skyTrack = null;
+let skyTrackKey = null;
+let skyTrackPath = null;
+let skyTrackMarkerMinute = null;
+
+function fetchSkyTrack() {
+    // 页面由本地服务器提供时直接请求接口，否则走pywebview接口
+    return fetch('api/moon_track')
+        .then(response => response.json())
+        .catch(() => (window.pywebview && window.pywebview.api) ? window.pywebview.api.get_moon_track() : null);
+}
+
+function updateSkyTrack(key) {
+    if (key === skyTrackKey) return;
+    skyTrackKey = key;
+    if (!key) {
+        skyTrack = null;
+        drawSkyTrack(true);
+        return;
+    }
+    fetchSkyTrack().then(track => {
+        skyTrack = track;
+        skyTrackPath = null;
+        drawSkyTrack(true);
+    });
+}
+
+function trackX(canvas, time) {
+    return (time - skyTrack.start) / (skyTrack.end - skyTrack.start) * canvas.width;
+}
+
+function trackY(canvas, altitude) {
+    // 地平线在底部，天顶在顶部
+    return canvas.height - 4 - Math.max(altitude, 0) / 90 * (canvas.height - 8);
+}
+
+function drawSkyTrack(force) {
+    const canvas = el('sky-track');
+    if (!canvas) return;
+    const minute = Math.floor(currentTimeMs() / 60000);
+    if (!force && minute === skyTrackMarkerMinute) return;
+    skyTrackMarkerMinute = minute;
+
+    const ctx = canvas.getContext('2d');
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    if (!skyTrack) return;
+
+    if (!skyTrackPath) {
+        skyTrackPath = new Path2D();
+        skyTrack.times.forEach((time, i) => {
+            const x = trackX(canvas, time), y = trackY(canvas, skyTrack.altitude[i]);
+            if (i === 0) skyTrackPath.moveTo(x, y);
+            else skyTrackPath.lineTo(x, y);
+        });
+    }
+
+    // 地平线
+    ctx.strokeStyle = 'rgba(255, 255, 255, 0.2)';
+    ctx.beginPath();
+    ctx.moveTo(0, canvas.height - 4);
+    ctx.lineTo(canvas.width, canvas.height - 4);
+    ctx.stroke();
+
+    ctx.strokeStyle = '#aaccff';
+    ctx.stroke(skyTrackPath);
+
+    // 当前位置标记（按时间线性插值高度角）
+    const now = currentTimeMs();
+    if (now >= skyTrack.start && now <= skyTrack.end && skyTrack.times.length >= 2) {
+        // 第一个晚于当前时间的采样；找不到时当前时间正好是最后一个采样，落在最后一段
+        const next = skyTrack.times.findIndex(t => t > now);
+        const i = next === -1 ? skyTrack.times.length - 2 : Math.max(0, next - 1);
+        const f = (now - skyTrack.times[i]) / (skyTrack.times[i + 1] - skyTrack.times[i]);
+        const altitude = lerp(skyTrack.altitude[i], skyTrack.altitude[i + 1], f);
+        ctx.fillStyle = 'gold';
+        ctx.beginPath();
+        ctx.arc(trackX(canvas, now), trackY(canvas, altitude), 3, 0, Math.PI * 2);
+        ctx.fill();
+    }
+}
+
+// 月面：亮面路径只与亮面比例有关，按比例缓存为Path2D；亮边方向用画布旋转实现，两者都不变时不重画
+const moonLitPaths = new Map();
+let moonDiscKey = null;
+
+function moonLitPath(r, k) {
+    let path = moonLitPaths.get(k);
+    if (path) return path;
+    // 亮边朝+x方向：亮边半圆 + 明暗界线（半椭圆，短半轴为r·|1-2k|），娥眉月时界线凸向亮边，凸月时凸向暗边
+    path = new Path2D();
+    path.arc(0, 0, r, -Math.PI / 2, Math.PI / 2, false);
+    path.ellipse(0, 0, Math.abs(1 - 2 * k) * r, r, 0, Math.PI / 2, -Math.PI / 2, k < 0.5);
+    path.closePath();
+    if (moonLitPaths.size > 64) moonLitPaths.clear();
+    moonLitPaths.set(k, path);
+    return path;
+}
+
+function signed(value) {
+    return (value >= 0 ? '+' : '') + value.toFixed(1);
+}
+
+function drawMoonDisc(disc) {
+    if (!disc) {
+        setDisplay('moon-disc', 'none');
+        setDisplay('moon-disc-info', 'none');
+        setDisplay('moon-phase', 'block');
+        return;
+    }
+    setDisplay('moon-phase', 'none');
+    setDisplay('moon-disc', 'block');
+    setDisplay('moon-disc-info', 'block');
+    setText('moon-disc-info', `亮面 ${(disc.illumination * 100).toFixed(1)}% · ` +
+        `天平动 经${signed(disc.libration_lon)}° 纬${signed(disc.libration_lat)}°`);
+
+    const key = `${disc.illumination}|${disc.limb_angle}`;
+    if (key === moonDiscKey) return;
+    moonDiscKey = key;
+
+    const canvas = el('moon-disc');
+    const ctx = canvas.getContext('2d');
+    const r = canvas.width / 2 - 2;
+    ctx.setTransform(1, 0, 0, 1, 0, 0);
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.translate(canvas.width / 2, canvas.height / 2);
+
+    // 暗面
+    ctx.fillStyle = 'rgba(60, 70, 90, 0.8)';
+    ctx.beginPath();
+    ctx.arc(0, 0, r, 0, Math.PI * 2);
+    ctx.fill();
+
+    // 亮边方向：limb_angle为相对天顶逆时针的角度（面向月球时东在左），旋转画布使+x指向亮边
+    const p = disc.limb_angle * Math.PI / 180;
+    ctx.rotate(Math.atan2(-Math.cos(p), -Math.sin(p)));
+    ctx.fillStyle = '#f4f1de';
+    ctx.fill(moonLitPath(r, disc.illumination));
+}
+
+// 页面可见性变化时通知Python端调整刷新频率
+document.addEventListener('visibilitychange', function() {
+    if (window.pywebview && window.pywebview.api && window.pywebview.api.set_page_visible) {
+        window.pywebview.api.set_page_visible(document.visibilityState === 'visible');
+    }
+});
+
+let lastMoonData = null;  // 最近一次收到的数据，供moonRenderBenchmark使用
+
+function updateMoonData(data) {
+    const start = performance.now();
+    lastMoonData = data;
+
+    // 隐藏加载提示
+    setDisplay('loading', 'none');
+
+    // 显示或隐藏Skyfield错误信息
+    if (data.skyfield_available) {
+        setDisplay('skyfield-error', 'none');
+    } else {
+        setDisplay('skyfield-error', 'block');
+        setText('skyfield-error', data.skyfield_error || 'Skyfield不可用，部分功能受限');
+    }
+
+    // 热启动快照中的数据标记为过期，收到实时数据后恢复正常显示
+    if (data.stale) {
+        setDisplay('stale-notice', 'block');
+        setText('stale-notice', `显示上次保存的数据（${data.snapshot_time || '--'}），正在更新…`);
+    } else {
+        setDisplay('stale-notice', 'none');
+    }
+    queueWrite(document.body, 'body|class', 'className', data.stale ? 'stale' : '');
+
+    setText('location', data.location);
+    setText('longitude', data.longitude);
+    setText('latitude', data.latitude);
+    setText('timezone', data.timezone);
+    if (typeof data.utc_offset === 'number') {
+        clockOffsetMinutes = data.utc_offset;
+        clockBase = {
+            timestamp: data.timestamp,
+            received: Date.now(),
+            rate: typeof data.clock_rate === 'number' ? data.clock_rate : 1
+        };
+        tickClock();
+    } else if (data.time) {
+        setText('time', data.time);
+    }
+    renderPosition(data);
+
+    // 更新月出月落事件显示
+    setText('first-event-label', data.first_event + ':');
+    setText('first-event-time', data.first_time);
+    setText('second-event-label', data.second_event + ':');
+    setText('second-event-time', data.second_time);
+    setText('transit-time', data.transit_time || '--');
+    setText('max-altitude', data.max_altitude || '--');
+    setText('viewing-window', data.viewing_window || '--');
+
+    // 更新可见性及样式
+    setVisibility(data.visibility);
+
+    // 月球轨迹（键变化时才重新获取）及当前位置标记
+    updateSkyTrack(data.track_key || null);
+    drawSkyTrack(false);
+
+    // 关键帧模式：位置由本地插值接管
+    updateMoonKeyframe(data.keyframe || null);
+
+    // 更新月相表情
+    const phase = parseFloat(data.phase);
+    let moonEmoji = '🌑'; // 新月
+    if (phase > 0.9375 || phase <= 0.0625) moonEmoji = '🌑'; // 新月
+    else if (phase <= 0.1875) moonEmoji = '🌒'; // 娥眉月
+    else if (phase <= 0.3125) moonEmoji = '🌓'; // 上弦月
+    else if (phase <= 0.4375) moonEmoji = '🌔'; // 盈凸月
+    else if (phase <= 0.5625) moonEmoji = '🌕'; // 满月
+    else if (phase <= 0.6875) moonEmoji = '🌖'; // 亏凸月
+    else if (phase <= 0.8125) moonEmoji = '🌗'; // 下弦月
+    else if (phase <= 0.9375) moonEmoji = '🌘'; // 残月
+
+    setText('moon-phase', moonEmoji);
+    drawMoonDisc(data.disc || null);
+
+    // 更新月食信息（列表内容不变时不触碰DOM）
+    updateEclipseData(data.eclipses || [], data.eclipse_days || 7);
+
+    // 更新关注城市
+    updateWatchlist(data.watchlist || []);
+
+    // 更新最后更新时间
+    const now = new Date();
+    setText('last-update', `最后更新: ${now.toLocaleTimeString()}`);
+    // 更新网络状态
+    updateNetworkStatus(data.online);
+
+    renderStats.updates++;
+    renderStats.updateMs += performance.now() - start;
+}
+
+function updateNetworkStatus(online) {
+    if (online) {
+        setText('network-status', '● 在线');
+        setClass('network-status', 'network-status online');
+    } else {
+        setText('network-status', '● 离线 (使用缓存位置)');
+        setClass('network-status', 'network-status offline');
+    }
+}
+
+function toggleTopmost() {
+    // 浏览器中（服务器模式）没有置顶接口
+    if (!(window.pywebview && window.pywebview.api)) return;
+    const btn = document.getElementById('topmost-btn');
+    // 先立即更新UI状态，让用户有即时反馈
+    const isCurrentlyPinned = btn.classList.contains('pinned');
+    btn.classList.toggle('pinned', !isCurrentlyPinned);
+
+    // 然后调用API设置实际状态
+    window.pywebview.api.set_topmost(!isCurrentlyPinned).then(function(success) {
+        if (!success) {
+            // 如果操作失败，恢复原来的状态
+            btn.classList.toggle('pinned', isCurrentlyPinned);
+            console.log('置顶操作失败');
+        }
+    });
+}
+
+function hideLoading() {
+    setDisplay('loading', 'none');
+}
+
+function closeApp() {
+    if (window.pywebview && window.pywebview.api && window.pywebview.api.close_app) {
+        window.pywebview.api.close_app();
+    } else {
+        window.close();
+    }
+}
+
+// 服务器模式：通过Server-Sent Events接收数据，断线后浏览器会自动重连
+if (window.moonStreamUrl && window.EventSource) {
+    const source = new EventSource(window.moonStreamUrl);
+    source.onmessage = function(event) {
+        updateMoonData(JSON.parse(event.data));
+    };
+}
+
+// 初始显示 - 优先使用bootstrap.js随页面下发的首帧数据，无需等待第一次updateMoonData推送
+updateMoonData(window.initialMoonData || {
+    location: "获取中...",
+    longitude: "--",
+    latitude: "--",
+    timezone: "--",
+    time: "--:--:--",
+    ra: "--",
+    dec: "--",
+    distance: "--",
+    azimuth: "--",
+    altitude: "--",
+    first_event: "月出",
+    first_time: "--",
+    second_event: "月落",
+    second_time: "--",
+    visibility: "--",
+    phase: 0,
+    skyfield_available: true,
+    eclipses: []
+});